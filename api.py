@@ -0,0 +1,253 @@
+"""
+api.py - Bearer tokens and batch ingestion for the JSON API
+
+Instruments and scripts post test results in batches of up to thousands
+of items to /api/v1/test-results:batch:
+
+    {"items": [{"key": "rig4-2024-05-01-0001", "sample_id": "S-001",
+                "test_name": "Compressive Strength", "raw_values": "450,22500",
+                "date_tested": "2024-05-01T10:30:00"}, ...]}
+
+Every item carries a client-supplied idempotency `key` (unique per user).
+A batch is handled in one transaction:
+
+1. items are checked one by one (shape, raw values, dates);
+2. one query finds keys already ingested and one resolves the sample IDs;
+3. results are calculated per test kind with the vectorized formulas
+   (bulk_import.calculate) before anything is written;
+4. tests, measurements and keys are written with executemany inserts,
+   the dashboard counters and search index are updated, and the batch is
+   committed.
+
+Each item gets a status: `created`, `duplicate` (key seen before with the
+same content; the earlier test's id is returned, nothing is written),
+`conflict` (key seen before with different content) or `error`. A retried
+batch therefore never creates a test twice, even when the first attempt
+committed and only the response was lost.
+
+Tokens are random strings shown once when created; only their sha256 is
+stored (see scripts/create_api_token.py).
+"""
+import hashlib
+import json
+import secrets
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import bulk_import
+import measurements
+import models
+import results
+import search
+import stats
+
+MAX_BATCH = 5000
+MAX_KEY_LENGTH = 100
+ITEM_FIELDS = ('sample_id', 'test_name', 'raw_values', 'date_tested')
+USED_TOKENS = 'api_tokens_used'  # session.info key: token id -> last_used_at set by authenticate()
+
+
+class BatchError(ValueError):
+    """The request body is not a batch this endpoint accepts (HTTP `status`)."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+# ---------------------------------------------------------------------------
+# Tokens
+# ---------------------------------------------------------------------------
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_token(session, user, name: str) -> str:
+    """Store a new token for `user` and return it; it cannot be recovered later."""
+    token = secrets.token_urlsafe(32)
+    session.add(models.ApiToken(user_id=user.id, name=name, token_hash=hash_token(token),
+                                created_at=datetime.utcnow()))
+    session.commit()
+    return token
+
+
+def authenticate(session, authorization: Optional[str]):
+    """The User of a valid `Authorization: Bearer <token>` header, else None.
+
+    Marks the token as used; the change is committed with the request's work.
+    """
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    api_token = session.execute(select(models.ApiToken).where(
+        models.ApiToken.token_hash == hash_token(token.strip()),
+        models.ApiToken.revoked_at.is_(None))).scalar_one_or_none()
+    if api_token is None:
+        return None
+    api_token.last_used_at = datetime.utcnow()
+    session.info.setdefault(USED_TOKENS, {})[api_token.id] = api_token.last_used_at
+    return api_token.user
+
+
+def _mark_used(session) -> None:
+    """Set last_used_at again for the tokens authenticate() accepted in this session (after a rollback)."""
+    for token_id, used_at in session.info.get(USED_TOKENS, {}).items():
+        session.execute(update(models.ApiToken).where(models.ApiToken.id == token_id).values(last_used_at=used_at))
+
+
+# ---------------------------------------------------------------------------
+# Batch ingestion
+# ---------------------------------------------------------------------------
+
+def _text(value) -> str:
+    if isinstance(value, (list, tuple)):  # readings may be sent as a JSON array
+        return ','.join(str(v) for v in value)
+    return '' if value is None else str(value).strip()
+
+
+def fingerprint(item: Dict[str, Any]) -> str:
+    """sha256 of the item's content (everything but the key)."""
+    content = {name: _text(item.get(name)) for name in ITEM_FIELDS}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _check(item, seen: set) -> List[Tuple[str, str]]:
+    """(field, message) problems of one item that need no database lookup."""
+    if not isinstance(item, dict):
+        return [('item', 'Each item must be a JSON object')]
+    errors = []
+    key = item.get('key')
+    if not isinstance(key, str) or not key.strip():
+        errors.append(('key', 'An idempotency key is required'))
+    elif len(key) > MAX_KEY_LENGTH:
+        errors.append(('key', f'Keys are at most {MAX_KEY_LENGTH} characters'))
+    elif key in seen:
+        errors.append(('key', 'Key repeated in this batch'))
+    for name, label in (('sample_id', 'Sample ID'), ('test_name', 'Test name'), ('raw_values', 'Raw values')):
+        if not _text(item.get(name)):
+            errors.append((name, f'{label} is required'))
+    test_name, raw = _text(item.get('test_name')), _text(item.get('raw_values'))
+    if test_name and raw:
+        message = bulk_import.raw_values_error(test_name, raw)
+        if message:
+            errors.append(('raw_values', message))
+    tested = item.get('date_tested')
+    if tested and (not isinstance(tested, str) or bulk_import.parse_datetime(tested) is None):
+        errors.append(('date_tested', 'Date tested must be an ISO 8601 date or date-time'))
+    return errors
+
+
+def _outcome(index: int, key, status: str, test=None, errors=None) -> Dict[str, Any]:
+    outcome = {'index': index, 'key': key, 'status': status}
+    if test is not None:
+        outcome.update({'id': test.id, 'result': results.format_result(test) or None,
+                        'result_kind': test.result_kind, 'result_value': test.result_value,
+                        'result_unit': test.result_unit})
+    if errors:
+        outcome['errors'] = [{'field': field, 'message': message} for field, message in errors]
+    return outcome
+
+
+def _ingest(session, user_id: int, items: Sequence, now: datetime) -> List[Dict[str, Any]]:
+    Sample, TestResult, Key = models.Sample, models.TestResult, models.IdempotencyKey
+    outcomes: List[Optional[Dict]] = [None] * len(items)
+    pending = []  # indexes of items that passed the checks
+    seen: set = set()
+    for i, item in enumerate(items):
+        errors = _check(item, seen)
+        key = item.get('key') if isinstance(item, dict) else None
+        if isinstance(key, str):
+            seen.add(key)
+        if errors:
+            outcomes[i] = _outcome(i, key, 'error', errors=errors)
+        else:
+            pending.append(i)
+
+    keys = [items[i]['key'] for i in pending]
+    stored = {}
+    if keys:
+        rows = session.execute(
+            select(Key.key, Key.fingerprint, TestResult.id, TestResult.calculated_result, TestResult.result_kind,
+                   TestResult.result_value, TestResult.result_unit, TestResult.result_payload)
+            .outerjoin(TestResult, TestResult.id == Key.test_result_id)
+            .where(Key.user_id == user_id, Key.key.in_(keys)))
+        stored = {row.key: row for row in rows}
+    codes = {_text(items[i]['sample_id']) for i in pending if items[i]['key'] not in stored}
+    samples = dict(session.execute(select(Sample.sample_id, Sample.id)
+                                   .where(Sample.sample_id.in_(codes))).all()) if codes else {}
+
+    new_tests, new_indexes, fingerprints = [], [], []
+    for i in pending:
+        item = items[i]
+        key, print_ = item['key'], fingerprint(item)
+        if key in stored:
+            row = stored[key]
+            if row.fingerprint != print_:
+                outcomes[i] = _outcome(i, key, 'conflict', errors=[
+                    ('key', 'Key was already used for a different test result')])
+            else:
+                outcomes[i] = _outcome(i, key, 'duplicate', test=row if row.id is not None else None)
+            continue
+        sample_pk = samples.get(_text(item['sample_id']))
+        if sample_pk is None:
+            outcomes[i] = _outcome(i, key, 'error', errors=[('sample_id', 'Unknown sample ID')])
+            continue
+        tested = item.get('date_tested')
+        new_tests.append({'sample_id': sample_pk, 'test_name': _text(item['test_name']),
+                          'raw_values': _text(item['raw_values']), 'status': 'Pending',
+                          'date_tested': bulk_import.parse_datetime(tested) if tested else now})
+        new_indexes.append(i)
+        fingerprints.append(print_)
+
+    warnings = {}
+    if new_tests:
+        warnings = dict(bulk_import.calculate(new_tests))
+        ids = bulk_import.insert_ids(session, TestResult, new_tests)
+        readings = [m for id_, t in zip(ids, new_tests)
+                    for m in measurements.measurement_rows(id_, t['test_name'], t['raw_values'])]
+        if readings:
+            session.execute(insert(models.Measurement), readings)
+        session.execute(insert(Key), [
+            {'user_id': user_id, 'key': items[i]['key'], 'fingerprint': print_, 'test_result_id': id_,
+             'created_at': now} for i, print_, id_ in zip(new_indexes, fingerprints, ids)])
+        stats.add(session, {'tests': len(new_tests), 'tests_pending': len(new_tests)})
+        search.reindex_samples(session.connection(), {t['sample_id'] for t in new_tests})
+        for n, (i, id_, values) in enumerate(zip(new_indexes, ids, new_tests)):
+            test = SimpleNamespace(id=id_, calculated_result=None, result_kind=None, result_value=None,
+                                   result_unit=None, result_payload=None)
+            vars(test).update(values)
+            errors = [('calculation', f'Stored without a result: {warnings[n]}')] if n in warnings else None
+            outcomes[i] = _outcome(i, items[i]['key'], 'created', test=test, errors=errors)
+    session.commit()
+    return outcomes
+
+
+def ingest_batch(session, user, items, max_items: int = MAX_BATCH) -> Dict[str, Any]:
+    """Ingest a batch of test results for `user` in one transaction.
+
+    Returns {'items': [per-item outcome, in request order], 'counts': {status: n}}.
+    Raises BatchError when `items` is not a list or is too long.
+    """
+    if not isinstance(items, list) or not items:
+        raise BatchError('Send {"items": [...]} with at least one item')
+    if len(items) > max_items:
+        raise BatchError(f'At most {max_items} items per batch (got {len(items)})', status=413)
+    now = datetime.utcnow()
+    try:
+        outcomes = _ingest(session, user.id, items, now)
+    except IntegrityError:
+        # A concurrent request stored one of the keys first; on the second
+        # pass it is found and reported as a duplicate or conflict. The
+        # rollback also drops authenticate()'s last_used_at, so set it again.
+        session.rollback()
+        _mark_used(session)
+        outcomes = _ingest(session, user.id, items, now)
+    counts = {status: 0 for status in ('created', 'duplicate', 'conflict', 'error')}
+    for outcome in outcomes:
+        counts[outcome['status']] += 1
+    return {'items': outcomes, 'counts': counts}
@@ -3,8 +3,11 @@ app.py - Minimal Flask application for Civil Engineering LIMS
 
 This is intentionally simple and well-commented for demonstration and learning.
 """
+import json
 import os
 import pkgutil
+import secrets
+import threading
 # Some Python distributions (or newer interpreters) may not provide pkgutil.get_loader
 # which Flask's package-finding utilities expect. Provide a small shim if missing.
 if not hasattr(pkgutil, 'get_loader'):
@@ -21,19 +24,61 @@ if not hasattr(pkgutil, 'get_loader'):
     pkgutil.get_loader = _get_loader
 
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file
+from flask import (Flask, Response, render_template, request, redirect, url_for, flash, send_file, jsonify, abort,
+                   send_from_directory, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 from functools import wraps
 
+import db_engine
+import db_routing
+
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///lims_dev.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pool for MySQL and other server databases, pragmas for a SQLite file (see db_engine.py)
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', '10'))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', '30'))  # Seconds to wait for a free connection
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # Reconnect after this many seconds
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('true', '1', 'yes')
+app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+app.config['SQLITE_CACHE_SIZE_KB'] = int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))
+app.config['SQLITE_MMAP_SIZE'] = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_engine.engine_options(app.config)
+# Read-only pages can be served by a replica or a SQLite snapshot (see db_routing.py)
+app.config['DATABASE_REPLICA_URI'] = os.getenv('DATABASE_REPLICA_URI')
+app.config['DATABASE_SNAPSHOT'] = os.getenv('DATABASE_SNAPSHOT')  # Path of the snapshot copy of a SQLite primary
+app.config['DB_SNAPSHOT_SECONDS'] = int(os.getenv('DB_SNAPSHOT_SECONDS', '60'))  # Snapshot refresh interval
+app.config['DB_STICKY_SECONDS'] = float(os.getenv('DB_STICKY_SECONDS', '5'))  # Primary only after a user's commit
+# Add the tables, columns and indexes of newer models to an existing database when the app is imported
+app.config['SCHEMA_UPGRADE'] = os.getenv('SCHEMA_UPGRADE', 'true').lower() in ('true', '1', 'yes')
+app.config['PAGE_SIZE'] = int(os.getenv('PAGE_SIZE', '50'))  # Rows per page on list pages
+app.config['IMPORT_CHUNK_SIZE'] = int(os.getenv('IMPORT_CHUNK_SIZE', '500'))  # Rows per bulk-import transaction
+app.config['API_MAX_BATCH'] = int(os.getenv('API_MAX_BATCH', '5000'))  # Items per API ingestion request
+# Report worker threads per web process; 0 when scripts/lims_worker.py runs the jobs instead
+app.config['REPORT_WORKERS'] = int(os.getenv('REPORT_WORKERS', '2'))
+# Audit entries are queued and batch-inserted by a background thread (see audit.py)
+app.config['AUDIT_BUFFERED'] = os.getenv('AUDIT_BUFFERED', 'true').lower() in ('true', '1', 'yes')
+app.config['AUDIT_QUEUE_SIZE'] = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+app.config['AUDIT_BATCH_ROWS'] = int(os.getenv('AUDIT_BATCH_ROWS', '500'))  # Insert when this many are queued...
+app.config['AUDIT_FLUSH_MS'] = int(os.getenv('AUDIT_FLUSH_MS', '200'))  # ...or this long after the first one
+app.config['AUDIT_SPILL_DIR'] = os.getenv('AUDIT_SPILL_DIR', os.path.join('reports', 'audit_spill'))
+# Months older than this are moved to compressed files by scripts/audit_maintenance.py (see audit_archive.py)
+app.config['AUDIT_RETENTION_MONTHS'] = int(os.getenv('AUDIT_RETENTION_MONTHS', '12'))
+app.config['AUDIT_ARCHIVE_DIR'] = os.getenv('AUDIT_ARCHIVE_DIR', os.path.join('reports', 'audit_archive'))
+# Hash chain and Merkle blocks over the audit log (see audit_chain.py); 0 leaves sealing to the CLI
+app.config['AUDIT_SEAL_SECONDS'] = int(os.getenv('AUDIT_SEAL_SECONDS', '300'))
+app.config['AUDIT_BLOCK_SIZE'] = int(os.getenv('AUDIT_BLOCK_SIZE', '1024'))
 
 # CSRF Protection Configuration
 app.config['WTF_CSRF_ENABLED'] = True
@@ -50,7 +95,9 @@ except ImportError:
     csrf = None
     print('Warning: flask-wtf not installed, CSRF protection disabled')
 
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': db_routing.RoutingSession})
+with app.app_context():
+    db_engine.init_engine(db.engine, app.config)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -59,41 +106,114 @@ import models
 from calculations import (compressive_strength_mpa, flexural_strength_mpa, 
                          split_tensile_strength_mpa, water_absorption_percent,
                          cbr_value, proctor_compaction, sieve_analysis_summary, atterberg_limits)
-from report_generator import generate_test_report_pdf
+import raw_values
+import measurements
+import results
+import schema_upgrade
+import pagination
+import search
+import stats
+import query_cache
+import report_jobs
+import pdf_cache
+import renderers
+import batch_reports
+import report_pack
+import exports
+import bulk_import
+import api
+import approvals
+import audit
+import audit_archive
 
 # Ensure models are initialized with the SQLAlchemy db instance
 models.init_models(db)
 
+# Keep the sample search index in step with the ORM (see search.py)
+search.init_search(db)
+
+# Dashboard totals are maintained incrementally (see stats.py)
+stats.init_stats(db)
+
+# Cache for reference data and list pages, invalidated by commits (see query_cache.py)
+query_cache.init_cache(db)
+
+# Read-only views marked @db_routing.read_replica may read from the replica (see db_routing.py)
+db_routing.init_routing(app, db)
+
+# Upgrade the schema on import, so `waitress-serve app:app` (Dockerfile, render.yaml) runs it
+# too, not only `python app.py`. In-memory test databases are created by the tests themselves.
+if app.config['SCHEMA_UPGRADE'] and not db_engine.is_memory(app.config['SQLALCHEMY_DATABASE_URI']):
+    with app.app_context():
+        try:
+            schema_upgrade.upgrade(db)
+        except Exception as e:  # e.g. another worker process upgrading at the same moment
+            app.logger.error('Schema upgrade failed: %s', e)
+
+# Audit log writer, off the request's session and transaction (see audit.py)
+with app.app_context():
+    audit.init_audit(app, db.engine)
+
+
+# Report workers start with each process's first request, so they run under
+# waitress-serve/gunicorn (which import app:app) and once per forked worker.
+# An in-memory SQLite database has one shared connection that worker threads
+# cannot use, so jobs there only run through report_jobs.run_pending().
+@app.before_request
+def start_report_workers():
+    if not db_engine.is_memory(app.config['SQLALCHEMY_DATABASE_URI']):
+        report_jobs.ensure_workers(app, app.config['REPORT_WORKERS'])
+
+# Results are stored as numbers and formatted when a page is rendered
+app.add_template_filter(results.format_result, 'format_result')
+
+
+@app.template_global()
+def page_url(**cursor):
+    """URL of the current list page with a new after/before cursor and the same filters."""
+    args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+    args.update({k: v for k, v in cursor.items() if v is not None})
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def current_page(query, id_column, rank_column=None, **kwargs):
+    """Keyset-paginate `query` using the after/before/per_page request args (in rank order if given)."""
+    args = pagination.cursor_args(request.args, app.config['PAGE_SIZE'])
+    if rank_column is not None:
+        return pagination.paginate_ranked(query, rank_column, id_column, **args, **kwargs)
+    return pagination.paginate(query, id_column, **args, **kwargs)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return models.User.query.get(int(user_id))
+    # Always from the primary: a replica may not have a new user yet, or still show an old role
+    with db_routing.primary():
+        return models.User.query.get(int(user_id))
 
 @app.route('/')
 @app.route('/dashboard')
 @login_required
+@db_routing.read_replica
 def index():
-    # Get statistics for dashboard
-    total_projects = models.Project.query.count()
-    total_samples = models.Sample.query.count()
-    total_tests = models.TestResult.query.count()
-    pending_tests = models.TestResult.query.filter_by(status='Pending').count()
-    approved_tests = models.TestResult.query.filter_by(status='Approved').count()
+    # Get statistics for dashboard (one read of the stats_counters table)
+    counters = stats.counters(db.session)
     
     # Recent samples
-    recent_samples = models.Sample.query.order_by(models.Sample.id.desc()).limit(5).all()
+    recent_samples = (models.Sample.query.options(joinedload(models.Sample.project))
+                      .order_by(models.Sample.id.desc()).limit(5).all())
     
     # Pending tests for approval (if user is Admin or Engineer)
     pending_approval = []
     if current_user.role in ['Admin', 'Engineer']:
-        pending_approval = models.TestResult.query.filter_by(status='Pending').limit(10).all()
+        pending_approval = (models.TestResult.query.options(joinedload(models.TestResult.sample))
+                            .filter_by(status='Pending').limit(10).all())
     
     return render_template('dashboard.html', 
                          user=current_user,
-                         total_projects=total_projects,
-                         total_samples=total_samples,
-                         total_tests=total_tests,
-                         pending_tests=pending_tests,
-                         approved_tests=approved_tests,
+                         total_projects=counters['projects'],
+                         total_samples=counters['samples'],
+                         total_tests=counters['tests'],
+                         pending_tests=counters['tests_pending'],
+                         approved_tests=counters['tests_approved'],
                          recent_samples=recent_samples,
                          pending_approval=pending_approval)
 
@@ -120,9 +240,11 @@ def role_required(*roles):
     def decorator(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            if not current_user or not getattr(current_user, 'is_authenticated', False):
-                return login_manager.unauthorized()
-            if current_user.role not in roles:
+            with db_routing.primary():  # the role as it is now, not as a replica last saw it
+                if not current_user or not getattr(current_user, 'is_authenticated', False):
+                    return login_manager.unauthorized()
+                allowed = current_user.role in roles
+            if not allowed:
                 flash('Permission denied for this action', 'danger')
                 return redirect(url_for('index'))
             return f(*args, **kwargs)
@@ -138,9 +260,11 @@ def logout():
 # --- Project Management ---
 @app.route('/projects')
 @login_required
+@db_routing.read_replica
 def projects():
-    projects = models.Project.query.order_by(models.Project.id.desc()).all()
-    return render_template('projects.html', projects=projects)
+    page = current_page(models.Project.query, models.Project.id)
+    page.approx_total = pagination.approximate_count(('projects',), models.Project.query)
+    return render_template('projects.html', projects=page, page=page)
 
 @app.route('/projects/new', methods=['GET', 'POST'])
 @login_required
@@ -177,10 +301,13 @@ def project_new():
 
 @app.route('/projects/<int:project_id>')
 @login_required
+@db_routing.read_replica
 def project_detail(project_id):
     proj = models.Project.query.get_or_404(project_id)
     samples = models.Sample.query.filter_by(project_id=project_id).all()
-    return render_template('project_detail.html', project=proj, samples=samples)
+    total_tests = (models.TestResult.query.join(models.Sample)
+                   .filter(models.Sample.project_id == project_id).count())
+    return render_template('project_detail.html', project=proj, samples=samples, total_tests=total_tests)
 
 @app.route('/projects/<int:project_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -228,38 +355,86 @@ def project_delete(project_id):
     flash('Project deleted', 'success')
     return redirect(url_for('projects'))
 
+def sample_test_counts():
+    """Subquery of (sample_id, test_count) so list pages can show counts without loading tests."""
+    return (db.session.query(models.TestResult.sample_id, func.count(models.TestResult.id).label('test_count'))
+            .group_by(models.TestResult.sample_id).subquery())
+
+
+def samples_with_test_counts(query):
+    """Add the project (joined) and test count (aggregate subquery) to a Sample query.
+
+    Returns rows of (Sample, test_count) in a single SQL statement.
+    """
+    counts = sample_test_counts()
+    return (query.options(joinedload(models.Sample.project))
+            .outerjoin(counts, counts.c.sample_id == models.Sample.id)
+            .add_columns(func.coalesce(counts.c.test_count, 0).label('test_count')))
+
+
+def project_choices():
+    """Projects for the dropdowns as plain dicts, cached until the projects table changes."""
+    def load():
+        return [{'id': p.id, 'project_code': p.project_code, 'project_name': p.project_name}
+                for p in models.Project.query.order_by(models.Project.id)]
+    return query_cache.cached('project_choices', (), ['projects'], load)
+
+
+def sample_row(sample):
+    """The fields of a sample the list page shows, as cacheable plain data."""
+    project = sample.project
+    return {'id': sample.id, 'sample_id': sample.sample_id, 'sample_type': sample.sample_type,
+            'project_name': sample.project_name, 'client_name': sample.client_name,
+            'project': {'id': project.id, 'project_name': project.project_name} if project else None}
+
+
 # Sample listing and registration
 @app.route('/samples')
 @login_required
+@db_routing.read_replica
 def samples():
     # Get search and filter parameters
-    search = request.args.get('search', '').strip()
+    search_term = request.args.get('search', '').strip()
     project_filter = request.args.get('project', '').strip()
     type_filter = request.args.get('type', '').strip()
     
     query = models.Sample.query
     
     # Apply filters
-    if search:
-        query = query.filter(models.Sample.sample_id.ilike(f'%{search}%'))
-    if project_filter:
-        query = query.filter(models.Sample.project_name.ilike(f'%{project_filter}%'))
+    hits = search.matches(db.session, search_term)
+    if hits is not None:
+        query = query.join(hits, hits.c.sample_id == models.Sample.id)
+    project_hits = search.matches(db.session, project_filter, field='project_name')
+    if project_hits is not None:
+        query = query.join(project_hits, project_hits.c.sample_id == models.Sample.id)
     if type_filter:
-        query = query.filter_by(sample_type=type_filter)
+        query = query.filter(models.Sample.sample_type == type_filter)
     
-    samples = query.order_by(models.Sample.id.desc()).all()
+    def load_page():
+        if hits is not None:
+            # Searches show the best matches first; the cursors page through them in rank order
+            page = current_page(samples_with_test_counts(query), models.Sample.id, rank_column=hits.c.rank,
+                                key=lambda row: row[0].id)
+        else:
+            page = current_page(samples_with_test_counts(query), models.Sample.id, key=lambda row: row[0].id)
+        page.items = [(sample_row(sample), test_count) for sample, test_count in page.items]
+        page.approx_total = pagination.approximate_count(('samples', search_term, project_filter, type_filter),
+                                                         query)
+        return page
     
-    # Get all projects for dropdown
-    projects = models.Project.query.all()
+    # Identical filtered listings are served from the cache until a sample, project or test changes
+    params = (search_term, project_filter, type_filter,
+              tuple(sorted(pagination.cursor_args(request.args, app.config['PAGE_SIZE']).items())))
+    page = query_cache.cached('samples_page', params, ['samples', 'projects', 'test_results'], load_page)
     
-    return render_template('samples.html', samples=samples, projects=projects,
-                         search=search, project_filter=project_filter, type_filter=type_filter)
+    return render_template('samples.html', samples=page, page=page, projects=project_choices(),
+                         search=search_term, project_filter=project_filter, type_filter=type_filter)
 
 @app.route('/samples/new', methods=['GET', 'POST'])
 @login_required
 @role_required('Admin', 'Lab Technician')
 def sample_new():
-    projects = models.Project.query.all()
+    projects = project_choices()
     if request.method == 'POST':
         # Basic sample registration with light validation
         sample_id = request.form.get('sample_id', '').strip()
@@ -289,11 +464,99 @@ def sample_new():
         return redirect(url_for('samples'))
     return render_template('sample_new.html', projects=projects)
 
+IMPORT_REPORT_DIR = os.path.join('reports', 'imports')
+
+
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+@role_required('Admin', 'Lab Technician')
+def import_samples():
+    """Register samples and tests from an uploaded CSV/XLSX sheet (see bulk_import.py)."""
+    if request.method == 'GET':
+        return render_template('import.html', summary=None, report_name=None, columns=bulk_import.COLUMNS)
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a CSV or XLSX file to import', 'danger')
+        return redirect(url_for('import_samples'))
+    report_name = f"import_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{secrets.token_hex(4)}_errors.csv"
+    errors_path = os.path.abspath(os.path.join(IMPORT_REPORT_DIR, report_name))
+    stopped = None
+    try:
+        summary = bulk_import.import_file(db.session, upload.stream, upload.filename, errors_path=errors_path,
+                                          chunk_size=app.config['IMPORT_CHUNK_SIZE'],
+                                          calculate_results=bool(request.form.get('calculate')))
+    except bulk_import.ImportInterrupted as e:
+        # Earlier chunks are committed: report them rather than pretend nothing happened
+        summary, stopped = e.summary, e
+    except Exception as e:
+        db.session.rollback()
+        if os.path.exists(errors_path):
+            os.remove(errors_path)
+        flash(f'Import failed: {e}', 'danger')
+        return redirect(url_for('import_samples'))
+    if not summary.errors:
+        os.remove(errors_path)
+        report_name = None
+    imported = f'Imported {summary.samples} samples and {summary.tests} tests'
+    if stopped is not None:
+        log_audit('IMPORT', 'Sample', None, f'{imported} from {upload.filename} ({summary.rejected} rows rejected); '
+                                            f'stopped after row {summary.committed_row}: {stopped.error}')
+        flash(f'Import stopped: {stopped.error}. Rows up to {summary.committed_row} were imported '
+              f'({summary.samples} samples, {summary.tests} tests); later rows were not.', 'danger')
+    else:
+        log_audit('IMPORT', 'Sample', None, f'{imported} from {upload.filename} ({summary.rejected} rows rejected)')
+        flash(imported + (f'; {summary.rejected} rows rejected' if summary.rejected else ''),
+              'warning' if summary.rejected else 'success')
+    return render_template('import.html', summary=summary, report_name=report_name, columns=bulk_import.COLUMNS,
+                           stopped=stopped)
+
+
+@app.route('/import/errors/<name>')
+@login_required
+@role_required('Admin', 'Lab Technician')
+def import_errors(name):
+    return send_from_directory(os.path.abspath(IMPORT_REPORT_DIR), name, as_attachment=True)
+
+
+# --- JSON API (token authenticated, see api.py) ---
+API_ROLES = ('Admin', 'Lab Technician')
+
+
+@app.route('/api/v1/test-results:batch', methods=['POST'])
+def api_test_results_batch():
+    """Ingest up to API_MAX_BATCH test results in one request and one transaction.
+
+    Authenticated with `Authorization: Bearer <token>`; every item needs an
+    idempotency key, so a retried request never duplicates a test.
+    """
+    user = api.authenticate(db.session, request.headers.get('Authorization'))
+    if user is None:
+        return jsonify(error='A valid bearer token is required'), 401, {'WWW-Authenticate': 'Bearer'}
+    if user.role not in API_ROLES:
+        return jsonify(error='Permission denied for this action'), 403
+    body = request.get_json(silent=True)
+    try:
+        batch = api.ingest_batch(db.session, user, body.get('items') if isinstance(body, dict) else None,
+                                 max_items=app.config['API_MAX_BATCH'])
+    except api.BatchError as e:
+        return jsonify(error=str(e)), e.status
+    counts = batch['counts']
+    log_audit('CREATE', 'TestResult', None, f"API batch of {len(batch['items'])}: {counts['created']} created, "
+                                            f"{counts['duplicate']} duplicate, {counts['conflict']} conflict, "
+                                            f"{counts['error']} error", user_id=user.id)
+    return jsonify(batch)
+
+
+if csrf is not None:
+    csrf.exempt(api_test_results_batch)  # token authenticated; no session cookie involved
+
+
 @app.route('/samples/<int:sample_id>', methods=['GET', 'POST'])
 @login_required
 def sample_detail(sample_id):
-    s = models.Sample.query.get_or_404(sample_id)
-    tests = s.tests
+    s = models.Sample.query.options(joinedload(models.Sample.project)).get_or_404(sample_id)
+    tests = (models.TestResult.query.options(joinedload(models.TestResult.approver))
+             .filter_by(sample_id=s.id).order_by(models.TestResult.id).all())
     if request.method == 'POST':
         test_name = request.form.get('test_name', '').strip()
         raw_value = request.form.get('raw_value', '').strip()
@@ -306,6 +569,7 @@ def sample_detail(sample_id):
         # Save raw values as JSON-like string for simplicity
         tr = models.TestResult(sample_id=s.id, test_name=test_name, raw_values=raw_value, date_tested=datetime.utcnow())
         db.session.add(tr)
+        measurements.store_measurements(db.session, tr)
         db.session.commit()
         flash('Test added', 'success')
         return redirect(url_for('sample_detail', sample_id=sample_id))
@@ -364,11 +628,9 @@ def calculate_compressive(test_id):
     tr = models.TestResult.query.get_or_404(test_id)
     # Expect raw_values like "load_kN,area_mm2"
     try:
-        parts = tr.raw_values.split(',')
-        load_kN = float(parts[0])
-        area_mm2 = float(parts[1])
-        strength = compressive_strength_mpa(load_kN, area_mm2)
-        tr.calculated_result = f"{strength:.3f} MPa"
+        values = raw_values.parse('compressive', tr.raw_values)
+        strength = compressive_strength_mpa(values.load_kN, values.area_mm2)
+        results.set_result(tr, 'compressive', strength)
         db.session.commit()
         flash('Calculated compressive strength', 'success')
     except Exception as e:
@@ -382,13 +644,9 @@ def calculate_flexural(test_id):
     tr = models.TestResult.query.get_or_404(test_id)
     # Expect raw_values like "load_kN,length_mm,width_mm,depth_mm"
     try:
-        parts = tr.raw_values.split(',')
-        load_kN = float(parts[0])
-        length_mm = float(parts[1])
-        width_mm = float(parts[2])
-        depth_mm = float(parts[3])
-        strength = flexural_strength_mpa(load_kN, length_mm, width_mm, depth_mm)
-        tr.calculated_result = f"{strength:.3f} MPa"
+        values = raw_values.parse('flexural', tr.raw_values)
+        strength = flexural_strength_mpa(values.load_kN, values.length_mm, values.width_mm, values.depth_mm)
+        results.set_result(tr, 'flexural', strength)
         db.session.commit()
         flash('Calculated flexural strength', 'success')
     except Exception as e:
@@ -402,12 +660,9 @@ def calculate_split_tensile(test_id):
     tr = models.TestResult.query.get_or_404(test_id)
     # Expect raw_values like "load_kN,length_mm,diameter_mm"
     try:
-        parts = tr.raw_values.split(',')
-        load_kN = float(parts[0])
-        length_mm = float(parts[1])
-        diameter_mm = float(parts[2])
-        strength = split_tensile_strength_mpa(load_kN, length_mm, diameter_mm)
-        tr.calculated_result = f"{strength:.3f} MPa"
+        values = raw_values.parse('split_tensile', tr.raw_values)
+        strength = split_tensile_strength_mpa(values.load_kN, values.length_mm, values.diameter_mm)
+        results.set_result(tr, 'split_tensile', strength)
         db.session.commit()
         flash('Calculated split tensile strength', 'success')
     except Exception as e:
@@ -421,11 +676,9 @@ def calculate_water_absorption(test_id):
     tr = models.TestResult.query.get_or_404(test_id)
     # Expect raw_values like "dry_mass_g,saturated_mass_g"
     try:
-        parts = tr.raw_values.split(',')
-        dry_mass = float(parts[0])
-        saturated_mass = float(parts[1])
-        absorption = water_absorption_percent(dry_mass, saturated_mass)
-        tr.calculated_result = f"{absorption:.2f}%"
+        values = raw_values.parse('water_absorption', tr.raw_values)
+        absorption = water_absorption_percent(values.dry_mass_g, values.saturated_mass_g)
+        results.set_result(tr, 'water_absorption', absorption)
         db.session.commit()
         flash('Calculated water absorption', 'success')
     except Exception as e:
@@ -439,11 +692,9 @@ def calculate_cbr(test_id):
     tr = models.TestResult.query.get_or_404(test_id)
     # Expect raw_values like "load_kN,standard_load_kN"
     try:
-        parts = tr.raw_values.split(',')
-        load = float(parts[0])
-        standard = float(parts[1])
-        cbr = cbr_value(load, standard)
-        tr.calculated_result = f"CBR = {cbr:.2f}%"
+        values = raw_values.parse('cbr', tr.raw_values)
+        cbr = cbr_value(values.load_at_penetration_kN, values.standard_load_kN)
+        results.set_result(tr, 'cbr', cbr)
         db.session.commit()
         flash('Calculated CBR value', 'success')
     except Exception as e:
@@ -457,11 +708,9 @@ def calculate_proctor(test_id):
     tr = models.TestResult.query.get_or_404(test_id)
     # Expect raw_values like "dry_density_kgm3,water_content_percent"
     try:
-        parts = tr.raw_values.split(',')
-        dry_density = float(parts[0])
-        water_content = float(parts[1])
-        result = proctor_compaction(dry_density, water_content)
-        tr.calculated_result = f"ρd={result['dry_density']} kg/m³, w={result['water_content']}%"
+        values = raw_values.parse('proctor', tr.raw_values)
+        result = proctor_compaction(values.dry_density_kgm3, values.water_content_percent)
+        results.set_result(tr, 'proctor', result['dry_density'], payload=result)
         db.session.commit()
         flash('Calculated Proctor compaction data', 'success')
     except Exception as e:
@@ -476,19 +725,9 @@ def calculate_sieve(test_id):
     # Expect raw_values as semicolon-separated mass retained per sieve: "sieve:mass;sieve:mass;..." and total mass
     try:
         # Example: "75:10;37.5:20;19:30;9.5:25;4.75:10;total:95"
-        entries = [e for e in tr.raw_values.split(';') if e]
-        sieve_masses = {}
-        total = None
-        for e in entries:
-            k, v = e.split(':')
-            if k.strip().lower() == 'total':
-                total = float(v)
-            else:
-                sieve_masses[float(k.strip())] = float(v)
-        if total is None:
-            total = sum(sieve_masses.values())
-        summary = sieve_analysis_summary(sieve_masses, total)
-        tr.calculated_result = str(summary['summary_table'])
+        values = raw_values.parse('sieve', tr.raw_values)
+        summary = sieve_analysis_summary(dict(values.sieve_masses), values.total_mass)
+        results.set_result(tr, 'sieve', payload=summary)
         db.session.commit()
         flash('Sieve analysis calculated', 'success')
     except Exception as e:
@@ -502,11 +741,9 @@ def calculate_atterberg(test_id):
     tr = models.TestResult.query.get_or_404(test_id)
     # Expect raw_values like "LL,PL" (liquid limit, plastic limit)
     try:
-        parts = tr.raw_values.split(',')
-        liquid_limit = float(parts[0])
-        plastic_limit = float(parts[1])
-        result = atterberg_limits(liquid_limit, plastic_limit)
-        tr.calculated_result = f"LL={result['LL']}%, PL={result['PL']}%, PI={result['PI']}%"
+        values = raw_values.parse('atterberg', tr.raw_values)
+        result = atterberg_limits(values.liquid_limit, values.plastic_limit)
+        results.set_result(tr, 'atterberg', result['PI'], payload=result)
         db.session.commit()
         flash('Atterberg limits calculated', 'success')
     except Exception as e:
@@ -525,6 +762,7 @@ def approve_test(test_id):
     tr.approved_by = current_user.id
     tr.approved_at = datetime.utcnow()
     tr.remarks = remarks
+    log_audit('APPROVE', 'TestResult', tr.id, f'Approved: {remarks}' if remarks else 'Approved', sync=True)
     db.session.commit()
     flash('Test result approved', 'success')
     return redirect(url_for('sample_detail', sample_id=tr.sample_id))
@@ -544,45 +782,68 @@ def reject_test(test_id):
     tr.approved_by = current_user.id
     tr.approved_at = datetime.utcnow()
     tr.remarks = remarks
+    log_audit('REJECT', 'TestResult', tr.id, f'Rejected: {remarks}', sync=True)
     db.session.commit()
     flash('Test result rejected', 'danger')
     return redirect(url_for('sample_detail', sample_id=tr.sample_id))
 
-@app.route('/reports/generate/<int:test_id>')
+@app.route('/tests/review', methods=['POST'])
 @login_required
-@role_required('Admin', 'Lab Technician', 'Engineer')
-def generate_report(test_id):
-    tr = models.TestResult.query.get_or_404(test_id)
-    sample = tr.sample
-    lab_name = 'Civil Engg Materials Lab - College'
-    out_path = f"reports/report_{tr.id}.pdf"
-    os.makedirs('reports', exist_ok=True)
-
-    # Prepare context similar to the preview route
-    parts = [p.strip() for p in (tr.raw_values or '').split(',') if p.strip()]
-    failure_loads = []
+@role_required('Admin', 'Engineer')
+def bulk_review():
+    """Approve or reject the selected tests in one transaction (see approvals.py)."""
+    target = request.form.get('next', '')
+    if not target.startswith('/') or target.startswith('//'):
+        target = url_for('index')
     try:
-        for v in parts[:3]:
-            failure_loads.append(float(v))
-    except Exception:
-        failure_loads = parts
-
-    area = None
-    if len(parts) >= 4:
-        try:
-            area = float(parts[3])
-        except Exception:
-            area = None
-
+        outcome = approvals.review(db.session, approvals.parse_ids(request.form.getlist('test_ids')),
+                                   request.form.get('decision', ''), current_user.id,
+                                   remarks=request.form.get('remarks', ''))
+    except approvals.ReviewError as e:
+        flash(str(e), 'danger')
+        return redirect(target)
+    message = f'{outcome.status} {len(outcome.updated)} test(s)'
+    if outcome.skipped:
+        shown = ', '.join(f'#{id_}' for id_ in outcome.skipped[:20])
+        more = f' and {len(outcome.skipped) - 20} more' if len(outcome.skipped) > 20 else ''
+        message += f'; skipped {len(outcome.skipped)} no longer pending: {shown}{more}'
+    flash(message, 'warning' if outcome.skipped else 'success')
+    return redirect(target)
+
+def cube_report_values(raw):
+    """Failure loads, area and per-cube strengths for the concrete cube report.
+
+    raw_values is read as "load1,load2,load3,area_mm2" through the shared
+    parser registry; if it does not parse, the raw tokens are shown as-is.
+    """
+    try:
+        values = raw_values.parse('cube_report', raw)
+    except raw_values.RawValuesError:
+        return [p.strip() for p in (raw or '').split(',') if p.strip()], None, []
+    failure_loads = [v for v in values[:3] if v is not None]
+    area = values.area_mm2
     compressive_strengths = []
     if area and failure_loads:
-        from calculations import compressive_strength_mpa
         for fl in failure_loads:
             try:
-                cs = compressive_strength_mpa(float(fl), area)
-                compressive_strengths.append(round(cs, 3))
-            except Exception:
+                # fl provided in kN
+                compressive_strengths.append(round(compressive_strength_mpa(fl, area), 3))
+            except ValueError:
                 compressive_strengths.append('N/A')
+    return failure_loads, area, compressive_strengths
+
+
+def test_report_inputs(tr, technician):
+    """Everything needed to render one test report, as plain data (HTML and ReportLab fields).
+
+    Needs the database and a request context; the rendering itself
+    (render_report_inputs) does not, so it can run on another thread.
+    """
+    sample = tr.sample
+    lab_name = 'Civil Engg Materials Lab - College'
+
+    # Prepare context similar to the preview route
+    failure_loads, area, compressive_strengths = cube_report_values(tr.raw_values)
 
     # Generate QR code data URI if qrcode available
     qr_data_uri = None
@@ -611,47 +872,170 @@ def generate_report(test_id):
         'failure_loads': failure_loads,
         'compressive_strengths': compressive_strengths,
         'test_name': tr.test_name,
-        'test_result': tr.calculated_result,
+        'test_result': results.format_result(tr),
         'test_status': tr.status,
-        'technician': current_user.username,
+        'technician': technician,
         'remarks': tr.remarks,
         'qr_code': qr_data_uri,
     }
 
-    # Render HTML and try converting with WeasyPrint; fallback to existing ReportLab generator
-    html = render_template('report_cube.html', **context)
+    html = None
+    if renderers.html_backend():
+        try:
+            html = render_template('report_cube.html', **context)
+        except Exception as e:
+            app.logger.warning('Report template failed, using ReportLab: %s', e)
+    sample_fields = {name: getattr(sample, name, '') for name in
+                     ('sample_id', 'sample_type', 'project_name', 'client_name', 'date_collected')}
+    return {
+        'html': html,
+        'base_url': request.base_url,
+        'fields': dict(lab_name=lab_name, sample=sample_fields, test_name=tr.test_name, raw_values=tr.raw_values,
+                       result=results.format_result(tr), technician=technician),
+    }
+
+
+def render_report_inputs(inputs, out_path):
+    """Render prepared report inputs to `out_path`. Returns the PDF engine used.
+
+    Uses the best renderer detected at startup (see renderers.py) and
+    raises if none of them works. The file is written next to `out_path` and
+    moved into place, so a reader never sees a half-written PDF.
+    """
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    tmp_path = f'{out_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    # Render with the preferred HTML backend found at startup (WeasyPrint, then
+    # pdfkit) in the warm renderer pool; fall back to the ReportLab layout
     used_html_pdf = None
-    # First try WeasyPrint (preferred) -> pdfkit (wkhtmltopdf) -> fallback to ReportLab
-    try:
-        from weasyprint import HTML
-        HTML(string=html, base_url=request.base_url).write_pdf(out_path)
-        used_html_pdf = 'weasyprint'
-    except Exception:
+    if inputs['html'] is not None:
         try:
-            import pdfkit
-            # pdfkit requires wkhtmltopdf binary available in PATH
-            pdfkit.from_string(html, out_path)
-            used_html_pdf = 'pdfkit'
-        except Exception:
-            # Fallback to old PDF generator (ReportLab)
-            try:
-                generate_test_report_pdf(out_path, lab_name=lab_name, sample=sample, test_name=tr.test_name,
-                                         raw_values=tr.raw_values, result=tr.calculated_result, technician=current_user.username)
-                used_html_pdf = 'reportlab'
-            except Exception as e:
-                flash(f'Failed to generate report: {e}', 'danger')
-                return redirect(url_for('sample_detail', sample_id=sample.id))
+            used_html_pdf = renderers.render_html(inputs['html'], tmp_path, base_url=inputs['base_url'])
+        except Exception as e:
+            app.logger.warning('HTML report rendering failed, using ReportLab: %s', e)
+    if used_html_pdf is None:
+        used_html_pdf = renderers.render_reportlab(tmp_path, **inputs['fields'])
+    os.replace(tmp_path, out_path)
+    return used_html_pdf
 
-    # Save a record
-    rpt = models.Report(sample_id=sample.id, test_result_id=tr.id, file_path=out_path, created_at=datetime.utcnow())
-    db.session.add(rpt)
-    db.session.commit()
+
+def render_test_report(tr, technician, out_path):
+    """Render the report for one test to `out_path`. Returns the PDF engine used."""
+    return render_report_inputs(test_report_inputs(tr, technician), out_path)
+
+
+# Renderers detected once at startup, in order of preference (part of the report cache key)
+REPORT_RENDERERS = '>'.join(renderers.available())
+
+
+def test_report_key(tr, technician):
+    """Cache key of a test report: hash of the test, sample and project rows, template and renderer."""
+    sample = tr.sample
+    return pdf_cache.cache_key('test_report', REPORT_RENDERERS, test=tr, sample=sample,
+                               project=sample.project if sample else None, technician=technician)
+
+
+def send_report(path, key, download_name):
+    """Send a cached PDF with its cache key as strong ETag (304 when the browser has it)."""
+    return send_file(path, as_attachment=True, download_name=download_name, etag=key,
+                     conditional=True, max_age=0)
+
+
+def run_test_report_job(job):
+    """report_jobs handler: render one test report into the PDF cache and return its path."""
+    tr = db.session.get(models.TestResult, job.params['test_id'])
+    if tr is None:
+        raise LookupError(f"Test {job.params['test_id']} no longer exists")
+    technician = job.params.get('technician', '')
+    key = test_report_key(tr, technician)
+    cached = pdf_cache.lookup(key)
+    if cached:
+        return cached
+    out_path = pdf_cache.path_for(key)
+    used_html_pdf = render_test_report(tr, technician, out_path)
+    pdf_cache.evict(keep=[out_path])
+
+    # Save a record (one per distinct rendered report)
+    if not models.Report.query.filter_by(test_result_id=tr.id, file_path=out_path).first():
+        rpt = models.Report(sample_id=tr.sample_id, test_result_id=tr.id, file_path=out_path,
+                            created_at=datetime.utcnow())
+        db.session.add(rpt)
+        db.session.commit()
 
     # Audit log
-    log_audit('GENERATE_REPORT', 'TestResult', tr.id, f'Generated PDF report for test {tr.test_name} (html_pdf={used_html_pdf})')
+    log_audit('GENERATE_REPORT', 'TestResult', tr.id,
+              f'Generated PDF report for test {tr.test_name} (html_pdf={used_html_pdf})', user_id=job.requested_by)
+    return out_path
+
+
+report_jobs.register('test_report', run_test_report_job)
+
+
+@app.route('/reports/generate/<int:test_id>')
+@login_required
+@role_required('Admin', 'Lab Technician', 'Engineer')
+def generate_report(test_id):
+    """Serve the cached PDF report for a test, or queue it and send the user to its status page."""
+    tr = models.TestResult.query.get_or_404(test_id)
+    key = test_report_key(tr, current_user.username)
+    cached = pdf_cache.lookup(key)
+    if cached:
+        return send_report(cached, key, f'report_{tr.id}.pdf')
+    params = {'test_id': tr.id, 'technician': current_user.username, 'base_url': request.url_root}
+    job, created = report_jobs.enqueue(db.session, 'test_report', params, user_id=current_user.id,
+                                       dedupe_params={'cache_key': key})
+    if created:
+        flash('Report queued; it will download when ready', 'info')
+    else:
+        flash('This report is already being generated', 'info')
+    return redirect(url_for('report_job', job_id=job.id))
+
+
+def visible_job_or_404(job_id):
+    job = models.ReportJob.query.get_or_404(job_id)
+    if job.requested_by != current_user.id and current_user.role != 'Admin':
+        abort(403)
+    return job
+
+
+@app.route('/reports/jobs/<int:job_id>')
+@login_required
+@role_required('Admin', 'Lab Technician', 'Engineer')
+def report_job(job_id):
+    """Status of a report job: JSON for polling (?format=json), otherwise an HTML page."""
+    job = visible_job_or_404(job_id)
+    status = {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'download_url': url_for('report_job_download', job_id=job.id) if job.status == 'done' else None,
+    }
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return jsonify(status)
+    return render_template('report_job.html', job=job, status=status)
 
-    flash('Report generated', 'success')
-    return send_file(out_path, as_attachment=True)
+
+@app.route('/reports/jobs/<int:job_id>/download')
+@login_required
+@role_required('Admin', 'Lab Technician', 'Engineer')
+def report_job_download(job_id):
+    job = visible_job_or_404(job_id)
+    if job.status == 'done' and not (job.result_path and os.path.exists(job.result_path)):
+        # The file was evicted from the PDF cache: make it again instead of linking back here
+        job = report_jobs.rerun(db.session, job)
+        flash('The report file is no longer available; it is being generated again', 'info')
+        return redirect(url_for('report_job', job_id=job.id))
+    if job.status != 'done':
+        flash('Report is not ready yet', 'warning')
+        return redirect(url_for('report_job', job_id=job.id))
+    key = os.path.splitext(os.path.basename(job.result_path))[0]
+    name = f"report_{job.params['test_id']}.pdf" if 'test_id' in job.params else os.path.basename(job.result_path)
+    return send_report(job.result_path, key, name)
 
 
 @app.route('/reports/preview/<int:test_id>')
@@ -665,32 +1049,7 @@ def preview_report(test_id):
     tr = models.TestResult.query.get_or_404(test_id)
     sample = tr.sample
     # parse raw values (expect comma-separated failure loads and optional area)
-    parts = [p.strip() for p in (tr.raw_values or '').split(',') if p.strip()]
-    failure_loads = []
-    try:
-        for v in parts[:3]:
-            failure_loads.append(float(v))
-    except Exception:
-        failure_loads = parts  # keep raw strings if parse fails
-
-    # compute compressive strengths if area provided (assume last value is area mm2)
-    compressive_strengths = []
-    area = None
-    if len(parts) >= 4:
-        try:
-            area = float(parts[3])
-        except Exception:
-            area = None
-
-    if area and failure_loads:
-        from calculations import compressive_strength_mpa
-        for fl in failure_loads:
-            try:
-                # fl provided in kN
-                cs = compressive_strength_mpa(float(fl), area)
-                compressive_strengths.append(round(cs, 3))
-            except Exception:
-                compressive_strengths.append('N/A')
+    failure_loads, area, compressive_strengths = cube_report_values(tr.raw_values)
 
     context = {
         'sample': sample,
@@ -710,190 +1069,333 @@ def preview_report(test_id):
 
     return render_template('report_cube.html', **context)
 
+def batch_report_scope(test_ids, project_id):
+    """Describe a batch selection: (title, subtitle, download name, audit entity, test count)."""
+    query = models.TestResult.query.join(models.Sample)
+    if test_ids is not None:
+        query = query.filter(models.TestResult.id.in_(test_ids))
+    if project_id is not None:
+        query = query.filter(models.Sample.project_id == project_id)
+    test_count = query.count()
+    if project_id is not None:
+        proj = db.session.get(models.Project, project_id)
+        name = proj.project_name if proj else f'#{project_id}'
+        code = proj.project_code if proj else project_id
+        return 'Batch Test Report', f'Project: {name}', f'batch_project_{code}.pdf', ('Project', project_id), test_count
+    sample_ids = [s for (s,) in query.with_entities(models.Sample.id).distinct().limit(2)]
+    if len(sample_ids) == 1:
+        sample = db.session.get(models.Sample, sample_ids[0])
+        return ('Batch Test Report', f'Sample: {sample.sample_id}', f'batch_{sample.sample_id}.pdf',
+                ('Sample', sample.id), test_count)
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    return 'Batch Test Report', 'Multiple samples', f'batch_{stamp}.pdf', ('Sample', None), test_count
+
+
+def run_batch_report_job(job):
+    """report_jobs handler: write a batch report to reports/batch_<job id>.pdf."""
+    params = job.params
+    title, subtitle, _, (entity, entity_id), _ = batch_report_scope(params.get('test_ids'), params.get('project_id'))
+    os.makedirs('reports', exist_ok=True)
+    out_path = os.path.abspath(os.path.join('reports', f'batch_{job.id}.pdf'))
+    summary = batch_reports.write_batch_pdf(
+        out_path, batch_reports.sections(params.get('test_ids'), params.get('project_id'), session=db.session),
+        title, subtitle)
+    rpt = models.Report(sample_id=entity_id if entity == 'Sample' else None, test_result_id=None,
+                        file_path=out_path, created_at=datetime.utcnow())
+    db.session.add(rpt)
+    db.session.commit()
+    log_audit('GENERATE_BATCH_REPORT', entity, entity_id,
+              f"Generated batch report for {summary['tests']} tests in {summary['samples']} samples",
+              user_id=job.requested_by)
+    return out_path
+
+
+report_jobs.register('batch_report', run_batch_report_job)
+
+
 @app.route('/reports/batch', methods=['POST'])
 @login_required
 @role_required('Admin', 'Lab Technician', 'Engineer')
 def generate_batch_report():
-    """Generate batch PDF report for multiple tests"""
-    test_ids = request.form.getlist('test_ids')
-    if not test_ids:
+    """Batch PDF report for the selected tests (test_ids) or a whole project (project_id).
+
+    The PDF is streamed to the browser while the sections are rendered; with
+    deliver=job it is written by a background job instead (for large projects).
+    """
+    test_ids = [int(i) for i in request.form.getlist('test_ids') if i.isdigit()] or None
+    project_id = request.form.get('project_id', type=int)
+    if test_ids is None and project_id is None:
         flash('No tests selected for batch report', 'danger')
-        return redirect(request.referrer or url_for('dashboard'))
-    
-    tests = models.TestResult.query.filter(models.TestResult.id.in_(test_ids)).all()
-    if not tests:
-        flash('No valid tests found', 'danger')
-        return redirect(request.referrer or url_for('dashboard'))
-    
-    # Group by sample
-    sample = tests[0].sample
-    lab_name = 'Civil Engg Materials Lab - College'
-    out_path = f"reports/batch_{sample.id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.pdf"
-    os.makedirs('reports', exist_ok=True)
-    
-    # Generate combined PDF with all tests
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.units import inch
-    
-    c = canvas.Canvas(out_path, pagesize=A4)
-    width, height = A4
-    
-    # Title page
-    c.setFont("Helvetica-Bold", 20)
-    c.drawCentredString(width/2, height-2*inch, lab_name)
-    c.setFont("Helvetica-Bold", 16)
-    c.drawCentredString(width/2, height-2.5*inch, "Batch Test Report")
-    c.setFont("Helvetica", 12)
-    c.drawCentredString(width/2, height-3*inch, f"Sample: {sample.sample_id}")
-    c.drawCentredString(width/2, height-3.3*inch, f"Project: {sample.project.project_name}")
-    c.drawCentredString(width/2, height-3.6*inch, f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}")
-    c.drawCentredString(width/2, height-3.9*inch, f"Total Tests: {len(tests)}")
-    
-    # New page for each test
-    for test in tests:
-        c.showPage()
-        y = height - inch
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(inch, y, f"Test: {test.test_name}")
-        y -= 0.3*inch
-        c.setFont("Helvetica", 11)
-        c.drawString(inch, y, f"Status: {test.status}")
-        y -= 0.3*inch
-        c.drawString(inch, y, f"Raw Values: {test.raw_values}")
-        y -= 0.3*inch
-        c.drawString(inch, y, f"Result: {test.calculated_result}")
-        y -= 0.3*inch
-        c.drawString(inch, y, f"Tested: {test.created_at.strftime('%Y-%m-%d')}")
-        if test.approved_at:
-            y -= 0.3*inch
-            c.drawString(inch, y, f"Approved: {test.approved_at.strftime('%Y-%m-%d')}")
-        if test.remarks:
-            y -= 0.3*inch
-            c.drawString(inch, y, f"Remarks: {test.remarks}")
-    
-    c.save()
-    
-    # Save report record
-    rpt = models.Report(sample_id=sample.id, test_result_id=None, file_path=out_path, created_at=datetime.utcnow())
-    db.session.add(rpt)
-    db.session.commit()
-    
-    log_audit('GENERATE_BATCH_REPORT', 'Sample', sample.id, f'Generated batch report for {len(tests)} tests')
-    
-    flash(f'Batch report generated for {len(tests)} tests', 'success')
-    return send_file(out_path, as_attachment=True, download_name=f'batch_{sample.sample_id}.pdf')
+        return redirect(request.referrer or url_for('index'))
 
-# --- Excel Export ---
-@app.route('/export/samples')
+    title, subtitle, download_name, (entity, entity_id), test_count = batch_report_scope(test_ids, project_id)
+    if not test_count:
+        flash('No valid tests found', 'danger')
+        return redirect(request.referrer or url_for('index'))
+
+    if request.form.get('deliver') == 'job':
+        params = {'test_ids': test_ids, 'project_id': project_id, 'base_url': request.url_root}
+        job, created = report_jobs.enqueue(db.session, 'batch_report', params, user_id=current_user.id)
+        flash('Batch report queued; it will download when ready' if created
+              else 'This batch report is already being generated', 'info')
+        return redirect(url_for('report_job', job_id=job.id))
+
+    log_audit('GENERATE_BATCH_REPORT', entity, entity_id, f'Streamed batch report for {test_count} tests')
+    chunks = batch_reports.build_batch_pdf(batch_reports.sections(test_ids, project_id, session=db.session),
+                                           title, subtitle)
+    return Response(stream_with_context(chunks), mimetype='application/pdf',
+                    headers={'Content-Disposition': f'attachment; filename="{download_name}"'})
+
+@app.route('/projects/<int:project_id>/reports.zip')
 @login_required
-def export_samples():
-    """Export all samples to Excel."""
+@role_required('Admin', 'Lab Technician', 'Engineer')
+@db_routing.read_replica
+def project_reports_zip(project_id):
+    """All approved test reports of a project as one ZIP, streamed while it is built.
+
+    Each test uses its cached render if the test is unchanged, else the newest
+    stored Report file, else it is rendered into the PDF cache just ahead of
+    the stream (see report_pack.py).
+    """
+    proj = models.Project.query.get_or_404(project_id)
+    technician = current_user.username
+    stored = dict(db.session.query(models.Report.test_result_id, models.Report.file_path)
+                  .join(models.TestResult, models.TestResult.id == models.Report.test_result_id)
+                  .join(models.Sample, models.Sample.id == models.TestResult.sample_id)
+                  .filter(models.Sample.project_id == project_id)
+                  .order_by(models.Report.id))  # newest row wins
+    tests = (models.TestResult.query.join(models.Sample)
+             .options(joinedload(models.TestResult.sample).joinedload(models.Sample.project))
+             .filter(models.Sample.project_id == project_id, models.TestResult.status == 'Approved')
+             .order_by(models.Sample.id, models.TestResult.id)
+             .yield_per(200))
+
+    def entries():
+        for tr in tests:
+            arcname = f'{report_pack.safe_name(tr.sample.sample_id)}/{tr.id}_{report_pack.safe_name(tr.test_name)}.pdf'
+            key = test_report_key(tr, technician)
+            path = pdf_cache.lookup(key)
+            if path is None and stored.get(tr.id) and os.path.exists(stored[tr.id]):
+                path = stored[tr.id]
+            yield arcname, path, key, None if path else test_report_inputs(tr, technician)
+
+    def resolve(entry):
+        arcname, path, key, inputs = entry
+        if path is None:
+            path = pdf_cache.path_for(key)
+            try:
+                render_report_inputs(inputs, path)
+            except Exception as e:
+                app.logger.warning('Report pack: rendering %s failed: %s', arcname, e)
+                return arcname, None
+        return arcname, path
+
+    def chunks():
+        yield from report_pack.stream_zip(report_pack.ordered_ahead(entries(), resolve))
+        pdf_cache.evict()
+
+    log_audit('DOWNLOAD_REPORT_PACK', 'Project', proj.id, f'Downloaded approved reports of {proj.project_name}')
+    name = f'{report_pack.safe_name(proj.project_code)}_reports.zip'
+    return Response(stream_with_context(chunks()), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+# --- Excel / CSV Export ---
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def export_response(name, title, query_for, available, default_columns, entity_type):
+    """Stream an export as CSV (?format=csv) or send it as a temporary write-only .xlsx.
+
+    `columns` picks columns; filters are read from the query string (see exports.py).
+    """
+    fmt = request.args.get('format', 'xlsx')
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Samples"
-        
-        # Header
-        headers = ['ID', 'Sample ID', 'Type', 'Project', 'Client', 'Date Collected', 'Test Count']
-        ws.append(headers)
-        
-        # Style header
-        for cell in ws[1]:
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        
-        # Data
-        samples = models.Sample.query.all()
-        for s in samples:
-            project_name = s.project.project_name if s.project else (s.project_name or 'N/A')
-            ws.append([s.id, s.sample_id, s.sample_type, project_name, 
-                      s.client_name, s.date_collected, len(s.tests)])
-        
-        # Save
-        output_path = 'reports/samples_export.xlsx'
-        wb.save(output_path)
-        
-        log_audit('EXPORT', 'Sample', None, f'Exported {len(samples)} samples to Excel')
-        
-        return send_file(output_path, as_attachment=True, download_name='samples.xlsx')
-    except ImportError:
-        flash('openpyxl not installed. Run: pip install openpyxl', 'danger')
-        return redirect(url_for('samples'))
-    except Exception as e:
+        columns = exports.pick_columns(available, request.args.getlist('columns'), default_columns)
+        query = query_for(request.args, db.session)
+    except (exports.ExportError, ValueError) as e:
         flash(f'Error exporting: {e}', 'danger')
         return redirect(url_for('samples'))
+    header = exports.headers(columns, available)
+    data = exports.rows(db.session, query, columns, available)
+
+    if fmt == 'csv':
+        def generate():
+            counter = []
+            yield from exports.stream_csv(header, data, counter)
+            log_audit('EXPORT', entity_type, None, f'Exported {counter[0]} {name} to CSV')
+        return Response(stream_with_context(generate()), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename="{name}.csv"'})
 
-@app.route('/export/tests')
-@login_required
-def export_tests():
-    """Export all test results to Excel."""
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Test Results"
-        
-        # Header
-        headers = ['Test ID', 'Sample ID', 'Test Name', 'Raw Values', 'Result', 'Status', 'Date Tested', 'Approved By']
-        ws.append(headers)
-        
-        # Style header
-        for cell in ws[1]:
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        
-        # Data
-        tests = models.TestResult.query.all()
-        for t in tests:
-            approved_by = t.approver.username if t.approver else 'N/A'
-            ws.append([t.id, t.sample.sample_id, t.test_name, t.raw_values, 
-                      t.calculated_result, t.status or 'Pending', 
-                      t.date_tested.strftime('%Y-%m-%d') if t.date_tested else '', approved_by])
-        
-        # Save
-        output_path = 'reports/tests_export.xlsx'
-        wb.save(output_path)
-        
-        log_audit('EXPORT', 'TestResult', None, f'Exported {len(tests)} tests to Excel')
-        
-        return send_file(output_path, as_attachment=True, download_name='tests.xlsx')
+        path, count = exports.write_xlsx(title, header, data)
     except ImportError:
         flash('openpyxl not installed. Run: pip install openpyxl', 'danger')
         return redirect(url_for('samples'))
     except Exception as e:
         flash(f'Error exporting: {e}', 'danger')
         return redirect(url_for('samples'))
+    log_audit('EXPORT', entity_type, None, f'Exported {count} {name} to Excel')
+    return Response(exports.read_and_delete(path), mimetype=XLSX_MIMETYPE,
+                    headers={'Content-Disposition': f'attachment; filename="{name}.xlsx"',
+                             'Content-Length': str(os.path.getsize(path))})
+
+
+@app.route('/export/samples')
+@login_required
+@db_routing.read_replica
+def export_samples():
+    """Export samples to Excel or CSV."""
+    return export_response('samples', 'Samples', exports.sample_query, exports.SAMPLE_COLUMNS,
+                           exports.DEFAULT_SAMPLE_COLUMNS, 'Sample')
+
+
+@app.route('/export/tests')
+@login_required
+@db_routing.read_replica
+def export_tests():
+    """Export test results to Excel or CSV."""
+    return export_response('tests', 'Test Results', exports.test_query, exports.TEST_COLUMNS,
+                           exports.DEFAULT_TEST_COLUMNS, 'TestResult')
 
 # --- Audit Log ---
-def log_audit(action, entity_type, entity_id, details):
-    """Helper function to create audit log entries."""
-    try:
-        log = models.AuditLog(
-            user_id=current_user.id if current_user.is_authenticated else None,
-            action=action,
-            entity_type=entity_type,
-            entity_id=entity_id,
-            details=details,
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
-    except Exception:
-        pass  # Don't fail operations if audit logging fails
+def log_audit(action, entity_type, entity_id, details, user_id=None, sync=False):
+    """Record an audit log entry.
+
+    The entry is handed to the audit writer, which inserts it in a batch from
+    a background thread (see audit.py); the request's session is neither
+    flushed nor committed. With sync=True the row is added to the session
+    instead, so it is committed by the caller's next commit together with
+    the change it describes; call it before that commit.
+
+    `user_id` defaults to the logged-in user; background jobs pass the user
+    who requested them.
+    """
+    if user_id is None and current_user and current_user.is_authenticated:
+        user_id = current_user.id
+    row = audit.entry(action, entity_type, entity_id, details, user_id=user_id)
+    if sync:
+        db.session.add(models.AuditLog(**row))
+    else:
+        audit.record(row)
 
 @app.route('/audit/logs')
 @login_required
 @role_required('Admin')
 def audit_logs():
-    """View audit logs."""
-    logs = models.AuditLog.query.order_by(models.AuditLog.timestamp.desc()).limit(100).all()
-    return render_template('audit_logs.html', logs=logs)
+    """View audit logs, newest first, filtered by user, action, entity and date range."""
+    filters = audit_log_filters()
+    if filters is None:
+        return redirect(url_for('audit_logs'))
+    query, entry = audit_archive.log_query(db.session, filters['start'], filters['end'])
+    if filters['user_id'] is not None:
+        query = query.filter(entry.user_id == filters['user_id'])
+    if filters['action']:
+        query = query.filter(entry.action == filters['action'])
+    if filters['entity_type']:
+        query = query.filter(entry.entity_type == filters['entity_type'])
+    if filters['entity_id'] is not None:
+        query = query.filter(entry.entity_id == filters['entity_id'])
+    page = current_page(query.options(joinedload(entry.user)), entry.id)
+    page.approx_total = pagination.approximate_count(('audit_logs',) + tuple(sorted(request.args.items(multi=True))),
+                                                     query)
+    return render_template('audit_logs.html', logs=page, page=page,
+                           archived=audit_archive.archived_months(app.config['AUDIT_ARCHIVE_DIR']))
+
+
+def audit_log_filters():
+    """Audit log filters from request.args; None (after flashing why) when one is invalid."""
+    args = request.args
+    entity_id = args.get('entity_id', '').strip()
+    if entity_id and not entity_id.isdigit():
+        flash('Entity ID must be a number', 'danger')
+        return None
+    try:
+        filters = {
+            'start': audit_archive.parse_day(args.get('from'), 'From'),
+            'end': audit_archive.parse_day(args.get('to'), 'To', end=True),
+            'action': args.get('action', '').strip().upper(),
+            'entity_type': args.get('entity_type', '').strip(),
+            'entity_id': int(entity_id) if entity_id else None,
+            'user_id': None,
+        }
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return None
+    username = args.get('user', '').strip()
+    if username:
+        user = models.User.query.filter_by(username=username).first()
+        filters['user_id'] = user.id if user else -1  # unknown user: no entries
+    return filters
+
+
+@app.route('/audit/archive.jsonl')
+@login_required
+@role_required('Admin')
+def audit_archive_search():
+    """Archived audit entries matching the audit log filters, streamed as JSON lines."""
+    filters = audit_log_filters()
+    if filters is None:
+        return redirect(url_for('audit_logs'))
+    entries = audit_archive.read_archive(app.config['AUDIT_ARCHIVE_DIR'], filters['start'], filters['end'],
+                                         user_id=filters['user_id'], action=filters['action'],
+                                         entity_type=filters['entity_type'], entity_id=filters['entity_id'])
+    lines = (json.dumps(e) + '\n' for e in entries)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': 'attachment; filename=audit_archive.jsonl'})
+
+
+@app.route('/admin/cache')
+@login_required
+@role_required('Admin')
+def cache_metrics():
+    """Query cache hit/miss counts for this worker process."""
+    return jsonify(query_cache.metrics())
+
+
+@app.route('/admin/db')
+@login_required
+@role_required('Admin')
+def db_status():
+    """Engine settings, pool state and the replica used by read-only pages."""
+    return jsonify({'primary': db_engine.settings(db.engine), 'replica': db_routing.status()})
+
+
+@app.route('/admin/audit/metrics')
+@login_required
+@role_required('Admin')
+def audit_metrics():
+    """Audit writer queue depth, flush latency and spilled/dropped entries for this worker process."""
+    return jsonify(audit.metrics())
+
+
+@app.route('/admin/jobs')
+@login_required
+@role_required('Admin')
+def admin_jobs():
+    """Background report jobs with their retries, queue wait and run time."""
+    status_filter = request.args.get('status', '').strip()
+    query = models.ReportJob.query.options(joinedload(models.ReportJob.requester))
+    if status_filter:
+        query = query.filter(models.ReportJob.status == status_filter)
+    page = current_page(query, models.ReportJob.id)
+    return render_template('admin_jobs.html', jobs=page, page=page, status_filter=status_filter)
+
+
+@app.route('/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+@role_required('Admin')
+def admin_job_retry(job_id):
+    """Put a failed job back in the queue with a fresh set of attempts."""
+    job = models.ReportJob.query.get_or_404(job_id)
+    if job.status == 'failed':
+        queued = report_jobs.rerun(db.session, job)
+        if queued is not job:
+            flash(f'The same report is already queued as job {queued.id}', 'info')
+            return redirect(url_for('admin_jobs'))
+        log_audit('RETRY', 'ReportJob', job.id, f'Re-queued {job.kind} job', sync=True)
+        db.session.commit()
+        flash(f'Job {job.id} re-queued', 'success')
+    return redirect(url_for('admin_jobs'))
 
 
 # --- User management (Admin only) ---
@@ -901,8 +1403,9 @@ def audit_logs():
 @login_required
 @role_required('Admin')
 def users():
-    users = models.User.query.order_by(models.User.id.desc()).all()
-    return render_template('users.html', users=users)
+    page = current_page(models.User.query, models.User.id)
+    page.approx_total = pagination.approximate_count(('users',), models.User.query)
+    return render_template('users.html', users=page, page=page)
 
 
 @app.route('/users/new', methods=['GET', 'POST'])
@@ -982,7 +1485,10 @@ def internal_error(error):
 if __name__ == '__main__':
     # Ensure we run DB setup inside the app context
     with app.app_context():
-        db.create_all()
+        # Create missing tables and add columns/indexes introduced since the DB was created
+        # (already done on import unless SCHEMA_UPGRADE is off)
+        if not app.config['SCHEMA_UPGRADE']:
+            schema_upgrade.upgrade(db)
         # Create an admin user for quick testing if none exists
         try:
             if models.User.query.count() == 0:
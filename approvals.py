@@ -0,0 +1,105 @@
+"""
+approvals.py - Approve or reject many test results at once
+
+Instead of one POST, commit and page load per test, a set of test ids is
+reviewed in one transaction:
+
+* per chunk of ids, one `UPDATE test_results SET status, approved_by,
+  approved_at, remarks WHERE id IN (...) AND status = 'Pending'`, so a test
+  that someone else approved, rejected or deleted since the page was shown
+  is left alone;
+* the ids that UPDATE changed come from UPDATE ... RETURNING where the
+  database supports it. Elsewhere (MySQL) the Pending ids are first locked
+  with SELECT ... FOR UPDATE, and only those are updated; a rowcount that
+  does not match means the lock did not hold, and the review is rolled back.
+  Everything else is reported as skipped, so a double-submitted selection
+  updates, audits and counts each test once;
+* the audit rows for the updated tests are written with one executemany
+  insert, and the dashboard counters are adjusted with stats.add() (the
+  Core UPDATE skips the ORM flush that normally maintains them).
+"""
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import insert, select, update
+
+import models
+import stats
+
+CHUNK_SIZE = 500
+
+# decision -> (new status, audit action)
+DECISIONS = {'approve': ('Approved', 'APPROVE'), 'reject': ('Rejected', 'REJECT')}
+
+
+class ReviewError(ValueError):
+    """Bad review request (unknown decision, no ids, or a rejection without remarks)."""
+
+
+class ReviewConflict(ReviewError):
+    """Tests changed between locking and updating them; nothing was saved."""
+
+
+class ReviewResult(NamedTuple):
+    status: str
+    updated: List[int]
+    skipped: List[int]  # not Pending any more, or no such test
+
+
+def parse_ids(values: Iterable[str]) -> List[int]:
+    """Distinct test ids from form values, in the order given."""
+    ids = {}
+    for value in values:
+        try:
+            ids.setdefault(int(value))
+        except (TypeError, ValueError):
+            raise ReviewError(f'Invalid test id {value!r}')
+    return list(ids)
+
+
+def review(session, test_ids: List[int], decision: str, user_id: int, remarks: str = '',
+           chunk_size: int = CHUNK_SIZE, now: Optional[datetime] = None) -> ReviewResult:
+    """Approve or reject the Pending tests among `test_ids` and commit once."""
+    if decision not in DECISIONS:
+        raise ReviewError(f'Unknown decision {decision!r}')
+    if not test_ids:
+        raise ReviewError('Select at least one test')
+    remarks = (remarks or '').strip()
+    if decision == 'reject' and not remarks:
+        raise ReviewError('Remarks are required when rejecting a test')
+    status, action = DECISIONS[decision]
+    TestResult = models.TestResult
+    now = now or datetime.utcnow()
+    returning = session.get_bind(TestResult).dialect.update_returning
+
+    updated = []
+    for start in range(0, len(test_ids), chunk_size):
+        chunk = test_ids[start:start + chunk_size]
+        stmt = (update(TestResult).values(status=status, approved_by=user_id, approved_at=now, remarks=remarks)
+                .execution_options(synchronize_session=False))
+        if returning:
+            updated += session.execute(stmt.where(TestResult.id.in_(chunk), TestResult.status == 'Pending')
+                                       .returning(TestResult.id)).scalars().all()
+            continue
+        pending = session.execute(select(TestResult.id).where(TestResult.id.in_(chunk),
+                                                              TestResult.status == 'Pending')
+                                  .with_for_update()).scalars().all()
+        if not pending:
+            continue
+        count = session.execute(stmt.where(TestResult.id.in_(pending), TestResult.status == 'Pending')).rowcount
+        if count != len(pending):
+            session.rollback()
+            raise ReviewConflict('Some of the selected tests changed while they were being reviewed; '
+                                 'nothing was saved, please try again')
+        updated += pending
+
+    if updated:
+        details = f'{status} (bulk)' + (f': {remarks}' if remarks else '')
+        session.execute(insert(models.AuditLog), [
+            {'user_id': user_id, 'action': action, 'entity_type': 'TestResult', 'entity_id': id_,
+             'details': details, 'timestamp': now} for id_ in updated])
+        stats.add(session, {'tests_pending': -len(updated),
+                            'tests_approved': len(updated) if status == 'Approved' else 0})
+    session.commit()
+    done = set(updated)
+    return ReviewResult(status, sorted(done), [id_ for id_ in test_ids if id_ not in done])
@@ -0,0 +1,336 @@
+"""
+audit.py - Buffered, batched audit log writer
+
+log_audit() used to add an AuditLog row and commit the request's session on
+every call. That commit also flushed anything else pending in the session,
+and it doubled the commits (and fsyncs) of every write request. Entries now
+go to an AuditWriter instead:
+
+* record() puts the entry on a bounded in-memory queue and returns at once;
+* a background thread batch-inserts the queue with one executemany INSERT
+  every `flush_ms` milliseconds or `batch_rows` rows, whichever comes first,
+  on its own connection (never the request's session);
+* when the database is slow or down, entries are spilled to JSON-lines
+  files under `spill_dir` instead of blocking requests: the whole queue
+  when it is full, or a batch whose INSERT failed. Spilled entries are
+  written back once inserts succeed again. They are only dropped when the
+  spill directory is full or cannot be written, and are counted when that
+  happens.
+
+Entries that must be durable together with the change they describe are not
+sent here: log_audit(..., sync=True) adds the row to the caller's session so
+that it commits (or rolls back) with the business write.
+
+The thread is started on the first record(), so processes forked by a web
+server each get their own, and stop() (also run at exit) drains the queue.
+An in-memory SQLite database has a single shared connection that a second
+thread cannot use, so there every entry is written directly instead.
+
+When `seal_seconds` is set, the thread also seals the log into hash-chained
+Merkle blocks that often (see audit_chain.py).
+
+metrics() reports queue depth, flush latency, and spilled, replayed and
+dropped entry counts (served on /admin/audit/metrics).
+"""
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+
+import models
+
+QUEUE_SIZE = 10000
+BATCH_ROWS = 500
+FLUSH_MS = 200
+SPILL_MAX_BYTES = 100 * 1024 * 1024
+RETRY_SECONDS = 1.0  # pause after a failed insert before trying again
+REPLAY_STALE_SECONDS = 600  # a claimed spill file untouched this long is claimed again
+BLOCK_SIZE = 1024
+
+
+def entry(action: str, entity_type: str, entity_id: Optional[int], details: Optional[str],
+          user_id: Optional[int] = None, timestamp: Optional[datetime] = None) -> Dict[str, Any]:
+    """An audit_logs row as a dict, stamped now unless `timestamp` is given."""
+    return {'user_id': user_id, 'action': action, 'entity_type': entity_type, 'entity_id': entity_id,
+            'details': details, 'timestamp': timestamp or datetime.utcnow()}
+
+
+class AuditWriter:
+    """Queue of audit entries written to `engine` in batches by a background thread."""
+
+    def __init__(self, engine, buffered: bool = True, queue_size: int = QUEUE_SIZE, batch_rows: int = BATCH_ROWS,
+                 flush_ms: int = FLUSH_MS, spill_dir: Optional[str] = None, spill_max_bytes: int = SPILL_MAX_BYTES,
+                 seal_seconds: int = 0, block_size: int = BLOCK_SIZE):
+        self.engine = engine
+        self.buffered = buffered
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_ms / 1000
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.seal_seconds = seal_seconds
+        self.block_size = block_size
+        self._sealed_at = time.monotonic()
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()  # counters and the spill file
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._counts = {'recorded': 0, 'written': 0, 'flushes': 0, 'failed_flushes': 0,
+                        'spilled': 0, 'replayed': 0, 'dropped': 0, 'blocks_sealed': 0, 'failed_seals': 0}
+        self._latency = {'last_ms': None, 'max_ms': 0.0, 'total_ms': 0.0}
+
+    # -- producer side -----------------------------------------------------
+
+    def record(self, row: Dict[str, Any]) -> None:
+        """Queue one entry (see entry()). Never waits for the database and never raises."""
+        self._count('recorded')
+        if not self.buffered:
+            self._write([row])
+            return
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._spill([row])
+
+    def start(self) -> 'AuditWriter':
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, name='audit-writer', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """Stop the thread and write what is still queued."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    def flush(self) -> None:
+        """Write everything queued now, in this thread, then any spilled entries.
+
+        If an insert fails the rest of the queue is spilled too.
+        """
+        while True:
+            batch = self._drain(self.batch_rows)
+            if not batch:
+                break
+            if not self._write(batch):
+                rest = self._drain(self._queue.qsize())
+                if rest:
+                    self._spill(rest)
+                return
+        self._replay()
+
+    # -- writer thread -----------------------------------------------------
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            batch = self._take()
+            if batch:
+                if not self._write(batch):
+                    self._stop.wait(RETRY_SECONDS)
+            elif self.spill_dir:
+                self._replay()
+            if self.seal_seconds and time.monotonic() - self._sealed_at >= self.seal_seconds:
+                self._seal()
+
+    def _seal(self) -> None:
+        import audit_chain  # imports audit_archive, which needs the app's models first
+
+        self._sealed_at = time.monotonic()
+        try:
+            with self.engine.begin() as conn:
+                sealed = audit_chain.seal(conn, self.block_size)
+        except Exception as e:
+            self._count('failed_seals')
+            print(f'audit-writer: sealing failed: {type(e).__name__}: {e}')
+            return
+        self._count('blocks_sealed', sealed['blocks'])
+
+    def _take(self) -> List[Dict]:
+        """Wait for an entry, then gather more for up to flush_ms or batch_rows entries."""
+        try:
+            batch = [self._queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch + self._drain(self.batch_rows - len(batch))
+
+    def _drain(self, limit: int) -> List[Dict]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, rows: List[Dict]) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(insert(models.AuditLog.__table__), rows)
+
+    def _write(self, batch: List[Dict]) -> bool:
+        """Insert a batch; spill it if the insert fails. Returns whether it was inserted."""
+        started = time.perf_counter()
+        try:
+            self._insert(batch)
+        except Exception as e:
+            self._count('failed_flushes')
+            print(f'audit-writer: {type(e).__name__}: {e}; spilling {len(batch)} entries')
+            self._spill(batch)
+            return False
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._counts['flushes'] += 1
+            self._counts['written'] += len(batch)
+            self._latency['last_ms'] = elapsed
+            self._latency['max_ms'] = max(self._latency['max_ms'], elapsed)
+            self._latency['total_ms'] += elapsed
+        return True
+
+    # -- spill files -------------------------------------------------------
+
+    def _spill_path(self) -> str:
+        return os.path.join(self.spill_dir, f'audit-{os.getpid()}.jsonl')
+
+    def _spill_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in glob.glob(os.path.join(self.spill_dir, 'audit-*')))
+
+    def _spill(self, rows: List[Dict]) -> None:
+        lines = ''.join(json.dumps({**r, 'timestamp': r['timestamp'].isoformat()}) + '\n' for r in rows)
+        with self._lock:
+            try:
+                if not self.spill_dir or self._spill_bytes() + len(lines) > self.spill_max_bytes:
+                    raise OSError('audit spill directory is full' if self.spill_dir else 'no spill directory')
+                os.makedirs(self.spill_dir, exist_ok=True)
+                with open(self._spill_path(), 'a', encoding='utf-8') as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._counts['spilled'] += len(rows)
+            except (OSError, TypeError, ValueError) as e:
+                self._counts['dropped'] += len(rows)
+                print(f'audit-writer: dropped {len(rows)} entries ({e})')
+
+    def _claim_spill_files(self) -> List[str]:
+        """Rename spill files to <name>.<pid>.replay so only one writer replays each."""
+        claimed = []
+        now = time.time()
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, 'audit-*'))):
+            if path.endswith('.replay') and now - os.path.getmtime(path) < REPLAY_STALE_SECONDS:
+                continue  # being replayed by another thread or process
+            target = path[:path.index('.jsonl')] + f'.jsonl.{os.getpid()}.replay'
+            try:
+                with self._lock:  # _spill() must not append to a file while it is renamed
+                    os.rename(path, target)
+                os.utime(target)
+            except OSError:
+                continue  # claimed by someone else first
+            claimed.append(target)
+        return claimed
+
+    def _replay(self) -> None:
+        """Insert spilled entries again, oldest file first; stops at the first failure."""
+        if not self.spill_dir or not os.path.isdir(self.spill_dir):
+            return
+        for path in self._claim_spill_files():
+            with open(path, encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            for row in rows:
+                row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+            done = 0
+            try:
+                while done < len(rows):
+                    batch = rows[done:done + self.batch_rows]
+                    self._insert(batch)
+                    done += len(batch)
+                    self._count('replayed', len(batch))
+            except Exception as e:
+                self._count('failed_flushes')
+                print(f'audit-writer: replay of {os.path.basename(path)} failed: {type(e).__name__}: {e}')
+                os.remove(path)
+                self._count('spilled', -(len(rows) - done))  # counted again by _spill()
+                self._spill(rows[done:])
+                return
+            os.remove(path)
+
+    # -- metrics -----------------------------------------------------------
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += n
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            latency = dict(self._latency)
+            spill_bytes = self._spill_bytes() if self.spill_dir and os.path.isdir(self.spill_dir) else 0
+        flushes = counts['flushes']
+        return {
+            'mode': 'buffered' if self.buffered else 'direct',
+            'running': self._thread is not None and self._thread.is_alive(),
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            **counts,
+            'flush_latency_ms': {'last': latency['last_ms'], 'max': latency['max_ms'],
+                                 'avg': latency['total_ms'] / flushes if flushes else None},
+            'spill_bytes': spill_bytes,
+        }
+
+
+_writer: Optional[AuditWriter] = None
+
+
+def init_audit(app, engine) -> AuditWriter:
+    """Create the process's writer from the AUDIT_* settings of `app`."""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+    url = engine.url
+    in_memory = url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+    _writer = AuditWriter(engine, buffered=app.config['AUDIT_BUFFERED'] and not in_memory,
+                          queue_size=app.config['AUDIT_QUEUE_SIZE'], batch_rows=app.config['AUDIT_BATCH_ROWS'],
+                          flush_ms=app.config['AUDIT_FLUSH_MS'], spill_dir=app.config['AUDIT_SPILL_DIR'],
+                          seal_seconds=app.config['AUDIT_SEAL_SECONDS'], block_size=app.config['AUDIT_BLOCK_SIZE'])
+    return _writer
+
+
+def writer() -> AuditWriter:
+    return _writer
+
+
+def record(row: Dict[str, Any]) -> None:
+    _writer.record(row)
+
+
+def flush() -> None:
+    _writer.flush()
+
+
+def metrics() -> Dict[str, Any]:
+    return _writer.metrics() if _writer is not None else {}
+
+
+@atexit.register
+def _stop_at_exit():
+    if _writer is not None:
+        _writer.stop()
@@ -0,0 +1,340 @@
+"""
+audit_archive.py - Monthly audit log partitions and compressed archives
+
+audit_logs only grows. It is split by month of `timestamp`:
+
+* MySQL: real RANGE partitions p<YYYYMM> on TO_DAYS(timestamp) plus a
+  p_future catch-all (see schema.sql; partition_mysql_table() converts a
+  table created by db.create_all()). ensure_partitions() splits p_future so
+  the coming months get their own partition; queries with a time range are
+  pruned by MySQL itself.
+* SQLite (and other databases): rollover() moves the rows of finished months
+  out of audit_logs into rollover tables audit_logs_<YYYYMM>. log_query()
+  reads audit_logs plus the rollover tables that overlap the requested time
+  range with UNION ALL, so browsing works the same either way. The newest
+  row always stays in audit_logs so SQLite never hands out its id again.
+
+archive() writes every partition older than the retention window to
+<archive_dir>/audit_logs_<YYYYMM>.jsonl.gz (one JSON object per line, in id
+order), then drops the partition or rollover table. read_archive() streams
+the archived rows back with the same filters as the audit log page, one
+file at a time, so searching old months never loads a whole file.
+
+Run monthly, e.g. from cron:
+    python scripts/audit_maintenance.py archive --keep-months 12
+"""
+import glob
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, Index, MetaData, Table, delete, func, inspect, select, text, union_all
+from sqlalchemy.orm import aliased
+
+import models
+import schema_upgrade
+
+RETENTION_MONTHS = 12
+MYSQL_MONTHS_AHEAD = 3
+TABLE = 'audit_logs'
+ROLLOVER_RE = re.compile(r'^audit_logs_(\d{6})$')
+ARCHIVE_RE = re.compile(r'^audit_logs_(\d{6})\.jsonl\.gz$')
+BATCH_SIZE = 1000
+
+
+# ---------------------------------------------------------------------------
+# Months
+# ---------------------------------------------------------------------------
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month: datetime, n: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + n
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def month_key(month: datetime) -> str:
+    return month.strftime('%Y%m')
+
+
+def _parse_key(key: str) -> datetime:
+    return datetime.strptime(key, '%Y%m')
+
+
+def _is_mysql(conn) -> bool:
+    return conn.dialect.name in ('mysql', 'mariadb')
+
+
+# ---------------------------------------------------------------------------
+# Rollover tables (SQLite and other databases without partitioning)
+# ---------------------------------------------------------------------------
+
+def rollover_table(month: datetime, metadata: Optional[MetaData] = None) -> Table:
+    """The audit_logs_<YYYYMM> table: audit_logs' columns, without foreign keys."""
+    name = f'{TABLE}_{month_key(month)}'
+    columns = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+               for c in models.AuditLog.__table__.columns]
+    return Table(name, metadata if metadata is not None else MetaData(), *columns,
+                 Index(f'ix_{name}_timestamp', 'timestamp'),
+                 Index(f'ix_{name}_entity', 'entity_type', 'entity_id'),
+                 Index(f'ix_{name}_user', 'user_id'))
+
+
+def rollover_months(conn) -> List[datetime]:
+    """Months that have a rollover table, oldest first."""
+    names = inspect(conn).get_table_names()
+    return sorted(_parse_key(m.group(1)) for m in map(ROLLOVER_RE.match, names) if m)
+
+
+def upgrade_rollover_tables(engine) -> List[str]:
+    """Add columns that audit_logs gained since the rollover tables were created."""
+    with engine.connect() as conn:
+        months = rollover_months(conn)
+    metadata = MetaData()
+    for month in months:
+        rollover_table(month, metadata)
+    return schema_upgrade.add_missing_columns(metadata, engine)
+
+
+def rollover(conn, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Move rows of months before the current one into rollover tables. Returns {table: rows moved}.
+
+    On MySQL, makes sure partitions exist for the coming months instead.
+    """
+    now = now or datetime.utcnow()
+    if _is_mysql(conn):
+        ensure_partitions(conn, now)
+        return {}
+    log = models.AuditLog.__table__
+    current = month_start(now)
+    newest = conn.execute(select(func.max(log.c.id))).scalar()
+    oldest = conn.execute(select(func.min(log.c.timestamp)).where(log.c.timestamp < current)).scalar()
+    moved = {}
+    if newest is None or oldest is None:
+        return moved
+    month = month_start(oldest)
+    while month < current:
+        where = (log.c.timestamp >= month, log.c.timestamp < add_months(month, 1), log.c.id < newest)
+        if conn.execute(select(func.count()).select_from(log).where(*where)).scalar():
+            table = rollover_table(month)
+            table.create(conn, checkfirst=True)
+            result = conn.execute(table.insert().from_select([c.name for c in log.columns],
+                                                             select(*log.columns).where(*where)))
+            conn.execute(delete(log).where(*where))
+            moved[table.name] = result.rowcount
+        month = add_months(month, 1)
+    return moved
+
+
+# ---------------------------------------------------------------------------
+# MySQL partitions
+# ---------------------------------------------------------------------------
+
+def mysql_partitions(conn) -> List[Tuple[str, Optional[str]]]:
+    """(name, LESS THAN value) of audit_logs' partitions; empty when it is not partitioned."""
+    rows = conn.execute(text(
+        'SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL '
+        'ORDER BY PARTITION_ORDINAL_POSITION'), {'table': TABLE}).all()
+    return [(name, description) for name, description in rows]
+
+
+def _partition_clause(month: datetime) -> str:
+    return f"PARTITION p{month_key(month)} VALUES LESS THAN (TO_DAYS('{add_months(month, 1):%Y-%m-%d}'))"
+
+
+def partition_mysql_table(conn, now: Optional[datetime] = None) -> List[str]:
+    """Convert a plain audit_logs table into monthly partitions. Returns the statements run.
+
+    MySQL requires the partitioning column in the primary key and does not
+    allow foreign keys on partitioned tables, so the user_id foreign key is
+    dropped and the primary key becomes (id, timestamp).
+    """
+    now = now or datetime.utcnow()
+    if mysql_partitions(conn):
+        return []
+    log = models.AuditLog.__table__
+    first = conn.execute(select(func.min(log.c.timestamp))).scalar() or now
+    months, month = [], month_start(first)
+    while month <= add_months(month_start(now), MYSQL_MONTHS_AHEAD):
+        months.append(month)
+        month = add_months(month, 1)
+    statements = [f'ALTER TABLE {TABLE} DROP FOREIGN KEY {fk["name"]}'
+                  for fk in inspect(conn).get_foreign_keys(TABLE) if fk.get('name')]
+    statements.append(f'ALTER TABLE {TABLE} DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)')
+    statements.append(f'ALTER TABLE {TABLE} PARTITION BY RANGE (TO_DAYS(timestamp)) ('
+                      + ', '.join(_partition_clause(m) for m in months)
+                      + ', PARTITION p_future VALUES LESS THAN MAXVALUE)')
+    for statement in statements:
+        conn.execute(text(statement))
+    return statements
+
+
+def ensure_partitions(conn, now: Optional[datetime] = None, ahead: int = MYSQL_MONTHS_AHEAD) -> List[str]:
+    """Split p_future so that this month and the next `ahead` months have a partition."""
+    now = now or datetime.utcnow()
+    names = {name for name, _ in mysql_partitions(conn)}
+    if 'p_future' not in names:
+        return []  # not partitioned (see partition_mysql_table)
+    existing = [_parse_key(n[1:]) for n in names if re.match(r'^p\d{6}$', n)]
+    month = add_months(max(existing), 1) if existing else month_start(now)
+    statements = []
+    while month <= add_months(month_start(now), ahead):
+        statements.append(f'ALTER TABLE {TABLE} REORGANIZE PARTITION p_future INTO '
+                          f'({_partition_clause(month)}, PARTITION p_future VALUES LESS THAN MAXVALUE)')
+        month = add_months(month, 1)
+    for statement in statements:
+        conn.execute(text(statement))
+    return statements
+
+
+def partition_months(conn) -> List[datetime]:
+    """Months split out of the live data: MySQL partitions or rollover tables, oldest first."""
+    if _is_mysql(conn):
+        return sorted(_parse_key(name[1:]) for name, _ in mysql_partitions(conn) if re.match(r'^p\d{6}$', name))
+    return rollover_months(conn)
+
+
+# ---------------------------------------------------------------------------
+# Browsing
+# ---------------------------------------------------------------------------
+
+def entries_table(conn, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """audit_logs, or audit_logs UNION ALL the rollover tables that overlap [start, end).
+
+    Leaving out the other rollover tables works like MySQL's partition
+    pruning. The result has audit_logs' columns.
+    """
+    log = models.AuditLog.__table__
+    months = [] if _is_mysql(conn) else [
+        m for m in rollover_months(conn)
+        if (start is None or add_months(m, 1) > start) and (end is None or m < end)]
+    if not months:
+        return log
+    tables = [log] + [rollover_table(m) for m in months]
+    return union_all(*[select(*[t.c[c.name] for c in log.columns]) for t in tables]).subquery('audit_logs_all')
+
+
+def log_query(session, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """ORM query of audit entries across audit_logs and its rollover tables (see entries_table()).
+
+    Returns (query, entity); filter and order on the entity's columns.
+    """
+    table = entries_table(session.connection(), start, end)
+    entity = models.AuditLog if table is models.AuditLog.__table__ else aliased(models.AuditLog, table)
+    query = session.query(entity)
+    if start is not None:
+        query = query.filter(entity.timestamp >= start)
+    if end is not None:
+        query = query.filter(entity.timestamp < end)
+    return query, entity
+
+
+# ---------------------------------------------------------------------------
+# Archival
+# ---------------------------------------------------------------------------
+
+def _row_dict(row) -> Dict:
+    data = dict(row._mapping)
+    for name in ('timestamp', 'inserted_at'):
+        data[name] = data[name].isoformat() if data[name] else None
+    return data
+
+
+def archive_path(archive_dir: str, month: datetime) -> str:
+    return os.path.join(archive_dir, f'{TABLE}_{month_key(month)}.jsonl.gz')
+
+
+def archive(conn, archive_dir: str, keep_months: int = RETENTION_MONTHS,
+            now: Optional[datetime] = None) -> Dict[str, int]:
+    """Write partitions older than `keep_months` to compressed JSONL and drop them.
+
+    Returns {archive path: rows written}. A month archived before (late
+    entries) is rewritten with the old and new rows together.
+    """
+    now = now or datetime.utcnow()
+    rollover(conn, now)
+    cutoff = add_months(month_start(now), -keep_months)
+    log = models.AuditLog.__table__
+    os.makedirs(archive_dir, exist_ok=True)
+    written = {}
+    for month in partition_months(conn):
+        if month >= cutoff:
+            continue
+        if _is_mysql(conn):
+            source = select(*log.columns).where(log.c.timestamp >= month, log.c.timestamp < add_months(month, 1))
+        else:
+            table = rollover_table(month)
+            source = select(*table.columns)
+        path = archive_path(archive_dir, month)
+        tmp = path + '.tmp'
+        count = 0
+        with gzip.open(tmp, 'wt', encoding='utf-8') as out:
+            if os.path.exists(path):
+                with gzip.open(path, 'rt', encoding='utf-8') as previous:
+                    for line in previous:
+                        out.write(line)
+                        count += 1
+            ordered = source.order_by(source.selected_columns.id).execution_options(yield_per=BATCH_SIZE)
+            for row in conn.execute(ordered):
+                out.write(json.dumps(_row_dict(row)) + '\n')
+                count += 1
+        with open(tmp, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        if _is_mysql(conn):
+            conn.execute(text(f'ALTER TABLE {TABLE} DROP PARTITION p{month_key(month)}'))
+        else:
+            table.drop(conn)
+        written[path] = count
+    return written
+
+
+def archived_months(archive_dir: str) -> List[datetime]:
+    names = (os.path.basename(p) for p in glob.glob(os.path.join(archive_dir, f'{TABLE}_*.jsonl.gz')))
+    return sorted(_parse_key(m.group(1)) for m in map(ARCHIVE_RE.match, names) if m)
+
+
+def read_archive(archive_dir: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 user_id: Optional[int] = None, action: Optional[str] = None, entity_type: Optional[str] = None,
+                 entity_id: Optional[int] = None, text_filter: Optional[str] = None) -> Iterator[Dict]:
+    """Stream archived entries matching the filters, oldest first; files outside [start, end) are skipped."""
+    needle = text_filter.lower() if text_filter else None
+    for month in archived_months(archive_dir):
+        if (start is not None and add_months(month, 1) <= start) or (end is not None and month >= end):
+            continue
+        with gzip.open(archive_path(archive_dir, month), 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                stamp = datetime.fromisoformat(row['timestamp']) if row.get('timestamp') else None
+                if start is not None and (stamp is None or stamp < start):
+                    continue
+                if end is not None and (stamp is None or stamp >= end):
+                    continue
+                if user_id is not None and row.get('user_id') != user_id:
+                    continue
+                if action and row.get('action') != action:
+                    continue
+                if entity_type and row.get('entity_type') != entity_type:
+                    continue
+                if entity_id is not None and row.get('entity_id') != entity_id:
+                    continue
+                if needle and needle not in (row.get('details') or '').lower():
+                    continue
+                yield row
+
+
+def parse_day(value: Optional[str], name: str, end: bool = False) -> Optional[datetime]:
+    """YYYY-MM-DD as a datetime; with end=True the start of the following day (an exclusive bound)."""
+    if not value:
+        return None
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'{name} must be YYYY-MM-DD')
+    return day + timedelta(days=1) if end else day
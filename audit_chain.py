@@ -0,0 +1,416 @@
+"""
+audit_chain.py - Hash chain and Merkle blocks over the audit log
+
+Proves that audit_logs rows were not edited, removed or slipped in after
+the fact, without re-hashing the whole table for every check.
+
+Sealing (seal(), run by the audit writer every AUDIT_SEAL_SECONDS and by
+scripts/audit_chain.py) works in id order:
+
+* every entry gets a chain hash, sha256(previous chain hash + leaf hash),
+  where the leaf hash covers the entry's id, user, action, entity, details
+  and timestamp;
+* every `block_size` chained entries form a block in audit_blocks, holding
+  the Merkle root of their leaf hashes (RFC 6962 tree), the chain hashes
+  before and after them, and a block hash linking it to the previous block.
+
+Entries are sealed once they were inserted SEAL_GRACE_SECONDS ago, so
+transactions that committed a lower id late are not skipped. The cut-off uses
+inserted_at, not timestamp: spilled entries replayed by audit.py keep their
+old timestamps but get new, higher ids. Hashes depend only on the
+data, so two sealers running at once compute the same values; the block
+numbers are primary keys, so only one of them can store a block.
+
+Checks:
+
+* prove() / verify_proof() check one entry in O(log n) hashes: its path to
+  its block's Merkle root, then that root's path to the root over all
+  blocks (head()). Publish head() somewhere outside the database (a signed
+  email, a ticket) to detect edits to audit_blocks as well.
+* verify() re-checks whole blocks (optionally only those overlapping a date
+  range) in a process pool and stops at the first divergent block. Blocks
+  of archived months are read from the archive files (see audit_archive.py).
+"""
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import audit_archive
+import models
+
+GENESIS = '0' * 64
+BLOCK_SIZE = 1024
+SEAL_GRACE_SECONDS = 60
+CHAIN_BATCH = 1000
+
+# The entry fields covered by the hashes, in this order
+FIELDS = ('id', 'user_id', 'action', 'entity_type', 'entity_id', 'details', 'timestamp')
+
+
+class ChainError(ValueError):
+    """An entry that cannot be proven (not sealed yet, or not found)."""
+
+
+# ---------------------------------------------------------------------------
+# Hashing
+# ---------------------------------------------------------------------------
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def leaf_hash(entry) -> bytes:
+    """Hash of one entry (a row or a dict from the archive), as a Merkle leaf."""
+    get = entry.get if isinstance(entry, dict) else lambda name: getattr(entry, name)
+    data = json.dumps([_value(get(name)) for name in FIELDS], separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(b'\x00' + data.encode('utf-8')).digest()
+
+
+def chain_next(prev_hash: str, leaf: bytes) -> str:
+    return hashlib.sha256(bytes.fromhex(prev_hash) + leaf).hexdigest()
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def _split(n: int) -> int:
+    """Largest power of two smaller than n (n > 1)."""
+    k = 1
+    while k * 2 < n:
+        k *= 2
+    return k
+
+
+def merkle_root(leaves: Sequence[bytes]) -> bytes:
+    """RFC 6962 Merkle tree hash of already-hashed leaves."""
+    if not leaves:
+        return hashlib.sha256(b'').digest()
+    if len(leaves) == 1:
+        return leaves[0]
+    k = _split(len(leaves))
+    return _node(merkle_root(leaves[:k]), merkle_root(leaves[k:]))
+
+
+def inclusion_path(leaves: Sequence[bytes], index: int) -> List[bytes]:
+    """Sibling hashes from leaf `index` up to the root (RFC 6962 audit path)."""
+    if len(leaves) <= 1:
+        return []
+    k = _split(len(leaves))
+    if index < k:
+        return inclusion_path(leaves[:k], index) + [merkle_root(leaves[k:])]
+    return inclusion_path(leaves[k:], index - k) + [merkle_root(leaves[:k])]
+
+
+def root_from_path(leaf: bytes, index: int, size: int, path: Sequence[bytes]) -> Optional[bytes]:
+    """The root that `path` leads to from `leaf` (RFC 9162 2.1.3.2), or None if the path is malformed."""
+    if index >= size:
+        return None
+    fn, sn, node = index, size - 1, leaf
+    for sibling in path:
+        if sn == 0:
+            return None
+        if fn & 1 or fn == sn:
+            node = _node(sibling, node)
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            node = _node(node, sibling)
+        fn >>= 1
+        sn >>= 1
+    return node if sn == 0 else None
+
+
+def block_hash(prev_block_hash: str, block) -> str:
+    get = block.get if isinstance(block, dict) else lambda name: getattr(block, name)
+    data = f"{prev_block_hash}|{get('merkle_root')}|{get('last_hash')}|{get('first_id')}|{get('last_id')}|" \
+           f"{get('entries')}"
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Sealing
+# ---------------------------------------------------------------------------
+
+def _last_block(conn):
+    Block = models.AuditBlock.__table__
+    return conn.execute(select(Block).order_by(Block.c.id.desc()).limit(1)).first()
+
+
+def seal(conn, block_size: int = BLOCK_SIZE, now: Optional[datetime] = None,
+         grace_seconds: int = SEAL_GRACE_SECONDS) -> Dict[str, int]:
+    """Chain new entries and store every complete block. Returns {'chained': n, 'blocks': n}."""
+    log = models.AuditLog.__table__
+    now = now or datetime.utcnow()
+    last_block = _last_block(conn)
+    # Chained entries may already have been rolled over (see audit_archive.py)
+    entries = audit_archive.entries_table(conn, last_block.last_timestamp if last_block is not None else None)
+    last = conn.execute(select(entries.c.id, entries.c.chain_hash).where(entries.c.chain_hash.isnot(None))
+                        .order_by(entries.c.id.desc()).limit(1)).first()
+    if last is not None and (last_block is None or last.id > last_block.last_id):
+        after_id, prev = last.id, last.chain_hash
+    elif last_block is not None:
+        after_id, prev = last_block.last_id, last_block.last_hash
+    else:
+        after_id, prev = 0, GENESIS
+
+    # Stop before the first entry inserted inside the grace period (rows from
+    # before inserted_at existed fall back to their timestamp)
+    inserted = func.coalesce(log.c.inserted_at, log.c.timestamp)
+    recent = conn.execute(select(func.min(log.c.id)).where(
+        log.c.id > after_id, inserted >= now - timedelta(seconds=grace_seconds))).scalar()
+    query = select(*[log.c[name] for name in FIELDS]).where(log.c.id > after_id).order_by(log.c.id)
+    if recent is not None:
+        query = query.where(log.c.id < recent)
+    chained = 0
+    set_hash = update(log).where(log.c.id == bindparam('entry_id')).values(chain_hash=bindparam('hash'))
+    batch = []
+    for row in conn.execute(query).all():
+        prev = chain_next(prev, leaf_hash(row))
+        batch.append({'entry_id': row.id, 'hash': prev})
+        if len(batch) >= CHAIN_BATCH:
+            conn.execute(set_hash, batch)
+            chained += len(batch)
+            batch = []
+    if batch:
+        conn.execute(set_hash, batch)
+        chained += len(batch)
+
+    blocks = 0
+    while _store_next_block(conn, block_size, now):
+        blocks += 1
+    return {'chained': chained, 'blocks': blocks}
+
+
+def _store_next_block(conn, block_size: int, now: datetime) -> bool:
+    entries = audit_archive.entries_table(conn)
+    last_block = _last_block(conn)
+    after_id = last_block.last_id if last_block is not None else 0
+    rows = conn.execute(select(*[entries.c[name] for name in FIELDS], entries.c.chain_hash)
+                        .where(entries.c.id > after_id, entries.c.chain_hash.isnot(None))
+                        .order_by(entries.c.id).limit(block_size)).all()
+    if len(rows) < block_size:
+        return False
+    block = {
+        'id': (last_block.id if last_block is not None else 0) + 1,
+        'first_id': rows[0].id, 'last_id': rows[-1].id, 'entries': len(rows),
+        'first_timestamp': rows[0].timestamp, 'last_timestamp': rows[-1].timestamp,
+        'prev_hash': last_block.last_hash if last_block is not None else GENESIS,
+        'last_hash': rows[-1].chain_hash,
+        'merkle_root': merkle_root([leaf_hash(r) for r in rows]).hex(),
+        'sealed_at': now,
+    }
+    block['block_hash'] = block_hash(last_block.block_hash if last_block is not None else GENESIS, block)
+    try:
+        with conn.begin_nested():
+            conn.execute(insert(models.AuditBlock.__table__), block)
+    except IntegrityError:
+        return False  # another sealer stored this block first
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Single-entry proofs
+# ---------------------------------------------------------------------------
+
+def _block_rows(conn, block, archive_dir: Optional[str] = None) -> List:
+    """The entries of a block, from the database or (for archived months) the archive files."""
+    entries = audit_archive.entries_table(conn, block.first_timestamp, block.last_timestamp + timedelta(seconds=1))
+    rows = conn.execute(select(*[entries.c[name] for name in FIELDS], entries.c.chain_hash)
+                        .where(entries.c.id.between(block.first_id, block.last_id))
+                        .order_by(entries.c.id)).all()
+    if len(rows) == block.entries or not archive_dir:
+        return [tuple(r) for r in rows]
+    found = {r.id: tuple(r) for r in rows}
+    for entry in audit_archive.read_archive(archive_dir, block.first_timestamp,
+                                            block.last_timestamp + timedelta(seconds=1)):
+        if block.first_id <= entry['id'] <= block.last_id and entry['id'] not in found:
+            entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+            found[entry['id']] = tuple(entry.get(name) for name in FIELDS + ('chain_hash',))
+    return [found[i] for i in sorted(found)]
+
+
+def head(conn) -> Dict[str, Any]:
+    """Root over all block Merkle roots, with the block count and last block hash (publish this)."""
+    Block = models.AuditBlock.__table__
+    blocks = conn.execute(select(Block.c.merkle_root, Block.c.block_hash).order_by(Block.c.id)).all()
+    return {'blocks': len(blocks),
+            'root': merkle_root([bytes.fromhex(b.merkle_root) for b in blocks]).hex(),
+            'last_block_hash': blocks[-1].block_hash if blocks else GENESIS}
+
+
+def prove(conn, entry_id: int, archive_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Inclusion proof of one entry: its leaf, its path to the block root and that root's path to head()."""
+    Block = models.AuditBlock.__table__
+    block = conn.execute(select(Block).where(Block.c.first_id <= entry_id, Block.c.last_id >= entry_id)).first()
+    if block is None:
+        raise ChainError(f'Audit entry {entry_id} is not in a sealed block yet')
+    rows = _block_rows(conn, block, archive_dir)
+    index = next((i for i, r in enumerate(rows) if r[0] == entry_id), None)
+    if index is None:
+        raise ChainError(f'Audit entry {entry_id} was not found')
+    leaves = [leaf_hash(dict(zip(FIELDS, r))) for r in rows]
+    roots = [bytes.fromhex(r) for r in conn.execute(select(Block.c.merkle_root).order_by(Block.c.id)).scalars()]
+    return {
+        'entry_id': entry_id, 'leaf': leaves[index].hex(),
+        'block': block.id, 'index': index, 'entries': len(leaves),
+        'path': [h.hex() for h in inclusion_path(leaves, index)],
+        'block_root': block.merkle_root,
+        'block_index': block.id - 1, 'blocks': len(roots),
+        'block_path': [h.hex() for h in inclusion_path(roots, block.id - 1)],
+    }
+
+
+def verify_proof(entry, proof: Dict[str, Any], root: str) -> bool:
+    """Check `entry` (row or dict) against `proof` and a head() root: O(log n) hashes."""
+    leaf = leaf_hash(entry)
+    if leaf.hex() != proof['leaf']:
+        return False
+    block_root = root_from_path(leaf, proof['index'], proof['entries'], [bytes.fromhex(h) for h in proof['path']])
+    if block_root is None or block_root.hex() != proof['block_root']:
+        return False
+    top = root_from_path(block_root, proof['block_index'], proof['blocks'],
+                         [bytes.fromhex(h) for h in proof['block_path']])
+    return top is not None and top.hex() == root
+
+
+# ---------------------------------------------------------------------------
+# Full verification
+# ---------------------------------------------------------------------------
+
+def verify_block(block: Dict[str, Any], rows: List[tuple]) -> Optional[Dict[str, Any]]:
+    """Re-check one block's entries; None when intact, else {'reason', 'entry_id'}. Runs in the pool."""
+    ids = [r[0] for r in rows]
+    if len(rows) != block['entries'] or (ids and (ids[0] != block['first_id'] or ids[-1] != block['last_id'])):
+        expected = set(ids)
+        missing = next((i for i in range(block['first_id'], block['last_id'] + 1) if i not in expected), None)
+        return {'reason': f"expected {block['entries']} entries, found {len(rows)}", 'entry_id': missing}
+    prev = block['prev_hash']
+    leaves = []
+    for row in rows:
+        leaf = leaf_hash(dict(zip(FIELDS, row)))
+        leaves.append(leaf)
+        prev = chain_next(prev, leaf)
+        if row[len(FIELDS)] != prev:
+            return {'reason': 'entry does not match its chain hash', 'entry_id': row[0]}
+    if prev != block['last_hash']:
+        return {'reason': 'chain does not end at the block\'s last hash', 'entry_id': block['last_id']}
+    if merkle_root(leaves).hex() != block['merkle_root']:
+        return {'reason': 'Merkle root differs', 'entry_id': None}
+    return None
+
+
+def _blocks(conn, start: Optional[datetime], end: Optional[datetime]) -> Iterator:
+    Block = models.AuditBlock.__table__
+    query = select(Block).order_by(Block.c.id)
+    if start is not None:
+        query = query.where(Block.c.last_timestamp >= start)
+    if end is not None:
+        query = query.where(Block.c.first_timestamp < end)
+    return iter(conn.execute(query).all())
+
+
+def verify(conn, start: Optional[datetime] = None, end: Optional[datetime] = None, workers: int = 0,
+           archive_dir: Optional[str] = None, window: Optional[int] = None) -> Dict[str, Any]:
+    """Verify every block overlapping [start, end), stopping at the first divergent one.
+
+    Blocks are re-hashed in a pool of `workers` processes (0 = in this
+    process); this process reads the entries and checks the links between
+    blocks. Returns {'blocks', 'entries', 'ok', 'divergent': {...} or None}.
+    """
+    Block = models.AuditBlock.__table__
+    report = {'blocks': 0, 'entries': 0, 'ok': True, 'divergent': None}
+    blocks = _blocks(conn, start, end)
+
+    def divergent(block, reason, entry_id=None):
+        report['ok'] = False
+        report['divergent'] = {'block': block.id, 'first_id': block.first_id, 'last_id': block.last_id,
+                               'first_timestamp': block.first_timestamp.isoformat(),
+                               'last_timestamp': block.last_timestamp.isoformat(),
+                               'reason': reason, 'entry_id': entry_id}
+        return report
+
+    def jobs() -> Iterator[Tuple[Any, Optional[str], Dict, List]]:
+        previous = None
+        for block in blocks:
+            if previous is None and block.id > 1:
+                previous = conn.execute(select(Block).where(Block.c.id == block.id - 1)).first()
+            link = None
+            prev_hash = previous.last_hash if previous is not None else GENESIS
+            prev_block_hash = previous.block_hash if previous is not None else GENESIS
+            if block.prev_hash != prev_hash:
+                link = 'block does not continue the previous block\'s chain'
+            elif block.block_hash != block_hash(prev_block_hash, block):
+                link = 'block hash does not match its contents'
+            previous = block
+            yield block, link, dict(block._mapping), _block_rows(conn, block, archive_dir)
+
+    if workers and workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        window = window or workers * 2
+    else:
+        pool = None
+    try:
+        pending: List[Tuple[Any, Optional[str], Any, int]] = []
+        source = jobs()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < (window or 1):
+                try:
+                    block, link, data, rows = next(source)
+                except StopIteration:
+                    exhausted = True
+                    break
+                outcome = pool.submit(verify_block, data, rows) if pool else verify_block(data, rows)
+                pending.append((block, link, outcome, len(rows)))
+            if not pending:
+                break
+            block, link, outcome, count = pending.pop(0)
+            if link:
+                return divergent(block, link)
+            result = outcome.result() if pool else outcome
+            if result:
+                return divergent(block, result['reason'], result['entry_id'])
+            report['blocks'] += 1
+            report['entries'] += count
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    if end is None:
+        _verify_tail(conn, report)
+    return report
+
+
+def _verify_tail(conn, report: Dict[str, Any]) -> None:
+    """Check the chained entries after the last block, which no Merkle root covers yet."""
+    last_block = _last_block(conn)
+    after_id = last_block.last_id if last_block is not None else 0
+    prev = last_block.last_hash if last_block is not None else GENESIS
+    entries = audit_archive.entries_table(conn, last_block.last_timestamp if last_block is not None else None)
+    rows = conn.execute(select(*[entries.c[name] for name in FIELDS], entries.c.chain_hash)
+                        .where(entries.c.id > after_id, entries.c.chain_hash.isnot(None))
+                        .order_by(entries.c.id)).all()
+    for row in rows:
+        prev = chain_next(prev, leaf_hash(row))
+        if row.chain_hash != prev:
+            report['ok'] = False
+            report['divergent'] = {'block': None, 'first_id': after_id + 1, 'last_id': rows[-1].id,
+                                   'first_timestamp': None, 'last_timestamp': None,
+                                   'reason': 'entry after the last block does not match its chain hash',
+                                   'entry_id': row.id}
+            return
+    report['entries'] += len(rows)
+
+
+def unsealed(conn) -> int:
+    """Entries after the last block (chained or not), which only the next blocks will cover."""
+    log = models.AuditLog.__table__
+    last_block = _last_block(conn)
+    after_id = last_block.last_id if last_block is not None else 0
+    return conn.execute(select(func.count()).select_from(log).where(log.c.id > after_id)).scalar()
@@ -3,9 +3,20 @@ auto_calculations.py
 
 Wrapper to process raw input readings and run appropriate calculation functions
 so the user only needs to provide input readings and receives computed results.
+
+process_readings_many() does the same for large imports (bench sheets with tens
+of thousands of readings dicts): it streams the input in chunks, runs each test
+kind through the vectorized kernels in batch_calculations and can fan chunks out
+to a process pool.
 """
-from typing import Dict, Any
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Any, Iterable, Iterator, List
+import math
+
 import calculations
+import batch_calculations
 
 
 def process_readings(readings: Dict[str, Any]) -> Dict[str, Any]:
@@ -58,3 +69,149 @@ def process_readings(readings: Dict[str, Any]) -> Dict[str, Any]:
         results['atterberg'] = calculations.atterberg_limits(r['liquid_limit'], r['plastic_limit'])
 
     return results
+
+
+# Reading kind -> (result key, vectorized kernel, input fields in argument order).
+# Mirrors the branches of process_readings above; sieve is handled separately
+# because its input is a dict of sieve sizes rather than fixed fields.
+_KERNELS = {
+    'compressive': ('compressive_strength_mpa', batch_calculations.compressive_strength_mpa,
+                    ('load_kN', 'area_mm2')),
+    'flexural': ('flexural_strength_mpa', batch_calculations.flexural_strength_mpa,
+                 ('load_kN', 'length_mm', 'width_mm', 'depth_mm')),
+    'split_tensile': ('split_tensile_strength_mpa', batch_calculations.split_tensile_strength_mpa,
+                      ('load_kN', 'length_mm', 'diameter_mm')),
+    'water_absorption': ('water_absorption_percent', batch_calculations.water_absorption_percent,
+                         ('dry_mass_g', 'saturated_mass_g')),
+    'cbr': ('cbr_percent', batch_calculations.cbr_value,
+            ('load_at_penetration_kN', 'standard_load_kN')),
+    'proctor': ('proctor', batch_calculations.proctor_compaction,
+                ('dry_density_kgm3', 'water_content_percent')),
+    'atterberg': ('atterberg', batch_calculations.atterberg_limits,
+                  ('liquid_limit', 'plastic_limit')),
+}
+
+
+def _reading_error(e: Exception) -> str:
+    if isinstance(e, KeyError):
+        return f'Missing reading {e}'
+    return str(e)
+
+
+def _run_kernel(kind: str, chunk: List[Dict[str, Any]], outputs: List[Dict[str, Any]]) -> None:
+    """Run one fixed-field test kind for every item in the chunk that has it."""
+    result_key, kernel, fields = _KERNELS[kind]
+    positions, columns = [], [[] for _ in fields]
+    for pos, readings in enumerate(chunk):
+        if kind not in readings:
+            continue
+        try:
+            row = [float(readings[kind][f]) for f in fields]
+        except (KeyError, TypeError, ValueError) as e:
+            outputs[pos]['errors'][kind] = _reading_error(e)
+            continue
+        positions.append(pos)
+        for column, value in zip(columns, row):
+            column.append(value)
+    if not positions:
+        return
+
+    batch = kernel(*columns)
+    for i, pos in enumerate(positions):
+        if batch.invalid[i]:
+            outputs[pos]['errors'][kind] = batch.errors[i]
+        elif isinstance(batch.values, dict):
+            outputs[pos]['results'][result_key] = {k: float(v[i]) for k, v in batch.values.items()}
+        else:
+            outputs[pos]['results'][result_key] = float(batch.values[i])
+
+
+def _run_sieve(chunk: List[Dict[str, Any]], outputs: List[Dict[str, Any]]) -> None:
+    """Run sieve analysis, one matrix per distinct set of sieve sizes in the chunk."""
+    groups: Dict[tuple, List[tuple]] = {}
+    for pos, readings in enumerate(chunk):
+        if 'sieve' not in readings:
+            continue
+        try:
+            r = readings['sieve']
+            sizes = tuple(sorted(r['sieve_masses'].keys(), reverse=True))
+            row = [float(r['sieve_masses'][s]) for s in sizes]
+            total = float(r['total_mass'])
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            outputs[pos]['errors']['sieve'] = _reading_error(e)
+            continue
+        groups.setdefault(sizes, []).append((pos, row, total))
+
+    for sizes, items in groups.items():
+        batch = batch_calculations.sieve_analysis_summary(
+            sizes, [row for _, row, _ in items], [total for _, _, total in items])
+        v = batch.values
+        for i, (pos, row, _) in enumerate(items):
+            if batch.invalid[i]:
+                outputs[pos]['errors']['sieve'] = batch.errors[i]
+                continue
+            table = [{'sieve_mm': s, 'retained_g': chunk[pos]['sieve']['sieve_masses'][s],
+                      'percent_retained': float(v['percent_retained'][i, j]),
+                      'cumulative_retained': float(v['cumulative_retained'][i, j]),
+                      'percent_passing': float(v['percent_passing'][i, j])}
+                     for j, s in enumerate(sizes)]
+            summary: Dict[str, Any] = {'summary_table': table}
+            for key in ('D10', 'D30', 'D60', 'Cu', 'Cc'):
+                value = float(v[key][i])
+                summary[key] = None if math.isnan(value) else value
+            outputs[pos]['results']['sieve_analysis'] = summary
+
+
+def process_readings_chunk(chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Process a list of readings dicts with the vectorized kernels.
+
+    Readings are grouped by test kind so each kind is computed with a single
+    batch call. Returns one dict per input, in input order:
+      {'results': {...same keys as process_readings...}, 'errors': {kind: message}}
+    A failing reading only drops that test kind for that item.
+    """
+    outputs: List[Dict[str, Any]] = [{'results': {}, 'errors': {}} for _ in chunk]
+    for kind in _KERNELS:
+        _run_kernel(kind, chunk, outputs)
+    _run_sieve(chunk, outputs)
+    return outputs
+
+
+def process_readings_many(readings_iter: Iterable[Dict[str, Any]], workers: int = 1,
+                          chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Stream results for many readings dicts, in input order.
+
+    Args:
+      readings_iter: any iterable of readings dicts (read lazily, chunk by chunk)
+      workers: number of worker processes; 1 runs everything in this process
+      chunk_size: readings dicts per chunk sent to a worker
+
+    Yields one {'results': ..., 'errors': ...} dict per input (see
+    process_readings_chunk). At most 2 * workers chunks are held in memory
+    at a time, however long the input is.
+    """
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1')
+    it = iter(readings_iter)
+
+    def chunks():
+        while True:
+            chunk = list(islice(it, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    if workers <= 1:
+        for chunk in chunks():
+            yield from process_readings_chunk(chunk)
+        return
+
+    max_in_flight = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: deque = deque()
+        for chunk in chunks():
+            pending.append(pool.submit(process_readings_chunk, chunk))
+            if len(pending) >= max_in_flight:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,268 @@
+"""
+batch_calculations.py - Vectorized (NumPy) versions of the formulas in calculations.py
+
+Includes:
+- compressive_strength_mpa(load_kN, area_mm2)
+- flexural_strength_mpa(load_kN, length_mm, width_mm, depth_mm)
+- split_tensile_strength_mpa(load_kN, length_mm, diameter_mm)
+- water_absorption_percent(dry_mass_g, saturated_mass_g)
+- cbr_value(load_at_penetration_kN, standard_load_kN)
+- proctor_compaction(dry_density_kgm3, water_content_percent)
+- atterberg_limits(liquid_limit, plastic_limit)
+- sieve_analysis_summary(sieve_sizes, retained, total_mass=None, log_interpolation=False)
+
+Every function takes NumPy arrays (or anything np.asarray accepts: lists,
+tuples, scalars) and returns a BatchResult instead of raising. Rows that
+would make the scalar function raise ValueError are flagged in
+`BatchResult.invalid`, carry the same message in `BatchResult.errors` and
+hold NaN in the values. Valid rows are bit-identical to the scalar
+functions because the arithmetic is done in the same order.
+
+Run scripts/bench_batch_calculations.py to see the speedup over a Python loop.
+"""
+import math
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+
+class BatchResult(NamedTuple):
+    """Result of a batch calculation.
+
+    values:  float64 array (or dict of arrays for multi-value tests), NaN where invalid
+    invalid: boolean mask, True where the scalar function would have raised
+    errors:  object array with the scalar error message, or None for valid rows
+    """
+    values: Any
+    invalid: np.ndarray
+    errors: np.ndarray
+
+
+def _as_arrays(*args) -> Tuple[np.ndarray, ...]:
+    """Convert inputs to broadcast float64 arrays of a common shape."""
+    arrays = [np.asarray(a, dtype=np.float64) for a in args]
+    return tuple(np.broadcast_arrays(*arrays))
+
+
+def _checks(shape, checks: List[Tuple[np.ndarray, str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Build the invalid mask and error messages from (mask, message) pairs.
+
+    Checks are applied in order so a row gets the message of the first check
+    it fails, just like the first `raise` it would hit in calculations.py.
+    """
+    invalid = np.zeros(shape, dtype=bool)
+    errors = np.full(shape, None, dtype=object)
+    for mask, message in checks:
+        new = mask & ~invalid
+        errors[new] = message
+        invalid |= new
+    return invalid, errors
+
+
+def _finish(values: np.ndarray, invalid: np.ndarray, errors: np.ndarray) -> BatchResult:
+    values = np.where(invalid, np.nan, values)
+    return BatchResult(values, invalid, errors)
+
+
+def round_like_python(values, ndigits: int = 2) -> np.ndarray:
+    """Round an array exactly like the builtin round(float, ndigits).
+
+    np.round scales by 10**ndigits and rounds half to even in binary, while
+    Python rounds the exact decimal value of the float. They only disagree
+    when the scaled value sits (within a few ulps) on a .5 boundary, so those
+    few elements are re-rounded with the builtin.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rounded = np.round(values, ndigits)
+    scaled = values * (10.0 ** ndigits)
+    with np.errstate(invalid='ignore'):
+        distance = np.abs(scaled - np.floor(scaled) - 0.5)
+        ambiguous = np.isfinite(scaled) & (distance <= 4 * np.spacing(np.abs(scaled)))
+    if ambiguous.any():
+        idx = np.nonzero(ambiguous)
+        rounded[idx] = [round(float(v), ndigits) for v in values[idx]]
+    return rounded
+
+
+def compressive_strength_mpa(load_kN, area_mm2) -> BatchResult:
+    """Vectorized calculations.compressive_strength_mpa: (load_kN * 1000) / area_mm2."""
+    load_kN, area_mm2 = _as_arrays(load_kN, area_mm2)
+    invalid, errors = _checks(load_kN.shape, [(area_mm2 <= 0, 'Area must be positive')])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        strength = (load_kN * 1000.0) / area_mm2
+    return _finish(strength, invalid, errors)
+
+
+def flexural_strength_mpa(load_kN, length_mm, width_mm, depth_mm) -> BatchResult:
+    """Vectorized calculations.flexural_strength_mpa: (P * L) / (b * d^2)."""
+    load_kN, length_mm, width_mm, depth_mm = _as_arrays(load_kN, length_mm, width_mm, depth_mm)
+    invalid, errors = _checks(load_kN.shape, [
+        ((width_mm <= 0) | (depth_mm <= 0) | (length_mm <= 0), 'Dimensions must be positive'),
+    ])
+    load_N = load_kN * 1000.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        strength = (load_N * length_mm) / (width_mm * depth_mm * depth_mm)
+    return _finish(strength, invalid, errors)
+
+
+def split_tensile_strength_mpa(load_kN, length_mm, diameter_mm) -> BatchResult:
+    """Vectorized calculations.split_tensile_strength_mpa: (2 * P) / (pi * L * D)."""
+    load_kN, length_mm, diameter_mm = _as_arrays(load_kN, length_mm, diameter_mm)
+    invalid, errors = _checks(load_kN.shape, [
+        ((length_mm <= 0) | (diameter_mm <= 0), 'Dimensions must be positive'),
+    ])
+    load_N = load_kN * 1000.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        strength = (2.0 * load_N) / (math.pi * length_mm * diameter_mm)
+    return _finish(strength, invalid, errors)
+
+
+def water_absorption_percent(dry_mass_g, saturated_mass_g) -> BatchResult:
+    """Vectorized calculations.water_absorption_percent: ((Ws - Wd) / Wd) * 100."""
+    dry_mass_g, saturated_mass_g = _as_arrays(dry_mass_g, saturated_mass_g)
+    invalid, errors = _checks(dry_mass_g.shape, [
+        (dry_mass_g <= 0, 'Dry mass must be positive'),
+        (saturated_mass_g < dry_mass_g, 'Saturated mass cannot be less than dry mass'),
+    ])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        absorption = ((saturated_mass_g - dry_mass_g) / dry_mass_g) * 100.0
+    return _finish(absorption, invalid, errors)
+
+
+def cbr_value(load_at_penetration_kN, standard_load_kN) -> BatchResult:
+    """Vectorized calculations.cbr_value: (test load / standard load) * 100."""
+    load, standard = _as_arrays(load_at_penetration_kN, standard_load_kN)
+    invalid, errors = _checks(load.shape, [(standard <= 0, 'Standard load must be positive')])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cbr = (load / standard) * 100.0
+    return _finish(cbr, invalid, errors)
+
+
+def proctor_compaction(dry_density_kgm3, water_content_percent) -> BatchResult:
+    """Vectorized calculations.proctor_compaction.
+
+    Returns a BatchResult whose values are a dict of arrays with the same
+    keys as the scalar dict: 'dry_density' and 'water_content'.
+    """
+    density, water = _as_arrays(dry_density_kgm3, water_content_percent)
+    invalid, errors = _checks(density.shape, [
+        (density <= 0, 'Dry density must be positive'),
+        (water < 0, 'Water content cannot be negative'),
+    ])
+    values: Dict[str, np.ndarray] = {
+        'dry_density': np.where(invalid, np.nan, round_like_python(density, 2)),
+        'water_content': np.where(invalid, np.nan, round_like_python(water, 2)),
+    }
+    return BatchResult(values, invalid, errors)
+
+
+def atterberg_limits(liquid_limit, plastic_limit) -> BatchResult:
+    """Vectorized calculations.atterberg_limits.
+
+    Returns a BatchResult whose values are a dict of arrays with keys
+    'LL', 'PL' and 'PI' (PI = LL - PL), rounded like the scalar version.
+    """
+    ll, pl = _as_arrays(liquid_limit, plastic_limit)
+    invalid, errors = _checks(ll.shape, [((ll < 0) | (pl < 0), 'Limits must be non-negative')])
+    values: Dict[str, np.ndarray] = {
+        'LL': np.where(invalid, np.nan, round_like_python(ll, 2)),
+        'PL': np.where(invalid, np.nan, round_like_python(pl, 2)),
+        'PI': np.where(invalid, np.nan, round_like_python(ll - pl, 2)),
+    }
+    return BatchResult(values, invalid, errors)
+
+
+_D_TARGETS = (('D10', 10.0), ('D30', 30.0), ('D60', 60.0))
+
+
+def _interpolate_d_values(sizes: np.ndarray, passing: np.ndarray, target: float,
+                          log_interpolation: bool = False) -> np.ndarray:
+    """Vectorized calculations._interpolate_d_value for every lot at once.
+
+    `passing` is (lots x sieves) in descending sieve order. For each lot the
+    first sieve interval with passing[i-1] >= target >= passing[i] is found
+    with one boolean comparison over the whole matrix (the scalar version
+    scans the row in Python). Lots with no bracketing interval get NaN,
+    where the scalar version returns None.
+
+    With log_interpolation=True the size is interpolated linearly in
+    log10(size), which is how gradation curves are usually plotted.
+    """
+    lots = passing.shape[0]
+    if passing.shape[1] < 2:
+        return np.full(lots, np.nan)
+    upper, lower = passing[:, :-1], passing[:, 1:]
+    bracket = (upper >= target) & (target >= lower)
+    found = bracket.any(axis=1)
+    i = bracket.argmax(axis=1)
+    rows = np.arange(lots)
+
+    x1, x2 = upper[rows, i], lower[rows, i]
+    d1, d2 = sizes[i], sizes[i + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = (target - x1) / (x2 - x1)
+        if log_interpolation:
+            log_d1, log_d2 = np.log10(d1), np.log10(d2)
+            d = 10.0 ** (log_d1 + frac * (log_d2 - log_d1))
+        else:
+            d = d1 + frac * (d2 - d1)
+    d = np.where(x1 == x2, d1, d)
+    return np.where(found, d, np.nan)
+
+
+def sieve_analysis_summary(sieve_sizes, retained, total_mass=None,
+                           log_interpolation: bool = False) -> BatchResult:
+    """Vectorized calculations.sieve_analysis_summary for many aggregate lots.
+
+    Args:
+      sieve_sizes: 1-D array of sieve sizes in mm (any order)
+      retained: 2-D array (lots x sieves) of mass retained, columns aligned with sieve_sizes
+      total_mass: per-lot total dry mass (g); defaults to the row sums
+      log_interpolation: interpolate D-values in log10(size) instead of linearly
+
+    Returns:
+      BatchResult whose values is a dict of columnar arrays:
+        'sieve_mm' (sieves,), sorted coarsest to finest
+        'percent_retained', 'cumulative_retained', 'percent_passing' (lots x sieves),
+          rounded to 2 places like the scalar summary_table
+        'D10', 'D30', 'D60', 'Cu', 'Cc' (lots,), NaN where the scalar gives None
+    """
+    sizes = np.asarray(sieve_sizes, dtype=np.float64)
+    retained = np.atleast_2d(np.asarray(retained, dtype=np.float64))
+    if retained.shape[1] != sizes.shape[0]:
+        raise ValueError('retained must have one column per sieve size')
+    if total_mass is None:
+        total = retained.sum(axis=1)
+    else:
+        total = np.broadcast_to(np.asarray(total_mass, dtype=np.float64), retained.shape[:1])
+
+    order = np.argsort(-sizes, kind='stable')
+    sizes, retained = sizes[order], retained[:, order]
+    invalid, errors = _checks(total.shape, [(total <= 0, 'Total mass must be positive')])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent_retained = (retained / total[:, None]) * 100.0
+    # One cumsum replaces the running total kept per row in the scalar loop
+    cumulative = np.cumsum(percent_retained, axis=1)
+    passing = 100.0 - cumulative
+
+    values: Dict[str, np.ndarray] = {'sieve_mm': sizes}
+    for name, matrix in (('percent_retained', percent_retained),
+                         ('cumulative_retained', cumulative),
+                         ('percent_passing', passing)):
+        values[name] = np.where(invalid[:, None], np.nan, round_like_python(matrix, 2))
+
+    for name, target in _D_TARGETS:
+        values[name] = np.where(invalid, np.nan,
+                                _interpolate_d_values(sizes, passing, target, log_interpolation))
+
+    d10, d30, d60 = values['D10'], values['D30'], values['D60']
+    # Mirror the truthiness checks of the scalar version: None and 0.0 both skip Cu/Cc
+    has_cu = ~np.isnan(d10) & ~np.isnan(d60) & (d10 > 0) & (d60 != 0)
+    has_cc = has_cu & ~np.isnan(d30) & (d30 != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values['Cu'] = np.where(has_cu, d60 / d10, np.nan)
+        # float_power goes through libm pow() like Python's `D30 ** 2`; the
+        # `**` operator on arrays squares with x*x, which can differ by one ulp
+        values['Cc'] = np.where(has_cc, np.float_power(d30, 2) / (d10 * d60), np.nan)
+    return BatchResult(values, invalid, errors)
@@ -0,0 +1,238 @@
+"""
+batch_reports.py - Batch PDF reports over many tests and samples
+
+A batch report has a title page, a table of contents and one section per
+sample listing its tests. It is built as a pipeline with bounded memory:
+
+1. sections() reads the selected tests in (sample, test) order with a
+   streamed query and yields one plain-data section per sample;
+2. the sections are laid out into PDF page content streams by render_section()
+   in the renderer worker pool (a few sections in flight at a time);
+3. build_batch_pdf() writes the pages in order through
+   pdf_stream.PDFStreamWriter as they come back and yields the bytes, which go
+   straight to the HTTP response or, via write_batch_pdf(), to a job's file.
+
+Only the table-of-contents entries (one per sample) stay in memory, so memory
+stays flat however many tests are included. The title page and table of
+contents are written last but placed first in the document.
+"""
+import math
+import os
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import select
+
+import models
+import pdf_stream
+import renderers
+import results
+from pdf_stream import PAGE_HEIGHT, PAGE_WIDTH
+
+LAB_NAME = 'Civil Engg Materials Lab - College'
+MARGIN = 72
+LINE = 15
+BODY_SIZE = 10.5
+TOC_LINES_PER_PAGE = 40
+SECTIONS_IN_FLIGHT = 4  # sections handed to the renderer pool ahead of the writer
+
+
+# ---------------------------------------------------------------------------
+# Data
+# ---------------------------------------------------------------------------
+
+def _date(value) -> str:
+    return value.strftime('%Y-%m-%d') if value else '-'
+
+
+def sections(test_ids: Optional[Sequence[int]] = None, project_id: Optional[int] = None,
+             session=None, batch_size: int = 500) -> Iterator[Dict]:
+    """Yield {'sample': {...}, 'tests': [...]} per sample, as plain data, in sample order."""
+    TestResult, Sample, Project = models.TestResult, models.Sample, models.Project
+    session = session or TestResult.query.session
+    query = (select(Sample.id.label('sample_pk'), Sample.sample_id, Sample.sample_type, Sample.client_name,
+                    Sample.project_name.label('sample_project_name'), Project.project_name,
+                    TestResult.id, TestResult.test_name, TestResult.raw_values, TestResult.status,
+                    TestResult.date_tested, TestResult.approved_at, TestResult.remarks,
+                    TestResult.calculated_result, TestResult.result_kind, TestResult.result_value,
+                    TestResult.result_payload)
+             .join(Sample, Sample.id == TestResult.sample_id)
+             .outerjoin(Project, Project.id == Sample.project_id)
+             .order_by(Sample.id, TestResult.id)
+             .execution_options(yield_per=batch_size))
+    if test_ids is not None:
+        query = query.where(TestResult.id.in_([int(i) for i in test_ids]))
+    if project_id is not None:
+        query = query.where(Sample.project_id == project_id)
+    current = None
+    for row in session.execute(query):
+        if current is None or current['sample']['pk'] != row.sample_pk:
+            if current is not None:
+                yield current
+            current = {'sample': {'pk': row.sample_pk, 'sample_id': row.sample_id,
+                                  'sample_type': row.sample_type,
+                                  'project': row.project_name or row.sample_project_name or '-',
+                                  'client': row.client_name or '-'},
+                       'tests': []}
+        current['tests'].append({
+            'id': row.id, 'name': row.test_name, 'status': row.status or 'Pending',
+            'raw_values': row.raw_values or '', 'result': results.format_result(row) or '-',
+            'tested': _date(row.date_tested), 'approved': _date(row.approved_at) if row.approved_at else None,
+            'remarks': row.remarks,
+        })
+    if current is not None:
+        yield current
+
+
+# ---------------------------------------------------------------------------
+# Layout (runs in the worker processes)
+# ---------------------------------------------------------------------------
+
+def _wrap(value: str, width: float, size: float, font: str = 'Helvetica') -> List[str]:
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    words, lines, current = str(value).split(), [], ''
+    for word in words:
+        candidate = f'{current} {word}'.strip()
+        if current and stringWidth(candidate, font, size) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    lines.append(current)
+    return lines
+
+
+def render_section(section: Dict) -> List[bytes]:
+    """Lay out one sample's section; returns one content stream per page."""
+    sample = section['sample']
+    width = PAGE_WIDTH - 2 * MARGIN
+    pages, ops = [], []
+    y = PAGE_HEIGHT - MARGIN
+
+    def new_page(continued: bool):
+        nonlocal ops, y
+        if ops:
+            pages.append(b''.join(ops))
+        ops = []
+        y = PAGE_HEIGHT - MARGIN
+        title = f"Sample {sample['sample_id']}" + (' (continued)' if continued else '')
+        ops.append(pdf_stream.text(MARGIN, y, title, size=14, bold=True))
+        y -= LINE * 1.3
+        ops.append(pdf_stream.text(MARGIN, y, f"{sample['sample_type']} | Project: {sample['project']} | "
+                                              f"Client: {sample['client']}", size=BODY_SIZE))
+        y -= LINE * 0.6
+        ops.append(pdf_stream.line(MARGIN, y, PAGE_WIDTH - MARGIN, y))
+        y -= LINE * 1.4
+
+    new_page(False)
+    for test in section['tests']:
+        block = [(f"Test: {test['name']}", True)]
+        block.append((f"Status: {test['status']}    Tested: {test['tested']}"
+                      + (f"    Approved: {test['approved']}" if test['approved'] else ''), False))
+        block += [(l, False) for l in _wrap(f"Raw Values: {test['raw_values']}", width, BODY_SIZE)]
+        block += [(l, False) for l in _wrap(f"Result: {test['result']}", width, BODY_SIZE)]
+        if test['remarks']:
+            block += [(l, False) for l in _wrap(f"Remarks: {test['remarks']}", width, BODY_SIZE)]
+        if y - LINE * len(block) < MARGIN:
+            new_page(True)
+        for text, bold in block:
+            ops.append(pdf_stream.text(MARGIN, y, text, size=BODY_SIZE + (1 if bold else 0), bold=bold))
+            y -= LINE
+        y -= LINE * 0.6
+    pages.append(b''.join(ops))
+    return pages
+
+
+def _title_page(title: str, subtitle: str, samples: int, tests: int) -> bytes:
+    center = PAGE_WIDTH / 2
+
+    def centred(value, y, size, bold=False):
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        w = stringWidth(str(value), 'Helvetica-Bold' if bold else 'Helvetica', size)
+        return pdf_stream.text(center - w / 2, y, value, size=size, bold=bold)
+
+    top = PAGE_HEIGHT - 2 * MARGIN
+    return b''.join([
+        centred(LAB_NAME, top, 20, bold=True),
+        centred(title, top - 36, 16, bold=True),
+        centred(subtitle, top - 72, 12),
+        centred(f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}", top - 94, 12),
+        centred(f'Samples: {samples}    Total Tests: {tests}', top - 116, 12),
+    ])
+
+
+def _toc_pages(entries: List[Dict], first_page_number: int) -> List[tuple]:
+    pages = []
+    for start in range(0, len(entries), TOC_LINES_PER_PAGE):
+        ops, annots = [], []
+        y = PAGE_HEIGHT - MARGIN
+        ops.append(pdf_stream.text(MARGIN, y, 'Contents', size=14, bold=True))
+        y -= LINE * 2
+        for entry in entries[start:start + TOC_LINES_PER_PAGE]:
+            page_number = first_page_number + entry['offset']
+            ops.append(pdf_stream.text(MARGIN, y, f"{entry['label']}  ({entry['tests']} tests)", size=BODY_SIZE))
+            ops.append(pdf_stream.text(PAGE_WIDTH - MARGIN - 30, y, page_number, size=BODY_SIZE))
+            annots.append(pdf_stream.link((MARGIN, y - 3, PAGE_WIDTH - MARGIN, y + BODY_SIZE), entry['page_id']))
+            y -= LINE
+        pages.append((b''.join(ops), annots))
+    return pages
+
+
+# ---------------------------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------------------------
+
+def _rendered(section_iter: Iterable[Dict], window: int):
+    """(section, pages) in input order, with at most `window` sections rendering at once."""
+    pool = renderers.get_pool()
+    pending = deque()
+    for section in section_iter:
+        pending.append((section, pool.submit(render_section, section)))
+        if len(pending) >= window:
+            section, future = pending.popleft()
+            yield section, future.result(renderers.RENDER_TIMEOUT_SECONDS)
+    while pending:
+        section, future = pending.popleft()
+        yield section, future.result(renderers.RENDER_TIMEOUT_SECONDS)
+
+
+def build_batch_pdf(section_iter: Iterable[Dict], title: str, subtitle: str = '',
+                    window: int = SECTIONS_IN_FLIGHT, summary: Optional[Dict] = None) -> Iterator[bytes]:
+    """Generate the batch PDF as byte chunks, one chunk per sample section plus the trailer.
+
+    If `summary` is given it is filled with {'samples', 'tests', 'pages'} once done.
+    """
+    buffer: List[bytes] = []
+    writer = pdf_stream.PDFStreamWriter(buffer.append)
+    toc, tests = [], 0
+    for section, pages in _rendered(section_iter, window):
+        offset = len(writer.pages)
+        first_id = None
+        for content in pages:
+            page_id = writer.add_page(content)
+            first_id = first_id or page_id
+        toc.append({'label': f"{section['sample']['sample_id']} - {section['sample']['project']}",
+                    'tests': len(section['tests']), 'page_id': first_id, 'offset': offset})
+        tests += len(section['tests'])
+        yield b''.join(buffer)
+        buffer.clear()
+    toc_count = max(1, math.ceil(len(toc) / TOC_LINES_PER_PAGE))
+    front = [(_title_page(title, subtitle, len(toc), tests), ())]
+    front += _toc_pages(toc, first_page_number=2 + toc_count) or [
+        (pdf_stream.text(MARGIN, PAGE_HEIGHT - MARGIN, 'No tests selected', size=14, bold=True), ())]
+    writer.finish(front, outline=[(e['label'], e['page_id']) for e in toc], title=title)
+    yield b''.join(buffer)
+    if summary is not None:
+        summary.update(samples=len(toc), tests=tests, pages=len(front) + len(writer.pages))
+
+
+def write_batch_pdf(out_path: str, section_iter: Iterable[Dict], title: str, subtitle: str = '') -> Dict:
+    """Write the batch PDF to `out_path` (atomically). Returns {'samples', 'tests', 'pages'}."""
+    summary: Dict = {}
+    tmp_path = f'{out_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        for chunk in build_batch_pdf(section_iter, title, subtitle, summary=summary):
+            f.write(chunk)
+    os.replace(tmp_path, out_path)
+    return summary
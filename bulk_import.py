@@ -0,0 +1,499 @@
+"""
+bulk_import.py - Register samples and tests in bulk from CSV or XLSX
+
+One row per test (or per sample, when it has no test yet):
+
+    sample_id, sample_type, project_code, client_name, date_collected,
+    test_name, raw_values, date_tested
+
+The first row of a new sample_id registers the sample; later rows (or rows
+for a sample that already exists) only add tests to it. Header names are
+matched case-insensitively and a few aliases are accepted (see ALIASES).
+
+Files are read as a stream (csv module, or openpyxl in read-only mode) and
+processed in chunks of `chunk_size` rows. For each chunk:
+
+1. every check is run as a column mask over the whole chunk (like
+   batch_calculations) and a row keeps the message of the first check it
+   fails;
+2. one query finds which sample IDs already exist and one resolves the
+   project codes;
+3. samples, tests and their measurements are written with executemany
+   inserts, the dashboard counters and search index are updated, and the
+   chunk is committed;
+4. with calculate=True, each test with a known kind is calculated with the
+   vectorized formulas in the same pass and stored with its result.
+
+Rejected rows are written to an error report (CSV with the file's row
+number, the field and the reason); the other rows of the chunk are still
+imported.
+
+If a chunk fails (a database error, or a file that stops parsing half way),
+that chunk is rolled back and ImportInterrupted is raised. Its summary and
+the error report cover the chunks committed before it, and
+`summary.committed_row` is the last file row they include.
+"""
+import csv
+import io
+import os
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import insert, select
+
+import batch_calculations
+import calculations
+import measurements
+import models
+import raw_values
+import results
+import search
+import stats
+
+CHUNK_SIZE = 500
+SAMPLE_TYPES = ('Concrete', 'Soil', 'Aggregate')
+COLUMNS = ('sample_id', 'sample_type', 'project_code', 'client_name', 'date_collected',
+           'test_name', 'raw_values', 'date_tested')
+ALIASES = {
+    'sample': 'sample_id', 'type': 'sample_type', 'project': 'project_code', 'client': 'client_name',
+    'collected': 'date_collected', 'test': 'test_name', 'raw': 'raw_values', 'raw_value': 'raw_values',
+    'tested': 'date_tested',
+}
+ERROR_HEADER = ('row', 'sample_id', 'test_name', 'field', 'error')
+
+
+class ImportFormatError(ValueError):
+    """The file cannot be read as an import (unknown format or no sample_id column)."""
+
+
+class ImportInterrupted(Exception):
+    """A chunk failed after earlier chunks were committed; `summary` counts what was committed."""
+
+    def __init__(self, summary: 'ImportSummary', error: Exception):
+        super().__init__(f'Import stopped after row {summary.committed_row}: {error}')
+        self.summary = summary
+        self.error = error
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+def _column_name(header) -> str:
+    name = str(header or '').strip().lower().replace(' ', '_').replace('-', '_')
+    return ALIASES.get(name, name)
+
+
+def _cell(value) -> Any:
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _dict_rows(header: List, values: Iterable[Iterable]) -> Iterator[Dict[str, Any]]:
+    names = [_column_name(h) for h in header]
+    if 'sample_id' not in names:
+        raise ImportFormatError('The file needs a sample_id column')
+    for row in values:
+        row = {name: _cell(v) for name, v in zip(names, row) if name in COLUMNS}
+        if any(v != '' for v in row.values()):
+            yield row
+        else:
+            yield None  # blank line: keeps the row numbers right
+
+
+def read_rows(stream: IO[bytes], filename: str) -> Iterator[Optional[Dict[str, Any]]]:
+    """Rows of an uploaded .csv or .xlsx file as dicts (None for blank rows), read lazily."""
+    ext = os.path.splitext(filename.lower())[1]
+    if ext == '.csv':
+        reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        header = next(reader, None)
+        if header is None:
+            return iter(())
+        return _dict_rows(header, reader)
+    if ext in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+        wb = load_workbook(stream, read_only=True, data_only=True)
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return iter(())
+        return _dict_rows(list(header), rows)
+    raise ImportFormatError(f'Unsupported file type {ext or filename!r}; use .csv or .xlsx')
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[List[Tuple[int, Dict]]]:
+    """(file row number, row) lists of at most `size` rows; the header is row 1."""
+    chunk = []
+    for number, row in enumerate(rows, start=2):
+        if row is None:
+            continue
+        chunk.append((number, row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ---------------------------------------------------------------------------
+# Validation
+# ---------------------------------------------------------------------------
+
+def parse_datetime(value) -> Optional[datetime]:
+    """A datetime from a cell or ISO 8601 text, else None.
+
+    Times with an offset (or a trailing Z) are converted to naive UTC, which
+    is what the DateTime columns hold.
+    """
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    else:
+        text = str(value).strip()
+        if text[-1:] in ('Z', 'z'):  # fromisoformat() accepts Z only from Python 3.11
+            text = text[:-1] + '+00:00'
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _date_text(value) -> str:
+    parsed = parse_datetime(value) if value else None
+    return parsed.strftime('%Y-%m-%d') if parsed else ''
+
+
+def raw_values_error(test_name: str, raw: str) -> Optional[str]:
+    """Error message if `raw` does not parse for the test's kind, else None."""
+    kind = raw_values.kind_for_test_name(test_name)
+    if kind is None:
+        return None
+    try:
+        raw_values.parse(kind, raw)
+    except raw_values.RawValuesError as e:
+        return str(e)
+    return None
+
+
+def validate(chunk: List[Tuple[int, Dict]], existing: Dict[str, int], known: Dict[str, int],
+             projects: Dict[str, Tuple[int, str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Check a chunk with column masks.
+
+    Returns (invalid mask, (field, message) per row, mask of the rows that
+    register a new sample).
+
+    `existing` are sample IDs already in the database, `known` those
+    registered earlier in this import, `projects` the chunk's project codes.
+    """
+    def column(name):
+        return np.array([row.get(name, '') for _, row in chunk], dtype=object)
+
+    sample_id, sample_type = column('sample_id'), column('sample_type')
+    project_code, test_name, raw = column('project_code'), column('test_name'), column('raw_values')
+    tested, collected = column('date_tested'), column('date_collected')
+    has_test = test_name != ''
+    in_db = np.array([s in existing or s in known for s in sample_id], dtype=bool)
+    # A sample ID seen earlier in this chunk is registered by that earlier row
+    _, first = np.unique(sample_id.astype(str), return_index=True)
+    repeat = np.ones(len(chunk), dtype=bool)
+    repeat[first] = False
+    new_sample = ~in_db & ~repeat
+
+    raw_errors = np.array([raw_values_error(t, r) if t and r else None for t, r in zip(test_name, raw)], dtype=object)
+    bad_date = np.array([v != '' and parse_datetime(v) is None for v in tested], dtype=bool)
+    bad_collected = np.array([v != '' and parse_datetime(v) is None for v in collected], dtype=bool)
+
+    checks = [
+        (sample_id == '', 'sample_id', 'Sample ID is required'),
+        (new_sample & ~np.isin(sample_type, SAMPLE_TYPES), 'sample_type',
+         f'Sample type must be one of {list(SAMPLE_TYPES)}'),
+        (new_sample & (project_code != '') & ~np.isin(project_code, list(projects)), 'project_code',
+         'Unknown project code'),
+        (in_db & ~has_test, 'sample_id', 'Sample ID already exists'),
+        (repeat & ~in_db & ~has_test, 'sample_id', 'Duplicate sample row'),
+        (has_test & (raw == ''), 'raw_values', 'Raw values are required for the test'),
+        (raw_errors != None, 'raw_values', None),  # noqa: E711 (element-wise)
+        (bad_date, 'date_tested', 'Date tested must be YYYY-MM-DD'),
+        (new_sample & bad_collected, 'date_collected', 'Date collected must be YYYY-MM-DD'),
+    ]
+    invalid = np.zeros(len(chunk), dtype=bool)
+    errors = np.full(len(chunk), None, dtype=object)
+    for mask, field, message in checks:
+        new = mask & ~invalid
+        for i in np.nonzero(new)[0]:
+            errors[i] = (field, message or raw_errors[i])
+        invalid |= new
+    return invalid, errors, new_sample
+
+
+# ---------------------------------------------------------------------------
+# Calculations
+# ---------------------------------------------------------------------------
+
+def _vector(kind: str, parsed: List) -> Tuple[List[Optional[float]], List[Optional[dict]], List[Optional[str]]]:
+    """(values, payloads, errors) for parsed readings of one kind, computed as arrays."""
+    cols = list(zip(*parsed))
+    if kind == 'compressive':
+        res = batch_calculations.compressive_strength_mpa(*cols)
+    elif kind == 'flexural':
+        res = batch_calculations.flexural_strength_mpa(*cols)
+    elif kind == 'split_tensile':
+        res = batch_calculations.split_tensile_strength_mpa(*cols)
+    elif kind == 'water_absorption':
+        res = batch_calculations.water_absorption_percent(*cols)
+    elif kind == 'cbr':
+        res = batch_calculations.cbr_value(*cols)
+    elif kind in ('proctor', 'atterberg'):
+        fn = batch_calculations.proctor_compaction if kind == 'proctor' else batch_calculations.atterberg_limits
+        res = fn(*cols)
+        headline = 'dry_density' if kind == 'proctor' else 'PI'
+        payloads = [None if bad else {k: float(v[i]) for k, v in res.values.items()}
+                    for i, bad in enumerate(res.invalid)]
+        values = [None if bad else float(res.values[headline][i]) for i, bad in enumerate(res.invalid)]
+        return values, payloads, list(res.errors)
+    else:
+        raise KeyError(kind)
+    values = [None if bad else float(v) for v, bad in zip(res.values, res.invalid)]
+    return values, [None] * len(values), list(res.errors)
+
+
+def calculate(tests: List[Dict]) -> List[Tuple[int, str]]:
+    """Fill the result columns of new test rows in place, one array call per kind.
+
+    Returns (index, error) for tests whose calculation failed; they are kept
+    without a result.
+    """
+    by_kind: Dict[str, List[int]] = {}
+    for i, t in enumerate(tests):
+        kind = raw_values.kind_for_test_name(t['test_name'])
+        if kind:
+            by_kind.setdefault(kind, []).append(i)
+    failed = []
+    for kind, indexes in by_kind.items():
+        parsed = [raw_values.parse(kind, tests[i]['raw_values']) for i in indexes]
+        if kind == 'sieve':
+            outcomes = []
+            for p in parsed:
+                try:
+                    outcomes.append((None, calculations.sieve_analysis_summary(dict(p.sieve_masses), p.total_mass),
+                                     None))
+                except ValueError as e:
+                    outcomes.append((None, None, str(e)))
+        else:
+            outcomes = list(zip(*_vector(kind, parsed)))
+        for i, (value, payload, error) in zip(indexes, outcomes):
+            if error:
+                failed.append((i, error))
+                continue
+            holder = SimpleNamespace(calculated_result=None)
+            results.set_result(holder, kind, value, payload=payload)
+            tests[i].update(vars(holder))
+    return failed
+
+
+# ---------------------------------------------------------------------------
+# Writing
+# ---------------------------------------------------------------------------
+
+MAX_INSERT_PARAMS = 999  # bound parameters per multi-row INSERT (SQLite's historical limit)
+
+
+def _returns_many(session, model) -> bool:
+    return session.get_bind(model).dialect.insert_executemany_returning
+
+
+def insert_samples(session, rows: List[Dict]) -> Dict[str, int]:
+    """Insert sample rows in one executemany; returns {sample ID: id}."""
+    Sample = models.Sample
+    if _returns_many(session, Sample):
+        created = session.execute(insert(Sample).returning(Sample.id, Sample.sample_id), rows).all()
+    else:  # MySQL: no RETURNING, but sample IDs are unique
+        session.execute(insert(Sample), rows)
+        created = session.execute(select(Sample.id, Sample.sample_id)
+                                  .where(Sample.sample_id.in_([r['sample_id'] for r in rows]))).all()
+    return {code: id_ for id_, code in created}
+
+
+def _batches(rows: List[Dict]) -> Iterator[List[Dict]]:
+    """Runs of consecutive rows with the same keys, small enough for one multi-row INSERT."""
+    batch: List[Dict] = []
+    for row in rows:
+        if batch and (row.keys() != batch[0].keys() or (len(batch) + 1) * len(row) > MAX_INSERT_PARAMS):
+            yield batch
+            batch = []
+        batch.append(row)
+    if batch:
+        yield batch
+
+
+def insert_ids(session, model, rows: List[Dict]) -> List[int]:
+    """Insert `rows` into `model`'s table and return their new ids, in order.
+
+    Uses INSERT .. RETURNING with executemany where the dialect has it.
+    Otherwise (MySQL) the rows go in as multi-row INSERTs: the ids one
+    statement generates are consecutive, and lastrowid gives the first
+    (MySQL) or the last (SQLite) of them.
+    """
+    if _returns_many(session, model):
+        return session.execute(insert(model).returning(model.id, sort_by_parameter_order=True),
+                               rows).scalars().all()
+    dialect = session.get_bind(model).dialect
+    ids: List[int] = []
+    for batch in _batches(rows):
+        result = session.execute(insert(model).values(batch))
+        if result.rowcount != len(batch):
+            raise RuntimeError(f'Inserted {result.rowcount} of {len(batch)} {model.__tablename__} rows')
+        first = result.lastrowid if dialect.name in ('mysql', 'mariadb') else result.lastrowid - len(batch) + 1
+        ids.extend(range(first, first + len(batch)))
+    return ids
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+class ImportSummary:
+    """Counts of one import run; `errors` holds the first few error report lines for display."""
+
+    SHOWN_ERRORS = 20
+
+    def __init__(self):
+        self.rows = 0
+        self.samples = 0
+        self.tests = 0
+        self.calculated = 0
+        self.rejected = 0
+        self.warnings = 0  # imported, but the calculation failed
+        self.errors: List[Tuple] = []
+        self.committed_row: Optional[int] = None  # last file row of the last committed chunk
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'rows': self.rows, 'samples': self.samples, 'tests': self.tests,
+                'calculated': self.calculated, 'rejected': self.rejected, 'warnings': self.warnings}
+
+
+def import_rows(session, rows: Iterable[Optional[Dict]], chunk_size: int = CHUNK_SIZE, calculate_results: bool = False,
+                error_writer=None, now: Optional[datetime] = None) -> ImportSummary:
+    """Import parsed rows, committing after every chunk. Rejected rows go to `error_writer` (a csv.writer).
+
+    Raises ImportInterrupted when a chunk fails after others were committed.
+    """
+    Sample, TestResult, Project = models.Sample, models.TestResult, models.Project
+    summary = ImportSummary()
+    known: Dict[str, int] = {}  # sample ID -> id, for samples created by this import
+    now = now or datetime.utcnow()
+
+    def report(records, number, row, field, message, rejected=True):
+        records.append(((number, row.get('sample_id', ''), row.get('test_name', ''), field, message), rejected))
+
+    def record(records):
+        # Only committed chunks reach the summary and the error report
+        for line, rejected in records:
+            if rejected:
+                summary.rejected += 1
+            else:
+                summary.warnings += 1
+            if len(summary.errors) < summary.SHOWN_ERRORS:
+                summary.errors.append(line)
+            if error_writer is not None:
+                error_writer.writerow(line)
+
+    chunks = _chunks(rows, chunk_size)
+    while True:
+        records: List[Tuple[Tuple, bool]] = []
+        try:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return summary
+            codes = {row.get('sample_id') for _, row in chunk} - {''} - set(known)
+            existing = dict(session.execute(select(Sample.sample_id, Sample.id)
+                                            .where(Sample.sample_id.in_(codes))).all()) if codes else {}
+            project_codes = {row.get('project_code') for _, row in chunk} - {''}
+            projects = {code: (id_, name) for code, id_, name in session.execute(
+                select(Project.project_code, Project.id, Project.project_name)
+                .where(Project.project_code.in_(project_codes)))} if project_codes else {}
+
+            invalid, errors, registers = validate(chunk, existing, known, projects)
+            new_samples = []
+            for (number, row), bad, error, register in zip(chunk, invalid, errors, registers):
+                if bad:
+                    report(records, number, row, *error)
+                    continue
+                if not register:
+                    continue
+                project = projects.get(row.get('project_code'))
+                new_samples.append({
+                    'sample_id': row['sample_id'], 'sample_type': row['sample_type'],
+                    'project_id': project[0] if project else None, 'project_name': project[1] if project else '',
+                    'client_name': row.get('client_name', ''),
+                    'date_collected': _date_text(row.get('date_collected')) or now.date().isoformat(),
+                })
+            if new_samples:
+                known.update(insert_samples(session, new_samples))
+
+            new_tests, test_numbers = [], []
+            for (number, row), bad in zip(chunk, invalid):
+                if bad or not row.get('test_name'):
+                    continue
+                code = row['sample_id']
+                sample_pk = existing.get(code) or known.get(code)
+                if sample_pk is None:  # the row that should have registered it was rejected
+                    report(records, number, row, 'sample_id', 'Sample was not registered (see the earlier row)')
+                    continue
+                tested = row.get('date_tested')
+                new_tests.append({'sample_id': sample_pk, 'test_name': row['test_name'],
+                                  'raw_values': row['raw_values'], 'status': 'Pending',
+                                  'date_tested': parse_datetime(tested) if tested else now})
+                test_numbers.append((number, row))
+            if calculate_results and new_tests:
+                for i, message in calculate(new_tests):
+                    number, row = test_numbers[i]
+                    report(records, number, row, 'calculation', f'Imported without a result: {message}',
+                           rejected=False)
+            if new_tests:
+                ids = insert_ids(session, TestResult, new_tests)
+                readings = [m for id_, t in zip(ids, new_tests)
+                            for m in measurements.measurement_rows(id_, t['test_name'], t['raw_values'])]
+                if readings:
+                    session.execute(insert(models.Measurement), readings)
+
+            stats.add(session, {'samples': len(new_samples), 'tests': len(new_tests),
+                                'tests_pending': len(new_tests)})
+            search.reindex_samples(session.connection(), {t['sample_id'] for t in new_tests}
+                                   | {known[s['sample_id']] for s in new_samples})
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if summary.committed_row is None:
+                raise  # nothing was committed
+            raise ImportInterrupted(summary, e) from e
+        record(records)
+        summary.rows += len(chunk)
+        summary.calculated += sum(1 for t in new_tests if t.get('result_kind'))
+        summary.samples += len(new_samples)
+        summary.tests += len(new_tests)
+        summary.committed_row = chunk[-1][0]
+
+
+def import_file(session, stream: IO[bytes], filename: str, errors_path: Optional[str] = None,
+                **kwargs) -> ImportSummary:
+    """Import an uploaded file; rejected rows are written to `errors_path` as CSV when given."""
+    rows = read_rows(stream, filename)
+    if errors_path is None:
+        return import_rows(session, rows, **kwargs)
+    os.makedirs(os.path.dirname(errors_path) or '.', exist_ok=True)
+    with open(errors_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(ERROR_HEADER)
+        return import_rows(session, rows, error_writer=writer, **kwargs)
@@ -15,6 +15,9 @@ The functions are simple, well-commented, and suitable for college demos.
 """
 from typing import Dict, List, Any
 
+# Bump when a formula changes so stored results record which version produced them
+CALCULATION_VERSION = '1.0'
+
 def compressive_strength_mpa(load_kN: float, area_mm2: float) -> float:
     """
     Calculate compressive strength in MPa.
@@ -0,0 +1,234 @@
+"""
+db_routing.py - Send read-only pages to a replica, writes to the primary
+
+Dashboard counts, list pages, exports and report packs used to run on the
+same database as approvals and test entry, so a big export slowed data
+entry down. RoutingSession (the app's session class) now picks the engine
+per statement:
+
+* views marked @read_replica send their SELECTs to the replica engine when
+  one is configured (GET and HEAD requests only);
+* everything else, flushes, INSERT/UPDATE/DELETE and raw SQL other than
+  SELECT, goes to the primary. Once a session has written, the rest of its
+  reads go to the primary too;
+* read-your-writes: after a user's own commit their requests stay on the
+  primary for DB_STICKY_SECONDS (the time is kept in their session cookie,
+  so it holds across worker processes).
+
+The replica is either
+
+* DATABASE_REPLICA_URI - a server replica (e.g. a MySQL read replica), or
+* DATABASE_SNAPSHOT - for a single-node SQLite install, a copy of the
+  primary file made with SQLite's online backup every DB_SNAPSHOT_SECONDS.
+  The copy is written next to the snapshot path and moved into place, so
+  readers never see a half-written file; the pages read it immutable, with
+  no locks at all.
+
+Replica data lags the primary (by the replication delay, or up to
+DB_SNAPSHOT_SECONDS), which is why writes and the pages right after them
+stay on the primary. Results stored in query_cache.py are keyed by the
+primary's table generations, so cache loaders always read the primary.
+"""
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from flask import g, has_app_context, has_request_context, request, session as cookie
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.elements import TextClause
+
+import db_engine
+import query_cache
+
+STICKY_SECONDS = 5
+SNAPSHOT_SECONDS = 60
+STICKY_KEY = '_db_wrote_at'
+
+_replica = None
+_local = threading.local()  # primary() nesting depth, per thread
+
+
+def read_replica(view):
+    """Mark a view as read-only: its queries may be served by the replica."""
+    view.read_replica = True
+    return view
+
+
+@contextlib.contextmanager
+def primary():
+    """Read from the primary inside this block, whatever the request's route."""
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+
+
+def reading_replica() -> bool:
+    """Whether reads in this context go to the replica."""
+    return (_replica is not None and has_app_context() and g.get('db_route') == 'replica'
+            and not getattr(_local, 'depth', 0))
+
+
+def _is_read(clause) -> bool:
+    if clause is None:
+        return True
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() in ('SELECT', 'WITH')
+    return not getattr(clause, 'is_dml', False) and not getattr(clause, 'is_ddl', False)
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends the replica-routed reads to the replica engine."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not self.info.get('db_wrote')
+                and _is_read(clause) and reading_replica()):
+            engine = _replica.engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# ---------------------------------------------------------------------------
+# Replicas
+# ---------------------------------------------------------------------------
+
+class Replica:
+    """A replica database reached through its own engine."""
+
+    def __init__(self, engine):
+        self._engine = engine
+
+    def engine(self):
+        return self._engine
+
+    def status(self):
+        return {'kind': 'replica', 'url': self._engine.url.render_as_string(hide_password=True)}
+
+
+class Snapshot:
+    """A copy of a SQLite primary, refreshed in the background every `refresh_seconds`."""
+
+    def __init__(self, primary_path: str, path: str, refresh_seconds: int = SNAPSHOT_SECONDS):
+        self.primary_path = primary_path
+        self.path = os.path.abspath(path)
+        self.refresh_seconds = refresh_seconds
+        self.refreshed_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._engine = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def engine(self):
+        """The snapshot's engine, or None until the first copy exists. Starts a refresh when due."""
+        if self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.refresh_seconds:
+            with self._lock:
+                start, self._refreshing = not self._refreshing, True
+            if start:
+                threading.Thread(target=self._refresh_in_background, name='db-snapshot', daemon=True).start()
+        return self._engine
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self.last_error = f'{type(e).__name__}: {e}'
+            self.refreshed_at = time.monotonic()  # try again after the interval, not on every query
+            print(f'db-snapshot: refresh failed: {self.last_error}')
+        finally:
+            self._refreshing = False
+
+    def refresh(self) -> None:
+        """Copy the primary with the online backup API and move the copy into place."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        source = sqlite3.connect(self.primary_path)
+        target = sqlite3.connect(tmp)
+        try:
+            source.backup(target)  # a consistent copy; in WAL mode writers carry on meanwhile
+            target.execute('PRAGMA journal_mode=DELETE')  # read immutable, without -wal/-shm files
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp, self.path)
+        old, self._engine = self._engine, create_engine(
+            f'sqlite:///file:{self.path}?mode=ro&immutable=1&uri=true')
+        if old is not None:
+            old.dispose()  # connections still open keep reading the previous file until returned
+        self.refreshed_at = time.monotonic()
+        self.last_error = None
+
+    def status(self):
+        age = time.monotonic() - self.refreshed_at if self.refreshed_at is not None else None
+        return {'kind': 'snapshot', 'path': self.path, 'age_seconds': age, 'last_error': self.last_error}
+
+
+def replica_from_config(config, primary_engine):
+    """A Replica, a Snapshot or None, from DATABASE_REPLICA_URI / DATABASE_SNAPSHOT."""
+    uri = config.get('DATABASE_REPLICA_URI')
+    if uri:
+        options = db_engine.engine_options(dict(config, SQLALCHEMY_DATABASE_URI=uri))
+        engine = create_engine(uri, **options)
+        db_engine.init_engine(engine, config)
+        return Replica(engine)
+    path = config.get('DATABASE_SNAPSHOT')
+    if path:
+        url = make_url(primary_engine.url)
+        if url.get_backend_name() != 'sqlite' or db_engine.is_memory(url):
+            raise ValueError('DATABASE_SNAPSHOT needs a SQLite file as the primary database')
+        return Snapshot(url.database, path, config.get('DB_SNAPSHOT_SECONDS', SNAPSHOT_SECONDS))
+    return None
+
+
+def set_replica(replica) -> None:
+    global _replica
+    _replica = replica
+
+
+def replica():
+    return _replica
+
+
+def status():
+    return _replica.status() if _replica is not None else {'kind': None}
+
+
+# ---------------------------------------------------------------------------
+# Request routing and read-your-writes
+# ---------------------------------------------------------------------------
+
+def _wrote(session, *args):
+    session.info['db_wrote'] = True
+
+
+def _do_orm_execute(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info['db_wrote'] = True
+
+
+def _after_commit(session):
+    if session.info.get('db_wrote') and has_request_context():
+        cookie[STICKY_KEY] = time.time()
+
+
+def init_routing(app, db) -> None:
+    """Configure the replica from `app`'s settings and route requests (db must use RoutingSession)."""
+    with app.app_context():
+        set_replica(replica_from_config(app.config, db.engine))
+    event.listen(db.session, 'after_flush', _wrote)
+    event.listen(db.session, 'do_orm_execute', _do_orm_execute)
+    event.listen(db.session, 'after_commit', _after_commit)
+    query_cache.set_loader_context(primary)
+
+    @app.before_request
+    def _route_request():
+        view = app.view_functions.get(request.endpoint)
+        sticky = time.time() - cookie.get(STICKY_KEY, 0) < app.config.get('DB_STICKY_SECONDS', STICKY_SECONDS)
+        replica_ok = getattr(view, 'read_replica', False) and request.method in ('GET', 'HEAD')
+        g.db_route = 'replica' if _replica is not None and replica_ok and not sticky else 'primary'
@@ -0,0 +1,221 @@
+"""
+exports.py - Streaming, constant-memory CSV and Excel exports
+
+Exports read Core rows (not ORM objects) through a streamed cursor
+(yield_per), so only one batch of rows is in memory at a time:
+
+* CSV is generated row by row straight into the response;
+* Excel uses openpyxl's write-only mode, which spools rows to disk. The
+  workbook is saved to a per-request temporary file that is deleted once
+  sent, so concurrent exports never share a path.
+
+Each export has a set of named columns (SAMPLE_COLUMNS, TEST_COLUMNS);
+`columns=` picks and orders them. The filters are the same as on the
+samples list (search, project, type) plus a few per export (see
+sample_query() and test_query()).
+"""
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+
+import models
+import results
+import search
+
+BATCH_SIZE = 1000
+
+
+class ExportError(ValueError):
+    """Bad export parameters (unknown column or filter value)."""
+
+
+def _date(value) -> str:
+    return value.strftime('%Y-%m-%d') if value else ''
+
+
+# name -> (header, value(row)); rows carry every selected label below
+SAMPLE_COLUMNS: Dict[str, Tuple[str, Callable]] = {
+    'id': ('ID', lambda r: r.id),
+    'sample_id': ('Sample ID', lambda r: r.sample_id),
+    'type': ('Type', lambda r: r.sample_type),
+    'project': ('Project', lambda r: r.project or r.legacy_project_name or 'N/A'),
+    'client': ('Client', lambda r: r.client_name),
+    'date_collected': ('Date Collected', lambda r: r.date_collected),
+    'test_count': ('Test Count', lambda r: r.test_count),
+}
+
+TEST_COLUMNS: Dict[str, Tuple[str, Callable]] = {
+    'id': ('Test ID', lambda r: r.id),
+    'sample_id': ('Sample ID', lambda r: r.sample_id),
+    'project': ('Project', lambda r: r.project or r.legacy_project_name or ''),
+    'test_name': ('Test Name', lambda r: r.test_name),
+    'raw_values': ('Raw Values', lambda r: r.raw_values),
+    'result': ('Result', results.format_result),
+    'value': ('Value', lambda r: r.result_value),
+    'unit': ('Unit', lambda r: r.result_unit),
+    'status': ('Status', lambda r: r.status or 'Pending'),
+    'date_tested': ('Date Tested', lambda r: _date(r.date_tested)),
+    'approved_by': ('Approved By', lambda r: r.approver or 'N/A'),
+    'approved_at': ('Approved At', lambda r: _date(r.approved_at)),
+    'remarks': ('Remarks', lambda r: r.remarks),
+}
+
+# Columns exported when none are chosen (the historical layout)
+DEFAULT_SAMPLE_COLUMNS = ('id', 'sample_id', 'type', 'project', 'client', 'date_collected', 'test_count')
+DEFAULT_TEST_COLUMNS = ('id', 'sample_id', 'test_name', 'raw_values', 'result', 'value', 'unit', 'status',
+                        'date_tested', 'approved_by')
+
+
+def pick_columns(available: Dict[str, tuple], requested: Sequence[str], default: Sequence[str]) -> List[str]:
+    """Validate `requested` column names (comma-separated values allowed); default when empty."""
+    names = [n.strip() for value in requested for n in value.split(',') if n.strip()]
+    unknown = [n for n in names if n not in available]
+    if unknown:
+        raise ExportError(f"Unknown column(s): {', '.join(unknown)}. Available: {', '.join(available)}")
+    return names or list(default)
+
+
+def _parse_date(value: Optional[str], name: str) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ExportError(f'{name} must be YYYY-MM-DD')
+
+
+def _sample_filters(query, args, session):
+    Sample = models.Sample
+    hits = search.matches(session, (args.get('search') or '').strip())
+    if hits is not None:
+        query = query.join(hits, hits.c.sample_id == Sample.id)
+    project_hits = search.matches(session, (args.get('project') or '').strip(), field='project_name')
+    if project_hits is not None:
+        query = query.join(project_hits, project_hits.c.sample_id == Sample.id)
+    if (args.get('type') or '').strip():
+        query = query.where(Sample.sample_type == args.get('type').strip())
+    if args.get('project_id'):
+        query = query.where(Sample.project_id == int(args.get('project_id')))
+    return query
+
+
+def sample_query(args, session):
+    """Core select of samples with project name and test count, filtered by request `args`."""
+    Sample, Project, TestResult = models.Sample, models.Project, models.TestResult
+    counts = (select(TestResult.sample_id, func.count(TestResult.id).label('test_count'))
+              .group_by(TestResult.sample_id).subquery())
+    query = (select(Sample.id, Sample.sample_id, Sample.sample_type, Sample.client_name, Sample.date_collected,
+                    Sample.project_name.label('legacy_project_name'), Project.project_name.label('project'),
+                    func.coalesce(counts.c.test_count, 0).label('test_count'))
+             .outerjoin(Project, Project.id == Sample.project_id)
+             .outerjoin(counts, counts.c.sample_id == Sample.id)
+             .order_by(Sample.id))
+    return _sample_filters(query, args, session)
+
+
+def test_query(args, session):
+    """Core select of test results with sample, project and approver, filtered by request `args`.
+
+    Filters besides the sample ones: test_name, status, tested_from/tested_to (YYYY-MM-DD).
+    """
+    Sample, Project, TestResult = models.Sample, models.Project, models.TestResult
+    approver = aliased(models.User)
+    query = (select(TestResult.id, Sample.sample_id, Sample.project_name.label('legacy_project_name'),
+                    Project.project_name.label('project'), TestResult.test_name, TestResult.raw_values,
+                    TestResult.calculated_result, TestResult.result_kind, TestResult.result_value,
+                    TestResult.result_unit, TestResult.result_payload, TestResult.status, TestResult.date_tested,
+                    TestResult.approved_at, TestResult.remarks, approver.username.label('approver'))
+             .join(Sample, Sample.id == TestResult.sample_id)
+             .outerjoin(Project, Project.id == Sample.project_id)
+             .outerjoin(approver, approver.id == TestResult.approved_by)
+             .order_by(TestResult.id))
+    query = _sample_filters(query, args, session)
+    if args.get('test_name'):
+        query = query.where(TestResult.test_name == args.get('test_name'))
+    if args.get('status'):
+        query = query.where(TestResult.status == args.get('status'))
+    tested_from = _parse_date(args.get('tested_from'), 'tested_from')
+    tested_to = _parse_date(args.get('tested_to'), 'tested_to')
+    if tested_from:
+        query = query.where(TestResult.date_tested >= tested_from)
+    if tested_to:
+        query = query.where(TestResult.date_tested < tested_to + timedelta(days=1))
+    return query
+
+
+def rows(session, query, columns: Sequence[str], available: Dict[str, tuple]) -> Iterator[list]:
+    """Export rows (lists of cell values) read through a streamed cursor."""
+    getters = [available[name][1] for name in columns]
+    result = session.execute(query.execution_options(yield_per=BATCH_SIZE))
+    for row in result:
+        yield [get(row) for get in getters]
+
+
+def headers(columns: Sequence[str], available: Dict[str, tuple]) -> List[str]:
+    return [available[name][0] for name in columns]
+
+
+def stream_csv(header: List[str], data: Iterable[list], counter: Optional[list] = None) -> Iterator[str]:
+    """CSV text, one chunk per BATCH_SIZE rows. Appends the row count to `counter` when done."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    count = 0
+    for row in data:
+        writer.writerow(row)
+        count += 1
+        if count % BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+    if counter is not None:
+        counter.append(count)
+
+
+def write_xlsx(title: str, header: List[str], data: Iterable[list]) -> Tuple[str, int]:
+    """Write a write-only workbook to a new temporary file. Returns (path, row count); caller deletes it."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    header_cells = []
+    for name in header:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font = Font(bold=True)
+        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        header_cells.append(cell)
+    ws.append(header_cells)
+    count = 0
+    for row in data:
+        ws.append(row)
+        count += 1
+    fd, path = tempfile.mkstemp(prefix='lims_export_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        wb.save(path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
+
+
+def read_and_delete(path: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yield a file's bytes, then delete it (also when the client disconnects early)."""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
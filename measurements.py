@@ -0,0 +1,122 @@
+"""
+measurements.py - Numeric readings stored in the `measurements` table
+
+TestResult.raw_values stays the technician's original text, but every reading
+is also stored as one Measurement row (test_result_id, field, ordinal, value,
+unit) so the database can filter and aggregate on real numbers, e.g.
+
+    tests_with_reading('load_kN', '>', 600, project_id=3,
+                        test_name='Compressive Strength').all()
+
+Rows are written when a test is added (store_measurements) and existing data
+is migrated with backfill(), which walks test_results in small id-ordered
+chunks, committing after each one so no long lock is held and an interrupted
+run simply continues where it stopped.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import exists, insert, select
+
+import models
+import raw_values
+
+_OPERATORS = {
+    '>': lambda col, v: col > v,
+    '>=': lambda col, v: col >= v,
+    '<': lambda col, v: col < v,
+    '<=': lambda col, v: col <= v,
+    '=': lambda col, v: col == v,
+    '!=': lambda col, v: col != v,
+}
+
+
+def measurement_rows(test_result_id: int, test_name: str, raw: Optional[str]) -> List[Dict[str, Any]]:
+    """Parse raw_values with the registry and return Measurement rows as dicts.
+
+    Tests whose name has no parser, or whose raw string does not parse,
+    produce no rows (raw_values is still kept on the test itself).
+    """
+    kind = raw_values.kind_for_test_name(test_name)
+    if kind is None:
+        return []
+    try:
+        parsed = raw_values.parse(kind, raw)
+    except raw_values.RawValuesError:
+        return []
+
+    def row(field, value, ordinal=0):
+        return {'test_result_id': test_result_id, 'field': field, 'ordinal': ordinal,
+                'value': value, 'unit': raw_values.FIELD_UNITS.get(field)}
+
+    if kind == 'sieve':
+        rows = []
+        for ordinal, (size, mass) in enumerate(parsed.sieve_masses):
+            rows.append(row('sieve_mm', size, ordinal))
+            rows.append(row('retained_g', mass, ordinal))
+        rows.append(row('total_mass', parsed.total_mass))
+        return rows
+    return [row(field, value) for field, value in parsed._asdict().items() if value is not None]
+
+
+def store_measurements(session, test_result) -> int:
+    """Replace the measurements of one test from its raw_values. Call before commit."""
+    if test_result.id is None:
+        session.flush()
+    test_result.measurements = [models.Measurement(**r) for r in
+                                measurement_rows(test_result.id, test_result.test_name, test_result.raw_values)]
+    return len(test_result.measurements)
+
+
+def backfill(session, chunk_size: int = 500, start_id: int = 0,
+             progress: Optional[Callable[[int, int], None]] = None) -> Tuple[int, int]:
+    """Create measurements for existing tests that have none yet.
+
+    Walks test_results by id (keyset, never OFFSET) in chunks of `chunk_size`,
+    bulk-inserts the rows for each chunk and commits before reading the next,
+    so each transaction is short. Tests that already have measurements are
+    skipped, which makes the job safe to stop and re-run at any time.
+
+    Returns (last test id seen, measurement rows written).
+    """
+    TestResult, Measurement = models.TestResult, models.Measurement
+    last_id, written = start_id, 0
+    while True:
+        chunk = session.execute(
+            select(TestResult.id, TestResult.test_name, TestResult.raw_values)
+            .where(TestResult.id > last_id)
+            .where(~exists().where(Measurement.test_result_id == TestResult.id))
+            .order_by(TestResult.id)
+            .limit(chunk_size)
+        ).all()
+        if not chunk:
+            return last_id, written
+        rows = []
+        for test_id, test_name, raw in chunk:
+            rows.extend(measurement_rows(test_id, test_name, raw))
+        if rows:
+            session.execute(insert(Measurement), rows)
+        session.commit()
+        last_id = chunk[-1].id
+        written += len(rows)
+        if progress:
+            progress(last_id, written)
+
+
+def tests_with_reading(field: str, op: str, value: float, project_id: Optional[int] = None,
+                       test_name: Optional[str] = None, ordinal: Optional[int] = None):
+    """Query TestResults with a reading matching `field op value`, filtered in SQL."""
+    TestResult, Measurement, Sample = models.TestResult, models.Measurement, models.Sample
+    try:
+        condition = _OPERATORS[op](Measurement.value, value)
+    except KeyError:
+        raise ValueError(f'Unsupported operator {op!r}') from None
+    query = (TestResult.query
+             .join(Measurement, Measurement.test_result_id == TestResult.id)
+             .filter(Measurement.field == field, condition))
+    if ordinal is not None:
+        query = query.filter(Measurement.ordinal == ordinal)
+    if test_name:
+        query = query.filter(TestResult.test_name == test_name)
+    if project_id is not None:
+        query = query.join(Sample, Sample.id == TestResult.sample_id).filter(Sample.project_id == project_id)
+    return query.distinct()
@@ -4,6 +4,8 @@ models.py - SQLAlchemy models for Civil Engineering LIMS
 This file defines simple models: User, Sample, TestResult, Report.
 It's intentionally simple and includes helper methods for password hashing.
 """
+from datetime import datetime
+
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -57,15 +59,86 @@ def init_models(db):
         sample_id = db.Column(db.Integer, db.ForeignKey('samples.id'), nullable=False)
         test_name = db.Column(db.String(120), nullable=False)
         raw_values = db.Column(db.Text)  # Simple storage for raw values; could be JSON
-        calculated_result = db.Column(db.Text)
+        calculated_result = db.Column(db.Text)  # Legacy display text; see results.format_result
+        result_kind = db.Column(db.String(30))  # compressive, sieve, ... (which calculation ran)
+        result_value = db.Column(db.Float)  # Headline number, e.g. strength in MPa
+        result_unit = db.Column(db.String(10))
+        result_payload = db.Column(db.JSON)  # Structured output, e.g. sieve summary table
+        calc_version = db.Column(db.String(20))
         date_tested = db.Column(db.DateTime)
-        status = db.Column(db.String(30), default='Pending')  # Pending, Approved, Rejected
+        # Pending, Approved, Rejected. active_history loads the previous status of an
+        # expired test when it is set, so stats.py knows which counter to decrement.
+        status = db.column_property(db.Column(db.String(30), default='Pending'), active_history=True)
         approved_by = db.Column(db.Integer, db.ForeignKey('users.id'))
         approved_at = db.Column(db.DateTime)
         remarks = db.Column(db.Text)
         
         approver = db.relationship('User', foreign_keys=[approved_by])
 
+        __table_args__ = (
+            db.Index('ix_test_results_name_value', 'test_name', 'result_value'),
+            db.Index('ix_test_results_sample', 'sample_id'),
+        )
+
+        measurements = db.relationship('Measurement', backref='test_result', lazy=True,
+                                       order_by='Measurement.ordinal',
+                                       cascade='all, delete-orphan')
+
+        def reading(self, field, ordinal=0):
+            """Return one stored reading (e.g. 'load_kN') without re-parsing raw_values."""
+            for m in self.measurements:
+                if m.field == field and m.ordinal == ordinal:
+                    return m.value
+            return None
+
+        @property
+        def readings(self):
+            """All stored readings as {field: value}, or {field: [values]} for repeated fields."""
+            out = {}
+            for m in self.measurements:
+                if m.field in out:
+                    if not isinstance(out[m.field], list):
+                        out[m.field] = [out[m.field]]
+                    out[m.field].append(m.value)
+                else:
+                    out[m.field] = m.value
+            return out
+
+    class Measurement(db.Model):
+        """One numeric reading of a test, normalized out of TestResult.raw_values."""
+        __tablename__ = 'measurements'
+        id = db.Column(db.Integer, primary_key=True)
+        test_result_id = db.Column(db.Integer, db.ForeignKey('test_results.id', ondelete='CASCADE'),
+                                   nullable=False)
+        field = db.Column(db.String(40), nullable=False)  # e.g. load_kN, area_mm2, retained_g
+        ordinal = db.Column(db.Integer, nullable=False, default=0)  # position for repeated fields (sieves)
+        value = db.Column(db.Float, nullable=False)
+        unit = db.Column(db.String(10))
+
+        __table_args__ = (
+            db.UniqueConstraint('test_result_id', 'field', 'ordinal', name='uq_measurement_field'),
+            db.Index('ix_measurements_field_value', 'field', 'value'),
+        )
+
+    class SearchDocument(db.Model):
+        """Searchable text of one sample, used by search.py when FTS5 is not available."""
+        __tablename__ = 'search_documents'
+        sample_id = db.Column(db.Integer, primary_key=True)  # no FK: rows are replaced after the sample is flushed
+        body = db.Column(db.Text, nullable=False)  # lower-cased sample id, project, client and test names
+
+    class SearchGram(db.Model):
+        """Trigram -> sample posting list for substring search without leading-wildcard LIKE."""
+        __tablename__ = 'search_grams'
+        gram = db.Column(db.String(3), primary_key=True)
+        sample_id = db.Column(db.Integer, primary_key=True, index=True)
+
+    class StatCounter(db.Model):
+        """A dashboard total kept up to date by stats.py instead of COUNT(*) per page view."""
+        __tablename__ = 'stats_counters'
+        name = db.Column(db.String(40), primary_key=True)  # projects, samples, tests, tests_pending, ...
+        value = db.Column(db.Integer, nullable=False, default=0)
+        reconciled_at = db.Column(db.DateTime)
+
     class Report(db.Model):
         __tablename__ = 'reports'
         id = db.Column(db.Integer, primary_key=True)
@@ -74,7 +147,64 @@ def init_models(db):
         file_path = db.Column(db.String(255))
         created_at = db.Column(db.DateTime)
 
+    class ReportJob(db.Model):
+        """A report waiting for, or produced by, the background workers (see report_jobs.py)."""
+        __tablename__ = 'report_jobs'
+        id = db.Column(db.Integer, primary_key=True)
+        kind = db.Column(db.String(40), nullable=False)  # e.g. test_report
+        params = db.Column(db.JSON, nullable=False)
+        dedupe_key = db.Column(db.String(64), nullable=False)  # sha256 of kind + params
+        inflight_key = db.Column(db.String(64))  # dedupe_key while queued or running, else NULL (unique)
+        status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+        attempts = db.Column(db.Integer, nullable=False, default=0)
+        max_attempts = db.Column(db.Integer, nullable=False, default=3)
+        error = db.Column(db.Text)
+        result_path = db.Column(db.String(255))
+        worker = db.Column(db.String(80))
+        requested_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+        created_at = db.Column(db.DateTime, nullable=False)
+        run_after = db.Column(db.DateTime, nullable=False)  # not claimed before this (retry back-off)
+        started_at = db.Column(db.DateTime)
+        heartbeat_at = db.Column(db.DateTime)  # refreshed by the worker while the job runs
+        finished_at = db.Column(db.DateTime)
+
+        requester = db.relationship('User', foreign_keys=[requested_by])
+
+        __table_args__ = (
+            db.Index('ix_report_jobs_status_run_after', 'status', 'run_after'),
+            db.Index('ix_report_jobs_dedupe', 'dedupe_key', 'status'),
+            db.Index('ux_report_jobs_inflight', 'inflight_key', unique=True),
+        )
+
+    class ApiToken(db.Model):
+        """A bearer token for the JSON API (see api.py). Only its sha256 is stored."""
+        __tablename__ = 'api_tokens'
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+        name = db.Column(db.String(80), nullable=False)  # e.g. the instrument or script using it
+        token_hash = db.Column(db.String(64), unique=True, nullable=False)
+        created_at = db.Column(db.DateTime, nullable=False)
+        last_used_at = db.Column(db.DateTime)
+        revoked_at = db.Column(db.DateTime)
+
+        user = db.relationship('User', foreign_keys=[user_id])
+
+    class IdempotencyKey(db.Model):
+        """A client-supplied key of an ingested item, so a retried batch never creates the row twice."""
+        __tablename__ = 'idempotency_keys'
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+        key = db.Column(db.String(100), nullable=False)
+        fingerprint = db.Column(db.String(64), nullable=False)  # sha256 of the item, to detect reuse
+        test_result_id = db.Column(db.Integer, db.ForeignKey('test_results.id', ondelete='SET NULL'))
+        created_at = db.Column(db.DateTime, nullable=False)
+
+        __table_args__ = (
+            db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),
+        )
+
     class AuditLog(db.Model):
+        """One audited action. Split into monthly partitions and archived by audit_archive.py."""
         __tablename__ = 'audit_logs'
         id = db.Column(db.Integer, primary_key=True)
         user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -83,13 +213,51 @@ def init_models(db):
         entity_id = db.Column(db.Integer)
         details = db.Column(db.Text)  # JSON or text description
         timestamp = db.Column(db.DateTime, nullable=False)
+        chain_hash = db.Column(db.String(64))  # set when sealed (see audit_chain.py)
+        # When the row was inserted, which can be long after `timestamp` (see audit_chain.seal)
+        inserted_at = db.Column(db.DateTime, default=datetime.utcnow)
         
         user = db.relationship('User', foreign_keys=[user_id])
 
+        # Keyset pages are read newest id first; each index also covers the id
+        __table_args__ = (
+            db.Index('ix_audit_logs_timestamp', 'timestamp'),
+            db.Index('ix_audit_logs_entity', 'entity_type', 'entity_id'),
+            db.Index('ix_audit_logs_user', 'user_id'),
+        )
+
+    class AuditBlock(db.Model):
+        """A sealed run of audit entries: their Merkle root and the chain hashes around them."""
+        __tablename__ = 'audit_blocks'
+        id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # block number, from 1
+        first_id = db.Column(db.Integer, nullable=False)  # audit_logs.id range covered
+        last_id = db.Column(db.Integer, nullable=False)
+        entries = db.Column(db.Integer, nullable=False)
+        first_timestamp = db.Column(db.DateTime, nullable=False)
+        last_timestamp = db.Column(db.DateTime, nullable=False)
+        prev_hash = db.Column(db.String(64), nullable=False)  # chain hash before the first entry
+        last_hash = db.Column(db.String(64), nullable=False)  # chain hash of the last entry
+        merkle_root = db.Column(db.String(64), nullable=False)
+        block_hash = db.Column(db.String(64), nullable=False)  # links the block to the previous one
+        sealed_at = db.Column(db.DateTime, nullable=False)
+
+        __table_args__ = (
+            db.Index('ix_audit_blocks_last_id', 'last_id'),
+            db.Index('ix_audit_blocks_timestamps', 'first_timestamp', 'last_timestamp'),
+        )
+
     # Expose classes at module level so other modules can import them from models
     globals()['User'] = User
     globals()['Project'] = Project
     globals()['Sample'] = Sample
     globals()['TestResult'] = TestResult
+    globals()['Measurement'] = Measurement
+    globals()['SearchDocument'] = SearchDocument
+    globals()['SearchGram'] = SearchGram
+    globals()['StatCounter'] = StatCounter
     globals()['Report'] = Report
+    globals()['ReportJob'] = ReportJob
+    globals()['ApiToken'] = ApiToken
+    globals()['IdempotencyKey'] = IdempotencyKey
     globals()['AuditLog'] = AuditLog
+    globals()['AuditBlock'] = AuditBlock
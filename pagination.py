@@ -0,0 +1,143 @@
+"""
+pagination.py - Keyset (cursor) pagination for list pages
+
+List pages show newest first and page through rows with `?after=<id>` (older
+rows) and `?before=<id>` (newer rows) instead of OFFSET, so every page costs
+one indexed range scan no matter how deep the user goes, and the links stay
+valid while new rows are being added. Search results are paged the same way
+in rank order by paginate_ranked().
+
+The "about N results" figure comes from approximate_count(), which caches a
+COUNT(*) per filter combination for a short time instead of counting on every
+page load.
+"""
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+import query_cache
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+COUNT_TTL_SECONDS = 60
+COUNT_MAX_ENTRIES = 1024
+
+# Keys include search terms and audit-log filters, so the cache is a bounded LRU
+_count_cache = query_cache.MemoryBackend(COUNT_MAX_ENTRIES)
+
+
+class Page:
+    """One page of results plus the cursors for the neighbouring pages."""
+
+    def __init__(self, items: List[Any], page_size: int, next_cursor: Optional[int],
+                 prev_cursor: Optional[int], approx_total: Optional[int] = None):
+        self.items = items
+        self.page_size = page_size
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.approx_total = approx_total
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _int_arg(args: Mapping, name: str) -> Optional[int]:
+    try:
+        return int(args.get(name, ''))
+    except (TypeError, ValueError):
+        return None
+
+
+def cursor_args(args: Mapping, default_size: int = DEFAULT_PAGE_SIZE,
+                max_size: int = MAX_PAGE_SIZE) -> Dict[str, Optional[int]]:
+    """Read after / before / per_page from request.args, ignoring junk values."""
+    per_page = _int_arg(args, 'per_page') or default_size
+    return {
+        'after': _int_arg(args, 'after'),
+        'before': _int_arg(args, 'before'),
+        'page_size': max(1, min(per_page, max_size)),
+    }
+
+
+def paginate(query, id_column, after: Optional[int] = None, before: Optional[int] = None,
+             page_size: int = DEFAULT_PAGE_SIZE, key: Callable[[Any], int] = lambda item: item.id) -> Page:
+    """Fetch one page of `query`, newest (highest id) first.
+
+    `query` must not be ordered yet; `key` extracts the id from a result row
+    (override it when the query returns tuples such as (Sample, count)).
+    One extra row is fetched to know whether another page exists.
+    """
+    if before is not None:
+        rows = query.filter(id_column > before).order_by(id_column.asc()).limit(page_size + 1).all()
+        has_newer = len(rows) > page_size
+        items = rows[:page_size][::-1]
+        has_older = True
+    else:
+        if after is not None:
+            query = query.filter(id_column < after)
+        rows = query.order_by(id_column.desc()).limit(page_size + 1).all()
+        has_older = len(rows) > page_size
+        items = rows[:page_size]
+        has_newer = after is not None
+    next_cursor = key(items[-1]) if items and has_older else None
+    prev_cursor = key(items[0]) if items and has_newer else None
+    return Page(items, page_size, next_cursor, prev_cursor)
+
+
+def paginate_ranked(query, rank_column, id_column, after: Optional[int] = None, before: Optional[int] = None,
+                    page_size: int = DEFAULT_PAGE_SIZE, key: Callable[[Any], int] = lambda item: item.id) -> Page:
+    """Fetch one page of `query` ordered by `rank_column` (lowest first), then newest first.
+
+    Used for search results. The cursors are still row ids: the cursor row's
+    rank is looked up and the page continues from its (rank, id) position, so
+    every match can be reached. A cursor whose row no longer matches starts
+    again from the best matches.
+    """
+    cursor = before if before is not None else after
+    rank = None
+    if cursor is not None:
+        rank = query.with_entities(rank_column).filter(id_column == cursor).limit(1).scalar()
+    if rank is None:
+        after = before = None
+    if before is not None:
+        rows = (query.filter(or_(rank_column < rank, and_(rank_column == rank, id_column > before)))
+                .order_by(rank_column.desc(), id_column.asc()).limit(page_size + 1).all())
+        has_better = len(rows) > page_size
+        items = rows[:page_size][::-1]
+        has_worse = True
+    else:
+        if after is not None:
+            query = query.filter(or_(rank_column > rank, and_(rank_column == rank, id_column < after)))
+        rows = query.order_by(rank_column.asc(), id_column.desc()).limit(page_size + 1).all()
+        has_worse = len(rows) > page_size
+        items = rows[:page_size]
+        has_better = after is not None
+    next_cursor = key(items[-1]) if items and has_worse else None
+    prev_cursor = key(items[0]) if items and has_better else None
+    return Page(items, page_size, next_cursor, prev_cursor)
+
+
+def approximate_count(cache_key: Tuple, query, ttl: float = COUNT_TTL_SECONDS) -> int:
+    """COUNT(*) of `query`, cached per `cache_key` for `ttl` seconds."""
+    key = repr(cache_key)
+    cached = _count_cache.get(key)
+    if cached is not query_cache.MISS:
+        return cached
+    count = query.order_by(None).count()
+    _count_cache.set(key, count, ttl)
+    return count
+
+
+def clear_count_cache() -> None:
+    _count_cache.clear()
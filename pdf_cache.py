@@ -0,0 +1,113 @@
+"""
+pdf_cache.py - Content-addressed cache of rendered PDF reports
+
+A report is a pure function of its inputs: the test row, the sample (and
+project) row, the report template and rendering code (TEMPLATE_FILES, plus
+RENDER_VERSION for changes outside them), the renderer and the technician
+named on it. cache_key() hashes those inputs, and the rendered PDF is stored
+as <PDF_CACHE_DIR>/<key[:2]>/<key>.pdf. While nothing changes, every download
+is served from that file, and the key doubles as a strong ETag so browsers
+revalidate with a 304. A changed result, approval or template gives a new key
+and so a new file. The issue date printed on a cached report is the date it
+was first rendered.
+
+lookup() costs one stat(). Hits refresh the file's mtime at most once per
+TOUCH_SECONDS, and evict() deletes the least recently used files once the
+directory grows beyond PDF_CACHE_MAX_BYTES.
+"""
+import hashlib
+import json
+import os
+import time
+from functools import lru_cache
+from typing import Iterable, Optional
+
+CACHE_DIR = os.getenv('PDF_CACHE_DIR', os.path.join('reports', 'cache'))
+MAX_BYTES = int(os.getenv('PDF_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+TOUCH_SECONDS = 3600
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+# Files whose content changes what a report looks like
+TEMPLATE_FILES = ('templates/report_cube.html', 'report_generator.py', 'renderers.py', 'batch_reports.py',
+                  'pdf_stream.py')
+# Bump when report output changes outside TEMPLATE_FILES (e.g. the report fields
+# assembled in app.py, results formatting, or the images under static/)
+RENDER_VERSION = 1
+
+
+@lru_cache(maxsize=1)
+def template_version() -> str:
+    """Hash of RENDER_VERSION and the report template and rendering code (read once per process)."""
+    digest = hashlib.sha256(f'render-{RENDER_VERSION}'.encode())
+    for name in TEMPLATE_FILES:
+        try:
+            with open(os.path.join(_ROOT, name), 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(name.encode())
+    return digest.hexdigest()[:16]
+
+
+def row_fingerprint(obj) -> Optional[dict]:
+    """All column values of an ORM row, or None."""
+    if obj is None:
+        return None
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
+
+
+def cache_key(kind: str, renderer: str, **inputs) -> str:
+    """sha256 over everything a report depends on; ORM rows may be passed as inputs."""
+    payload = {'kind': kind, 'renderer': renderer, 'template': template_version()}
+    for name, value in inputs.items():
+        payload[name] = row_fingerprint(value) if hasattr(value, '__table__') else value
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def path_for(key: str) -> str:
+    return os.path.abspath(os.path.join(CACHE_DIR, key[:2], f'{key}.pdf'))
+
+
+def lookup(key: str) -> Optional[str]:
+    """Path of the cached PDF for `key`, or None. Marks the entry as recently used."""
+    path = path_for(key)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    now = time.time()
+    if now - st.st_mtime > TOUCH_SECONDS:
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+    return path
+
+
+def evict(max_bytes: int = MAX_BYTES, keep: Iterable[str] = ()) -> int:
+    """Delete least recently used PDFs until the cache fits in `max_bytes`. Returns files removed."""
+    keep = {os.path.abspath(p) for p in keep}
+    entries, total = [], 0
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    for shard in os.scandir(CACHE_DIR):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.name.endswith('.pdf'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,140 @@
+"""
+pdf_stream.py - Minimal PDF writer that streams pages as they are produced
+
+ReportLab's canvas keeps every page in memory until save(). For batch reports
+with hundreds of tests we want to send pages to the client (or a file) as soon
+as they are ready, so this writer emits each page object immediately and only
+remembers its object number and byte offset.
+
+Page order is decided by the /Kids array written in finish(), not by the order
+in which pages were written, so front matter whose content depends on the
+whole document (title page, table of contents with page numbers) is added at
+the end and still appears first.
+
+Only the two built-in Helvetica fonts are used (no embedding), with WinAnsi
+text encoding; callers pass ready-made content streams built with text() and
+friends.
+"""
+import zlib
+from typing import Callable, List, Optional, Sequence, Tuple
+
+PAGE_WIDTH, PAGE_HEIGHT = 595.2756, 841.8898  # A4 in points
+
+FONT_REGULAR = 'F1'
+FONT_BOLD = 'F2'
+
+# Characters used in result strings that WinAnsi cannot encode
+_REPLACEMENTS = str.maketrans({'ρ': 'rho ', '≥': '>=', '≤': '<=', '—': '-', '–': '-'})
+
+
+def escape(value) -> bytes:
+    """Encode `value` as the body of a PDF literal string."""
+    text = str(value).translate(_REPLACEMENTS)
+    raw = text.encode('cp1252', errors='replace')
+    return raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def text(x: float, y: float, value, size: float = 11, bold: bool = False) -> bytes:
+    """Content-stream operators drawing one line of text with its baseline at (x, y)."""
+    font = FONT_BOLD if bold else FONT_REGULAR
+    return b'BT /%s %.2f Tf %.2f %.2f Td (%s) Tj ET\n' % (font.encode(), size, x, y, escape(value))
+
+
+def line(x1: float, y1: float, x2: float, y2: float, width: float = 0.5) -> bytes:
+    return b'%.2f w %.2f %.2f m %.2f %.2f l S\n' % (width, x1, y1, x2, y2)
+
+
+class PDFStreamWriter:
+    """Write a PDF incrementally through `write(bytes)`."""
+
+    def __init__(self, write: Callable[[bytes], None]):
+        self._write = write
+        self._offset = 0
+        self._offsets = {}
+        self._next_id = 5
+        self.pages: List[int] = []
+        # Fixed object numbers: 1 catalog, 2 page tree, 3-4 fonts
+        self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._object(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+        self._object(4, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>')
+
+    def _emit(self, data: bytes) -> None:
+        self._write(data)
+        self._offset += len(data)
+
+    def reserve(self) -> int:
+        """Allocate an object number to be written later."""
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _object(self, obj_id: int, body: bytes) -> None:
+        self._offsets[obj_id] = self._offset
+        self._emit(b'%d 0 obj\n' % obj_id + body + b'\nendobj\n')
+
+    def _stream(self, data: bytes) -> int:
+        obj_id = self.reserve()
+        packed = zlib.compress(data)
+        self._object(obj_id, b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(packed) + packed
+                     + b'\nendstream')
+        return obj_id
+
+    def add_page(self, content: bytes, annotations: Sequence[bytes] = (), page_id: Optional[int] = None) -> int:
+        """Write one page now; it is appended to the page order. Returns its object number."""
+        page_id = self._write_page(content, annotations, page_id)
+        self.pages.append(page_id)
+        return page_id
+
+    def _write_page(self, content: bytes, annotations: Sequence[bytes], page_id: Optional[int]) -> int:
+        content_id = self._stream(content)
+        page_id = page_id or self.reserve()
+        annots = b' /Annots [%s]' % b' '.join(annotations) if annotations else b''
+        self._object(page_id, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] '
+                              b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R%s >>'
+                     % (PAGE_WIDTH, PAGE_HEIGHT, content_id, annots))
+        return page_id
+
+    def finish(self, front_pages: Sequence[Tuple[bytes, Sequence[bytes]]] = (),
+               outline: Sequence[Tuple[str, int]] = (), title: str = '') -> None:
+        """Write the front pages (placed before all others), bookmarks, page tree and trailer.
+
+        `front_pages` are (content, annotations); `outline` is (title, page object number).
+        """
+        front = [self._write_page(content, annots, None) for content, annots in front_pages]
+        kids = front + self.pages
+        self._object(2, b'<< /Type /Pages /Kids [%s] /Count %d >>'
+                     % (b' '.join(b'%d 0 R' % k for k in kids), len(kids)))
+        outlines = b''
+        if outline:
+            root_id = self.reserve()
+            item_ids = [self.reserve() for _ in outline]
+            for n, ((label, page_id), item_id) in enumerate(zip(outline, item_ids)):
+                links = b''
+                if n > 0:
+                    links += b' /Prev %d 0 R' % item_ids[n - 1]
+                if n + 1 < len(item_ids):
+                    links += b' /Next %d 0 R' % item_ids[n + 1]
+                self._object(item_id, b'<< /Title (%s) /Parent %d 0 R /Dest [%d 0 R /Fit]%s >>'
+                             % (escape(label), root_id, page_id, links))
+            self._object(root_id, b'<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>'
+                         % (item_ids[0], item_ids[-1], len(item_ids)))
+            outlines = b' /Outlines %d 0 R /PageMode /UseOutlines' % root_id
+        self._object(1, b'<< /Type /Catalog /Pages 2 0 R%s >>' % outlines)
+        info_id = self.reserve()
+        self._object(info_id, b'<< /Title (%s) /Producer (LIMS) >>' % escape(title))
+
+        xref_at = self._offset
+        size = self._next_id
+        rows = [b'0000000000 65535 f \n']
+        for obj_id in range(1, size):
+            offset = self._offsets.get(obj_id)
+            rows.append(b'%010d 00000 n \n' % offset if offset is not None else b'0000000000 65535 f \n')
+        self._emit(b'xref\n0 %d\n' % size + b''.join(rows))
+        self._emit(b'trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                   % (size, info_id, xref_at))
+
+
+def link(rect: Tuple[float, float, float, float], page_id: int) -> bytes:
+    """An inline link annotation jumping to `page_id`."""
+    return (b'<< /Type /Annot /Subtype /Link /Border [0 0 0] /Rect [%.2f %.2f %.2f %.2f] /Dest [%d 0 R /Fit] >>'
+            % (*rect, page_id))
@@ -0,0 +1,297 @@
+"""
+query_cache.py - Generation-counter cache for query results
+
+Reference data (the project dropdown) and list pages run the same queries over
+and over. cached() stores a loader's result under a key made of the query
+parameters plus the current *generation* of every table the result depends
+on. Each table's generation is a counter that is bumped after a commit that
+wrote to the table, so the next read misses and reloads. Writes invalidate
+precisely, and TTL only bounds memory.
+
+    projects = query_cache.cached('project_choices', (), ['projects'], load_projects)
+
+Cached values must be plain, picklable data (dicts, tuples, numbers), never
+ORM instances, which belong to the session that loaded them.
+
+Backends are chosen with CACHE_URL:
+
+* memory (default)  - per-process LRU with TTL. Generations are per process
+  too, so use it only with a single worker.
+* sqlite:///path    - a small SQLite file shared by every worker on the host
+  (put it on /dev/shm for a shared-memory cache).
+* redis://host:port - a local or shared Redis server (needs the redis package).
+* none              - caching disabled; loaders always run.
+
+Writes the ORM does not see (raw SQL through session.execute(text(...)) or
+another application) must call invalidate('table', ...) themselves.
+"""
+import contextlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+from sqlalchemy import event
+
+DEFAULT_TTL = 300
+MAX_ENTRIES = 2048
+
+MISS = object()
+
+
+class MemoryBackend:
+    """Thread-safe in-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return MISS
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, table: str) -> int:
+        return self._generations.get(table, 0)
+
+    def bump(self, table: str) -> None:
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Cache in a SQLite file so that all worker processes on one host share it."""
+
+    def __init__(self, path: str, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_entries '
+                         '(key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_entries_expires ON cache_entries (expires)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_generations (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        row = self._conn().execute('SELECT value, expires FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return MISS
+        return pickle.loads(row[0])
+
+    def set(self, key: str, value, ttl: float) -> None:
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)',
+                     (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + ttl))
+        excess = conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute('DELETE FROM cache_entries WHERE key IN '
+                         '(SELECT key FROM cache_entries ORDER BY expires LIMIT ?)', (excess,))
+            self.evictions += excess
+
+    def generation(self, table: str) -> int:
+        row = self._conn().execute('SELECT value FROM cache_generations WHERE name = ?', (table,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, table: str) -> None:
+        self._conn().execute('INSERT INTO cache_generations (name, value) VALUES (?, 1) '
+                             'ON CONFLICT(name) DO UPDATE SET value = value + 1', (table,))
+
+    def clear(self) -> None:
+        self._conn().execute('DELETE FROM cache_entries')
+
+
+class RedisBackend:
+    """Cache on a Redis server; Redis expires and evicts entries itself."""
+
+    def __init__(self, url: str, prefix: str = 'lims:'):
+        import redis  # optional dependency, only needed for this backend
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.evictions = 0
+
+    def get(self, key: str):
+        value = self._redis.get(self.prefix + key)
+        return MISS if value is None else pickle.loads(value)
+
+    def set(self, key: str, value, ttl: float) -> None:
+        self._redis.set(self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=max(1, int(ttl)))
+
+    def generation(self, table: str) -> int:
+        return int(self._redis.get(f'{self.prefix}gen:{table}') or 0)
+
+    def bump(self, table: str) -> None:
+        self._redis.incr(f'{self.prefix}gen:{table}')
+
+    def clear(self) -> None:
+        for key in self._redis.scan_iter(self.prefix + '*'):
+            if not key.decode().startswith(self.prefix + 'gen:'):
+                self._redis.delete(key)
+
+
+def backend_from_url(url: Optional[str]):
+    """Build a backend from a CACHE_URL value; None/'none' disables caching."""
+    if not url or url == 'none':
+        return None
+    if url == 'memory':
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith('redis://'):
+        return RedisBackend(url)
+    raise ValueError(f'Unsupported CACHE_URL {url!r}')
+
+
+_backend = MemoryBackend()
+_metrics: Dict[str, Dict[str, int]] = {}
+_metrics_lock = threading.Lock()
+_loader_context: Callable[[], Any] = contextlib.nullcontext
+
+
+def set_backend(backend) -> None:
+    global _backend
+    _backend = backend
+
+
+def set_loader_context(factory: Callable[[], Any]) -> None:
+    """Run every loader inside factory()'s context (db_routing.primary: load from the primary)."""
+    global _loader_context
+    _loader_context = factory
+
+
+def _count(name: str, outcome: str) -> None:
+    with _metrics_lock:
+        counts = _metrics.setdefault(name, {'hits': 0, 'misses': 0})
+        counts[outcome] += 1
+
+
+def cached(name: str, params: Hashable, tables: Iterable[str], loader: Callable[[], Any],
+           ttl: float = DEFAULT_TTL):
+    """Return loader()'s result, cached per `params` until one of `tables` is written."""
+    if _backend is None:
+        return loader()
+    # Read the generations before loading: a commit that lands while the loader
+    # runs bumps them, so a possibly stale result is stored under a dead key.
+    generations = tuple((t, _backend.generation(t)) for t in sorted(tables))
+    key = f'{name}|{params!r}|{generations!r}'
+    value = _backend.get(key)
+    if value is not MISS:
+        _count(name, 'hits')
+        return value
+    _count(name, 'misses')
+    with _loader_context():
+        value = loader()
+    _backend.set(key, value, ttl)
+    return value
+
+
+def invalidate(*tables: str) -> None:
+    """Bump the generation of `tables`, making every cached result that uses them stale."""
+    if _backend is not None:
+        for table in tables:
+            _backend.bump(table)
+
+
+def metrics() -> Dict[str, Any]:
+    """Hit/miss counts per cache name (this process) plus totals."""
+    with _metrics_lock:
+        per_name = {name: dict(counts) for name, counts in _metrics.items()}
+    hits = sum(c['hits'] for c in per_name.values())
+    misses = sum(c['misses'] for c in per_name.values())
+    return {
+        'backend': type(_backend).__name__ if _backend is not None else None,
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+        'evictions': getattr(_backend, 'evictions', 0),
+        'caches': per_name,
+    }
+
+
+def reset_metrics() -> None:
+    with _metrics_lock:
+        _metrics.clear()
+
+
+# ---------------------------------------------------------------------------
+# ORM hooks: remember written tables per transaction, bump them on commit
+# ---------------------------------------------------------------------------
+
+def _written(session) -> set:
+    return session.info.setdefault('query_cache_tables', set())
+
+
+def _after_flush(session, flush_context):
+    written = _written(session)
+    for obj in list(session.new) + list(session.deleted):
+        written.add(obj.__table__.name)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            written.add(obj.__table__.name)
+
+
+def _do_orm_execute(state):
+    # Bulk inserts, query.update() and query.delete() skip the flush
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, 'table', None)
+        if table is not None:
+            _written(state.session).add(table.name)
+
+
+def _after_commit(session):
+    invalidate(*session.info.pop('query_cache_tables', ()))
+
+
+def _after_transaction_end(session, transaction):
+    # Whatever is left when the outermost transaction ends was rolled back
+    if transaction.parent is None:
+        session.info.pop('query_cache_tables', None)
+
+
+def _schema_changed(metadata, conn, tables=(), **kw):
+    invalidate(*(t.name for t in tables))
+
+
+def init_cache(db, url: Optional[str] = None) -> None:
+    """Pick the backend from `url` (or CACHE_URL) and hook into the session and DDL events."""
+    set_backend(backend_from_url(url or os.getenv('CACHE_URL', 'memory')))
+    event.listen(db.session, 'after_flush', _after_flush)
+    event.listen(db.session, 'do_orm_execute', _do_orm_execute)
+    event.listen(db.session, 'after_commit', _after_commit)
+    event.listen(db.session, 'after_transaction_end', _after_transaction_end)
+    event.listen(db.metadata, 'after_create', _schema_changed)
+    event.listen(db.metadata, 'after_drop', _schema_changed)
@@ -0,0 +1,200 @@
+"""
+raw_values.py - Parser registry for TestResult.raw_values strings
+
+Technicians type raw readings as short strings, one format per test kind:
+  - compressive:       "load_kN,area_mm2"                        e.g. "250,19600"
+  - flexural:          "load_kN,length_mm,width_mm,depth_mm"     e.g. "45,500,150,150"
+  - split_tensile:     "load_kN,length_mm,diameter_mm"           e.g. "120,300,150"
+  - water_absorption:  "dry_mass_g,saturated_mass_g"             e.g. "2000,2100"
+  - cbr:               "load_kN,standard_load_kN"                e.g. "10.5,13.24"
+  - proctor:           "dry_density_kgm3,water_content_percent"  e.g. "1850,12.5"
+  - atterberg:         "LL,PL"                                   e.g. "45,20"
+  - sieve:             "sieve:mass;...;total:mass"               e.g. "75:10;37.5:20;total:95"
+  - cube_report:       "load1,load2,load3,area_mm2" as read by the report routes
+
+Every route, report, export and bulk job parses through parse(kind, raw) so a
+string is tokenized once (single regex pass) and the result is kept in a
+per-process LRU cache keyed by (kind, raw). Parsed values are immutable
+namedtuples whose field names match the keys used by
+auto_calculations.process_readings, so `parsed._asdict()` can be passed
+straight to the calculation functions.
+
+Errors are raised as RawValuesError (a ValueError) carrying the kind, field
+and character position of the problem.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+
+# One token of a comma separated list: an optional number, then ',' or end of string
+_LIST_TOKEN = re.compile(r'\s*(?:(?P<num>' + _NUMBER + r')|(?P<bad>[^,]*?))\s*(?P<end>,|\Z)')
+# One entry of a sieve string: "size:mass" or "total:mass", then ';' or end of string
+_SIEVE_TOKEN = re.compile(
+    r'\s*(?:(?P<empty>(?=;))|(?P<key>(?i:total)|' + _NUMBER + r')\s*:\s*(?P<val>' + _NUMBER + r')'
+    r'|(?P<bad>[^;]*?))\s*(?P<end>;|\Z)')
+
+# Unit of every declared field, used when readings are stored as measurements
+FIELD_UNITS = {
+    'load_kN': 'kN', 'area_mm2': 'mm2', 'length_mm': 'mm', 'width_mm': 'mm',
+    'depth_mm': 'mm', 'diameter_mm': 'mm', 'dry_mass_g': 'g', 'saturated_mass_g': 'g',
+    'load_at_penetration_kN': 'kN', 'standard_load_kN': 'kN', 'dry_density_kgm3': 'kg/m3',
+    'water_content_percent': '%', 'liquid_limit': '%', 'plastic_limit': '%',
+    'load_1_kN': 'kN', 'load_2_kN': 'kN', 'load_3_kN': 'kN',
+    'sieve_mm': 'mm', 'retained_g': 'g', 'total_mass': 'g',
+}
+
+# Test names used in the UI -> parser kind
+KIND_BY_TEST_NAME = {
+    'Compressive Strength': 'compressive',
+    'Flexural Strength': 'flexural',
+    'Split Tensile Strength': 'split_tensile',
+    'Water Absorption': 'water_absorption',
+    'CBR Test': 'cbr',
+    'Proctor Compaction': 'proctor',
+    'Sieve Analysis': 'sieve',
+    'Atterberg Limits': 'atterberg',
+}
+
+
+class RawValuesError(ValueError):
+    """A raw_values string that does not match its test kind's schema."""
+
+    def __init__(self, kind: str, raw: str, message: str, field: Optional[str] = None,
+                 position: Optional[int] = None):
+        self.kind = kind
+        self.raw = raw
+        self.field = field
+        self.position = position
+        self.message = message
+        where = f' (field {field!r}, position {position})' if field else ''
+        super().__init__(f'{message}{where}')
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'raw': self.raw, 'field': self.field,
+                'position': self.position, 'message': self.message}
+
+
+class FieldListParser:
+    """Comma separated numbers mapped to named fields.
+
+    The first `required` fields must be present; later fields are optional
+    and come back as None. Extra trailing values are ignored, as the
+    original per-route `split(',')` code did.
+    """
+
+    def __init__(self, kind: str, fields: Tuple[str, ...], required: Optional[int] = None):
+        self.kind = kind
+        self.fields = fields
+        self.required = len(fields) if required is None else required
+        self.result_type = namedtuple(f'{kind}_values', fields)
+
+    def parse(self, raw: str):
+        values = []
+        pos = 0
+        while True:
+            m = _LIST_TOKEN.match(raw, pos)
+            index = len(values)
+            in_schema = index < len(self.fields)
+            if m.group('num') is not None:
+                values.append(float(m.group('num')))
+            elif m.group('bad'):
+                if in_schema:
+                    raise RawValuesError(self.kind, raw, f'Expected a number, got {m.group("bad")!r}',
+                                         self.fields[index], m.start('bad'))
+            elif index < self.required:
+                # an empty slot where a value is required, e.g. "250,,19600" or ""
+                raise RawValuesError(self.kind, raw, 'Missing value', self.fields[index], m.start())
+            if not m.group('end'):
+                break
+            pos = m.end()
+        if len(values) < self.required:
+            raise RawValuesError(self.kind, raw, f'Expected {self.required} values, got {len(values)}',
+                                 self.fields[len(values)], len(raw))
+        values = values[:len(self.fields)]
+        values += [None] * (len(self.fields) - len(values))
+        return self.result_type(*values)
+
+
+SieveValues = namedtuple('SieveValues', ('sieve_masses', 'total_mass'))
+
+
+class SieveParser:
+    """Semicolon separated "size:mass" entries with an optional "total:mass".
+
+    sieve_masses comes back as a tuple of (size, mass) pairs in input order
+    (use dict() on it); total_mass defaults to the sum of the masses.
+    """
+
+    kind = 'sieve'
+    fields = ('sieve_masses', 'total_mass')
+
+    def parse(self, raw: str) -> SieveValues:
+        masses = []
+        total = None
+        pos = 0
+        while True:
+            m = _SIEVE_TOKEN.match(raw, pos)
+            if m.group('key') is not None:
+                if m.group('key').lower() == 'total':
+                    total = float(m.group('val'))
+                else:
+                    masses.append((float(m.group('key')), float(m.group('val'))))
+            elif m.group('bad'):
+                raise RawValuesError(self.kind, raw, f'Expected "size:mass", got {m.group("bad")!r}',
+                                     'sieve_masses', m.start('bad'))
+            if not m.group('end'):
+                break
+            pos = m.end()
+        if not masses:
+            raise RawValuesError(self.kind, raw, 'No sieve entries found', 'sieve_masses', 0)
+        if total is None:
+            total = sum(mass for _, mass in masses)
+        return SieveValues(tuple(masses), total)
+
+
+_PARSERS: Dict[str, Any] = {}
+
+
+def register(parser) -> None:
+    """Add (or replace) the parser for `parser.kind` and drop cached results."""
+    _PARSERS[parser.kind] = parser
+    parse.cache_clear()
+
+
+def get_parser(kind: str):
+    try:
+        return _PARSERS[kind]
+    except KeyError:
+        raise RawValuesError(kind, None, f'Unknown test kind {kind!r}') from None
+
+
+@lru_cache(maxsize=8192)
+def parse(kind: str, raw: Optional[str]):
+    """Parse `raw` with the parser registered for `kind` (cached per process)."""
+    return get_parser(kind).parse(raw or '')
+
+
+def kind_for_test_name(test_name: str) -> Optional[str]:
+    return KIND_BY_TEST_NAME.get(test_name)
+
+
+def to_readings(kind: str, raw: Optional[str]) -> Dict[str, Any]:
+    """Parse `raw` into the readings dict shape used by auto_calculations."""
+    values = parse(kind, raw)._asdict()
+    if kind == 'sieve':
+        values['sieve_masses'] = dict(values['sieve_masses'])
+    return {kind: values}
+
+
+register(FieldListParser('compressive', ('load_kN', 'area_mm2')))
+register(FieldListParser('flexural', ('load_kN', 'length_mm', 'width_mm', 'depth_mm')))
+register(FieldListParser('split_tensile', ('load_kN', 'length_mm', 'diameter_mm')))
+register(FieldListParser('water_absorption', ('dry_mass_g', 'saturated_mass_g')))
+register(FieldListParser('cbr', ('load_at_penetration_kN', 'standard_load_kN')))
+register(FieldListParser('proctor', ('dry_density_kgm3', 'water_content_percent')))
+register(FieldListParser('atterberg', ('liquid_limit', 'plastic_limit')))
+register(FieldListParser('cube_report', ('load_1_kN', 'load_2_kN', 'load_3_kN', 'area_mm2'), required=0))
+register(SieveParser())
@@ -0,0 +1,244 @@
+"""
+renderers.py - PDF renderer detection and a pool of warm renderer processes
+
+Report PDFs can come from three backends, in order of preference:
+
+* weasyprint - HTML/CSS to PDF in Python (needs cairo/pango system libraries)
+* pdfkit     - HTML to PDF through the wkhtmltopdf binary
+* reportlab  - the plain ReportLab layout from report_generator.py (always there)
+
+available() probes them once per process instead of attempting an import on
+every report. Rendering happens in a RendererPool of long-lived worker
+processes fed over the executor's queue. Each worker imports its backends, keeps
+one WeasyPrint font configuration, renders a warm-up page so fonts and the
+CSS machinery are loaded, and preloads the files under static/. Images in a
+report (header.gif, ...) are then served from memory by a URL fetcher instead
+of being fetched back over HTTP from the app itself. pdfkit gets file:// URLs
+for the same files.
+
+    renderers.render_html(html, out_path, base_url)  # -> backend used
+
+PDF_RENDER_WORKERS sets the pool size (default 2); PDF_RENDERER=<backend>
+restricts rendering to one backend.
+"""
+import atexit
+import importlib
+import mimetypes
+import multiprocessing
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+BACKENDS = ('weasyprint', 'pdfkit', 'reportlab')
+HTML_BACKENDS = ('weasyprint', 'pdfkit')
+RENDER_TIMEOUT_SECONDS = 120
+START_METHOD = 'spawn'
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(_ROOT, 'static')
+WARMUP_HTML = '<html><head><style>body { font-family: sans-serif; }</style></head><body>warm-up</body></html>'
+
+
+class NoRendererAvailable(RuntimeError):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Detection
+# ---------------------------------------------------------------------------
+
+def _probe(backend: str) -> bool:
+    try:
+        if backend == 'weasyprint':
+            importlib.import_module('weasyprint')  # fails with OSError when cairo/pango are missing
+            return True
+        if backend == 'pdfkit':
+            importlib.import_module('pdfkit')
+            return shutil.which('wkhtmltopdf') is not None
+        if backend == 'reportlab':
+            importlib.import_module('reportlab.platypus')
+            return True
+    except Exception:
+        return False
+    return False
+
+
+_available: Optional[List[str]] = None
+
+
+def available(refresh: bool = False) -> List[str]:
+    """Usable backends in order of preference, probed once per process."""
+    global _available
+    if _available is None or refresh:
+        only = os.getenv('PDF_RENDERER')
+        _available = [b for b in BACKENDS if (not only or b == only) and _probe(b)]
+    return list(_available)
+
+
+def html_backend() -> Optional[str]:
+    """The preferred backend that renders HTML, or None when only ReportLab is usable."""
+    return next((b for b in available() if b in HTML_BACKENDS), None)
+
+
+# ---------------------------------------------------------------------------
+# Worker process side
+# ---------------------------------------------------------------------------
+
+_worker: Dict[str, object] = {}
+
+
+def _preload_static(static_dir: str) -> Dict[str, tuple]:
+    files = {}
+    for dirpath, _, names in os.walk(static_dir):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                files[rel] = (f.read(), mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    return files
+
+
+def _static_fetcher(url: str):
+    """WeasyPrint URL fetcher that answers /static/... from memory and defers everything else."""
+    marker = '/static/'
+    if marker in url:
+        rel = url.split(marker, 1)[1].split('?', 1)[0]
+        cached = _worker['static'].get(rel)
+        if cached is None:
+            raise ValueError(f'Static file not found: {rel}')
+        data, mime = cached
+        return {'string': data, 'mime_type': mime}
+    from weasyprint import default_url_fetcher
+    return default_url_fetcher(url)
+
+
+def init_worker(backends: List[str], static_dir: str = STATIC_DIR) -> None:
+    """Process initializer: import the backends once and render a warm-up page."""
+    _worker['backends'] = backends
+    _worker['static'] = _preload_static(static_dir) if os.path.isdir(static_dir) else {}
+    _worker['static_dir'] = static_dir
+    if 'weasyprint' in backends:
+        from weasyprint import HTML
+        from weasyprint.text.fonts import FontConfiguration
+        _worker['fonts'] = FontConfiguration()
+        HTML(string=WARMUP_HTML).write_pdf(font_config=_worker['fonts'])
+    if 'pdfkit' in backends:
+        import pdfkit
+        _worker['pdfkit_config'] = pdfkit.configuration()
+    if 'reportlab' in backends:
+        import report_generator  # noqa: F401  (imports ReportLab and its font metrics)
+
+
+def render_job(backend: str, out_path: str, html: Optional[str] = None, base_url: Optional[str] = None,
+               fields: Optional[dict] = None) -> str:
+    """Render one PDF inside a worker. Returns the backend name."""
+    if 'backends' not in _worker:
+        init_worker(available())
+    if backend == 'weasyprint':
+        from weasyprint import HTML
+        HTML(string=html, base_url=base_url, url_fetcher=_static_fetcher).write_pdf(
+            out_path, font_config=_worker['fonts'])
+    elif backend == 'pdfkit':
+        import pdfkit
+        if base_url:
+            html = html.replace(base_url.rstrip('/') + '/static/', 'file://' + _worker['static_dir'] + '/')
+        html = html.replace('"/static/', '"file://' + _worker['static_dir'] + '/')
+        pdfkit.from_string(html, out_path, configuration=_worker['pdfkit_config'],
+                           options={'enable-local-file-access': '', 'quiet': ''})
+    elif backend == 'reportlab':
+        from types import SimpleNamespace
+        from report_generator import generate_test_report_pdf
+        fields = dict(fields or {})
+        fields['sample'] = SimpleNamespace(**(fields.get('sample') or {}))
+        generate_test_report_pdf(out_path, **fields)
+    else:
+        raise ValueError(f'Unknown renderer {backend!r}')
+    return backend
+
+
+# ---------------------------------------------------------------------------
+# Pool
+# ---------------------------------------------------------------------------
+
+class RendererPool:
+    """Long-lived renderer processes; submit work from any thread."""
+
+    def __init__(self, workers: int = 2, backends: Optional[List[str]] = None):
+        self.backends = backends if backends is not None else available()
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self) -> ProcessPoolExecutor:
+        # Spawned, not forked: the app process runs threads (waitress, report workers), and a
+        # forked child can inherit a lock one of them held. init_worker() loads what a worker needs.
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(START_METHOD),
+                                   initializer=init_worker, initargs=(self.backends, STATIC_DIR))
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """Replace `broken` (a worker died, e.g. segfault or OOM kill) unless another thread already did."""
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._start()
+
+    def _submit(self, fn, *args, **kwargs) -> Tuple[ProcessPoolExecutor, Future]:
+        executor = self._executor
+        try:
+            return executor, executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self._restart(executor)
+            executor = self._executor
+            return executor, executor.submit(fn, *args, **kwargs)
+
+    def render(self, backend: str, out_path: str, timeout: float = RENDER_TIMEOUT_SECONDS, **kwargs) -> str:
+        if backend not in self.backends:
+            raise NoRendererAvailable(f'{backend} is not available')
+        executor, future = self._submit(render_job, backend, out_path, **kwargs)
+        try:
+            return future.result(timeout)
+        except BrokenProcessPool:  # the worker died during this job: try once more on a new pool
+            self._restart(executor)
+            return self._submit(render_job, backend, out_path, **kwargs)[1].result(timeout)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Run any picklable module-level function in a worker (e.g. batch report page layout)."""
+        return self._submit(fn, *args, **kwargs)[1]
+
+    def render_html(self, html: str, out_path: str, base_url: Optional[str] = None) -> str:
+        """Render HTML with the preferred HTML backend, trying the next one if it fails."""
+        errors = []
+        for backend in (b for b in self.backends if b in HTML_BACKENDS):
+            try:
+                return self.render(backend, out_path, html=html, base_url=base_url)
+            except Exception as e:
+                errors.append(f'{backend}: {e}')
+        raise NoRendererAvailable('; '.join(errors) or 'No HTML renderer available')
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool: Optional[RendererPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> RendererPool:
+    """The process-wide renderer pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RendererPool(int(os.getenv('PDF_RENDER_WORKERS', '2')))
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def render_html(html: str, out_path: str, base_url: Optional[str] = None) -> str:
+    return get_pool().render_html(html, out_path, base_url)
+
+
+def render_reportlab(out_path: str, **fields) -> str:
+    return get_pool().render('reportlab', out_path, fields=fields)
@@ -0,0 +1,296 @@
+"""
+report_jobs.py - Durable background queue for report generation
+
+Rendering a PDF (WeasyPrint especially) can take seconds, so requests no longer
+render: they enqueue() a row in report_jobs and return immediately, and the
+browser polls the job until it can download the file.
+
+Jobs are picked up by worker threads, either inside the web process
+(ensure_workers(), started by the first request of every process when
+REPORT_WORKERS > 0, so waitress-serve app:app runs them too) or in a separate
+process (scripts/lims_worker.py). A job is claimed with a conditional
+UPDATE ... WHERE status = 'queued', so any number of threads and processes can
+share one table without handing out the same job twice.
+
+* Identical in-flight jobs (same kind and parameters, still queued or running)
+  are deduplicated: enqueue() returns the existing job. inflight_key holds the
+  dedupe key until the job finishes and is unique, so two requests racing to
+  enqueue the same job cannot both insert it.
+* A failing job is retried with a growing delay until max_attempts, then
+  marked failed with the last error. While a job runs its worker refreshes
+  heartbeat_at every HEARTBEAT_SECONDS; jobs whose heartbeat stopped for
+  JOB_TIMEOUT (the worker died) are re-queued, or failed once they have used
+  all their attempts. Long jobs that are still running are left alone.
+* created_at / started_at / finished_at and the attempt count are kept so
+  admins can see queue wait, run time and retries on /admin/jobs.
+
+Handlers are registered per kind with register(kind, handler). A handler gets
+the ReportJob, runs inside an app and request context, and returns the path of
+the file it produced.
+"""
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 10  # multiplied by the attempt number
+JOB_TIMEOUT_SECONDS = 600
+HEARTBEAT_SECONDS = JOB_TIMEOUT_SECONDS / 10
+POLL_SECONDS = 2.0
+
+IN_FLIGHT = ('queued', 'running')
+
+_handlers: Dict[str, Callable] = {}
+_wakeup = threading.Event()
+_pool: Optional['WorkerPool'] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def register(kind: str, handler: Callable) -> None:
+    """Register the function that runs jobs of `kind`."""
+    _handlers[kind] = handler
+
+
+def dedupe_key(kind: str, params: dict) -> str:
+    payload = json.dumps([kind, params], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def enqueue(session, kind: str, params: dict, user_id: Optional[int] = None,
+            max_attempts: int = MAX_ATTEMPTS, dedupe_params: Optional[dict] = None) -> Tuple[object, bool]:
+    """Queue a job and commit. Returns (job, created).
+
+    When an identical job is already queued or running it is returned instead
+    (created is False). `dedupe_params` limits which parameters count for that
+    comparison; by default all of them do.
+    """
+    ReportJob = models.ReportJob
+    key = dedupe_key(kind, params if dedupe_params is None else dedupe_params)
+    existing = ReportJob.query.filter(ReportJob.inflight_key == key).first()
+    if existing is not None:
+        return existing, False
+    now = datetime.utcnow()
+    job = ReportJob(kind=kind, params=params, dedupe_key=key, inflight_key=key, status='queued', attempts=0,
+                    max_attempts=max_attempts, requested_by=user_id, created_at=now, run_after=now)
+    session.add(job)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Another request queued the same job between the check and the insert
+        session.rollback()
+        existing = ReportJob.query.filter(ReportJob.inflight_key == key).first()
+        if existing is None:
+            raise
+        return existing, False
+    _wakeup.set()
+    return job, True
+
+
+def claim_next(session, worker: str):
+    """Atomically take the oldest runnable job, or return None."""
+    ReportJob = models.ReportJob
+    now = datetime.utcnow()
+    candidates = (session.query(ReportJob.id)
+                  .filter(ReportJob.status == 'queued', ReportJob.run_after <= now,
+                          ReportJob.attempts < ReportJob.max_attempts)
+                  .order_by(ReportJob.run_after, ReportJob.id).limit(5).all())
+    for (job_id,) in candidates:
+        claimed = session.execute(
+            update(ReportJob)
+            .where(ReportJob.id == job_id, ReportJob.status == 'queued', ReportJob.attempts < ReportJob.max_attempts)
+            .values(status='running', worker=worker, started_at=now, heartbeat_at=now,
+                    attempts=ReportJob.attempts + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        session.commit()
+        if claimed:
+            return session.get(ReportJob, job_id, populate_existing=True)
+    return None
+
+
+def requeue_stale(session, timeout: float = JOB_TIMEOUT_SECONDS) -> int:
+    """Put jobs back in the queue whose worker has not sent a heartbeat for `timeout` seconds.
+
+    Jobs that have used all their attempts are marked failed instead: a job
+    that kills its worker (e.g. out of memory) would otherwise run forever.
+    Returns the number of jobs re-queued.
+    """
+    ReportJob = models.ReportJob
+    now = datetime.utcnow()
+    stale = (ReportJob.status == 'running',
+             func.coalesce(ReportJob.heartbeat_at, ReportJob.started_at) < now - timedelta(seconds=timeout))
+    session.execute(
+        update(ReportJob)
+        .where(*stale, ReportJob.attempts >= ReportJob.max_attempts)
+        .values(status='failed', inflight_key=None, finished_at=now,
+                error='Worker timed out (it may have crashed) on the last attempt')
+        .execution_options(synchronize_session=False))
+    count = session.execute(
+        update(ReportJob)
+        .where(*stale)
+        .values(status='queued', error='Worker timed out', run_after=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    session.commit()
+    return count
+
+
+def rerun(session, job):
+    """Queue a finished (done or failed) job again with a fresh set of attempts, and commit.
+
+    Returns the job that will run: `job`, or an identical job already in flight.
+    """
+    ReportJob = models.ReportJob
+    duplicate = ReportJob.query.filter(ReportJob.inflight_key == job.dedupe_key).first()
+    if duplicate is not None:
+        return duplicate
+    job.status = 'queued'
+    job.inflight_key = job.dedupe_key
+    job.max_attempts = job.attempts + MAX_ATTEMPTS
+    job.run_after = datetime.utcnow()
+    job.finished_at = None
+    job.result_path = None
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        duplicate = ReportJob.query.filter(ReportJob.inflight_key == job.dedupe_key).first()
+        if duplicate is None:
+            raise
+        return duplicate
+    _wakeup.set()
+    return job
+
+
+def _heartbeat(engine, job_id: int, stop: threading.Event, interval: float) -> None:
+    """Refresh the job's heartbeat_at until `stop` is set, on a connection of its own."""
+    table = models.ReportJob.__table__
+    while not stop.wait(interval):
+        try:
+            with engine.begin() as conn:
+                conn.execute(update(table).where(table.c.id == job_id, table.c.status == 'running')
+                             .values(heartbeat_at=datetime.utcnow()))
+        except Exception as e:  # the next beat tries again
+            print(f'report job {job_id}: heartbeat failed: {type(e).__name__}: {e}')
+
+
+def run_job(app, session, job) -> None:
+    """Run one claimed job and record success, a retry or the final failure."""
+    ReportJob = models.ReportJob
+    job_id = job.id
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(session.get_bind(), job_id, stop, HEARTBEAT_SECONDS),
+                            name=f'report-job-{job_id}-heartbeat', daemon=True)
+    beat.start()
+    try:
+        handler = _handlers[job.kind]
+        with app.test_request_context('/', base_url=(job.params or {}).get('base_url')):
+            result_path = handler(job)
+    except Exception as e:
+        stop.set()
+        beat.join()
+        session.rollback()
+        job = session.get(ReportJob, job_id)
+        job.error = f'{type(e).__name__}: {e}'
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.inflight_key = None
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=RETRY_DELAY_SECONDS * job.attempts)
+    else:
+        stop.set()
+        beat.join()
+        job.status = 'done'
+        job.inflight_key = None
+        job.result_path = result_path
+        job.error = None
+        job.finished_at = datetime.utcnow()
+    session.commit()
+
+
+def run_pending(app, worker: str = 'inline', limit: Optional[int] = None) -> int:
+    """Run runnable jobs in this thread until none are left (or `limit`). Returns jobs run."""
+    done = 0
+    with app.app_context():
+        session = app.extensions['sqlalchemy'].session
+        while limit is None or done < limit:
+            job = claim_next(session, worker)
+            if job is None:
+                break
+            run_job(app, session, job)
+            done += 1
+    return done
+
+
+def worker_name(index: int = 0) -> str:
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+class WorkerPool:
+    """Background threads that keep draining the queue until stop() is called."""
+
+    def __init__(self, app, threads: int = 2, poll_seconds: float = POLL_SECONDS):
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._loop, args=(i,), name=f'report-worker-{i}', daemon=True)
+                         for i in range(threads)]
+
+    def start(self) -> 'WorkerPool':
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _loop(self, index: int) -> None:
+        name = worker_name(index)
+        last_sweep = 0.0
+        while not self._stop.is_set():
+            try:
+                if index == 0 and time.monotonic() - last_sweep > JOB_TIMEOUT_SECONDS / 10:
+                    with self.app.app_context():
+                        requeue_stale(self.app.extensions['sqlalchemy'].session)
+                    last_sweep = time.monotonic()
+                ran = run_pending(self.app, worker=name, limit=1)
+            except Exception as e:  # keep the thread alive through database hiccups
+                print(f'{name}: {type(e).__name__}: {e}')
+                ran = 0
+            if not ran:
+                _wakeup.wait(self.poll_seconds)
+                _wakeup.clear()
+
+
+def start_workers(app, threads: int = 2) -> WorkerPool:
+    """Start in-process worker threads for `app`."""
+    return WorkerPool(app, threads).start()
+
+
+def ensure_workers(app, threads: int) -> Optional[WorkerPool]:
+    """Start this process's worker threads unless they are running (again after a fork)."""
+    global _pool, _pool_pid
+    if threads <= 0:
+        return None
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = start_workers(app, threads)
+                _pool_pid = os.getpid()
+    return _pool
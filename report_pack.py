@@ -0,0 +1,116 @@
+"""
+report_pack.py - Stream a ZIP of report PDFs while it is being built
+
+/projects/<id>/reports.zip sends every approved report of a project as one
+download. Nothing is assembled up front:
+
+* stream_zip() writes the archive to a sink with no seek(), so zipfile puts
+  sizes and CRCs in data descriptors after each file. The bytes are yielded
+  as they are produced, 64 KiB at a time, with no temporary file;
+* entries come from ordered_ahead(), which starts resolving the next few
+  entries (up to `window`) on background threads while earlier ones are
+  being sent. Resolving a report that was never rendered renders it, so
+  missing reports are rendered just ahead of the stream cursor and at most
+  `window` PDFs are open or rendering at any time.
+
+PDFs are already compressed, so entries are stored rather than deflated.
+"""
+import os
+import re
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+CHUNK_SIZE = 64 * 1024
+RENDER_AHEAD = 8  # entries resolved (read or rendered) ahead of the one being sent
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _threads() -> ThreadPoolExecutor:
+    """Threads that wait on renders; the rendering itself happens in the renderer processes."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv('PDF_RENDER_WORKERS', '2')),
+                                           thread_name_prefix='report-pack')
+        return _executor
+
+
+def ordered_ahead(items: Iterable, resolve: Callable, window: int = RENDER_AHEAD) -> Iterator:
+    """Yield resolve(item) for each item, in order, running up to `window` resolves ahead."""
+    executor = _threads()
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(resolve, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:  # client went away: don't render the rest
+            future.cancel()
+
+
+class _Sink:
+    """Unseekable file object collecting what zipfile writes."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> Iterator[bytes]:
+        """What was written since the last take(), as zero or one chunk."""
+        if self.parts:
+            data = b''.join(self.parts)
+            self.parts.clear()
+            yield data
+
+
+def safe_name(value) -> str:
+    """A file-name-safe version of `value`."""
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(value)).strip('_') or 'report'
+
+
+def stream_zip(entries: Iterable[Tuple[str, Optional[str]]], missing_note: bool = True) -> Iterator[bytes]:
+    """ZIP archive bytes for (archive name, file path) entries, yielded as they are written.
+
+    Entries whose path is None or unreadable are listed in MISSING.txt at the end.
+    """
+    sink = _Sink()
+    missing = []
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for arcname, path in entries:
+            try:
+                src = open(path, 'rb') if path else None
+            except OSError:
+                src = None
+            if src is None:
+                missing.append(arcname)
+                continue
+            with src:
+                st = os.fstat(src.fileno())
+                info = zipfile.ZipInfo(arcname, date_time=datetime.fromtimestamp(st.st_mtime).timetuple()[:6])
+                info.file_size = st.st_size  # lets zipfile decide on ZIP64 before writing the header
+                with zf.open(info, 'w') as dst:
+                    while True:
+                        block = src.read(CHUNK_SIZE)
+                        if not block:
+                            break
+                        dst.write(block)
+                        yield from sink.take()
+            yield from sink.take()
+        if missing and missing_note:
+            zf.writestr('MISSING.txt', 'These reports could not be rendered:\n' + '\n'.join(missing) + '\n')
+    yield from sink.take()
@@ -0,0 +1,78 @@
+"""
+results.py - Typed storage and display formatting of calculated results
+
+Calculations store numbers, not display strings: TestResult.result_value and
+result_unit hold the headline figure (e.g. 27.4 / 'MPa'), result_payload keeps
+structured output such as the sieve summary table, result_kind says which
+calculation produced it and calc_version which version of the formulas.
+
+format_result() turns those columns into the text shown to users. Templates
+call it at render time through the `format_result` Jinja filter; the legacy
+calculated_result column is still filled with the same text for older readers.
+"""
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func
+
+import models
+from calculations import CALCULATION_VERSION
+
+# kind -> unit of the headline value
+RESULT_UNITS = {
+    'compressive': 'MPa',
+    'flexural': 'MPa',
+    'split_tensile': 'MPa',
+    'water_absorption': '%',
+    'cbr': '%',
+    'proctor': 'kg/m3',
+    'atterberg': '%',
+    'sieve': None,
+}
+
+
+def set_result(test_result, kind: str, value: Optional[float] = None,
+               payload: Optional[Dict[str, Any]] = None) -> None:
+    """Store a calculated result on a TestResult (does not commit)."""
+    test_result.result_kind = kind
+    test_result.result_value = value
+    test_result.result_unit = RESULT_UNITS.get(kind)
+    test_result.result_payload = payload
+    test_result.calc_version = CALCULATION_VERSION
+    test_result.calculated_result = format_result(test_result)
+
+
+def format_result(test_result) -> str:
+    """Display text for a test's result, built from the typed columns.
+
+    Rows calculated before the typed columns existed only have the legacy
+    calculated_result string, which is returned unchanged.
+    """
+    kind = getattr(test_result, 'result_kind', None)
+    value = getattr(test_result, 'result_value', None)
+    payload = getattr(test_result, 'result_payload', None) or {}
+    if kind in ('compressive', 'flexural', 'split_tensile') and value is not None:
+        return f"{value:.3f} MPa"
+    if kind == 'water_absorption' and value is not None:
+        return f"{value:.2f}%"
+    if kind == 'cbr' and value is not None:
+        return f"CBR = {value:.2f}%"
+    if kind == 'proctor' and payload:
+        return f"ρd={payload['dry_density']} kg/m³, w={payload['water_content']}%"
+    if kind == 'atterberg' and payload:
+        return f"LL={payload['LL']}%, PL={payload['PL']}%, PI={payload['PI']}%"
+    if kind == 'sieve' and payload:
+        return str(payload['summary_table'])
+    return test_result.calculated_result or ''
+
+
+def result_statistics(test_name: str, project_id: Optional[int] = None) -> Dict[str, Any]:
+    """Count/avg/min/max of result_value for one test type, as a single SQL aggregate."""
+    TestResult, Sample = models.TestResult, models.Sample
+    query = (TestResult.query
+             .with_entities(func.count(TestResult.result_value), func.avg(TestResult.result_value),
+                            func.min(TestResult.result_value), func.max(TestResult.result_value))
+             .filter(TestResult.test_name == test_name, TestResult.result_value.isnot(None)))
+    if project_id is not None:
+        query = query.join(Sample, Sample.id == TestResult.sample_id).filter(Sample.project_id == project_id)
+    count, avg, low, high = query.one()
+    return {'count': count, 'avg': avg, 'min': low, 'max': high}
@@ -25,7 +25,14 @@ CREATE TABLE IF NOT EXISTS test_results (
   test_name VARCHAR(120) NOT NULL,
   raw_values TEXT,
   calculated_result TEXT,
+  result_kind VARCHAR(30),
+  result_value DOUBLE,
+  result_unit VARCHAR(10),
+  result_payload JSON,
+  calc_version VARCHAR(20),
   date_tested DATETIME,
+  KEY ix_test_results_name_value (test_name, result_value),
+  KEY ix_test_results_sample (sample_id),
   FOREIGN KEY (sample_id) REFERENCES samples(id) ON DELETE CASCADE
 ) ENGINE=InnoDB;
 
@@ -38,3 +45,126 @@ CREATE TABLE IF NOT EXISTS reports (
   FOREIGN KEY (sample_id) REFERENCES samples(id) ON DELETE SET NULL,
   FOREIGN KEY (test_result_id) REFERENCES test_results(id) ON DELETE SET NULL
 ) ENGINE=InnoDB;
+
+-- One row per numeric reading, normalized out of test_results.raw_values
+CREATE TABLE IF NOT EXISTS measurements (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  test_result_id INT NOT NULL,
+  field VARCHAR(40) NOT NULL,
+  ordinal INT NOT NULL DEFAULT 0,
+  value DOUBLE NOT NULL,
+  unit VARCHAR(10),
+  UNIQUE KEY uq_measurement_field (test_result_id, field, ordinal),
+  KEY ix_measurements_field_value (field, value),
+  FOREIGN KEY (test_result_id) REFERENCES test_results(id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- Sample search index (search.py); trigram postings instead of leading-wildcard LIKE
+CREATE TABLE IF NOT EXISTS search_documents (
+  sample_id INT PRIMARY KEY,
+  body TEXT NOT NULL
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS search_grams (
+  gram VARCHAR(3) NOT NULL,
+  sample_id INT NOT NULL,
+  PRIMARY KEY (gram, sample_id),
+  KEY ix_search_grams_sample_id (sample_id)
+) ENGINE=InnoDB;
+
+-- Dashboard totals maintained incrementally by stats.py
+CREATE TABLE IF NOT EXISTS stats_counters (
+  name VARCHAR(40) PRIMARY KEY,
+  value INT NOT NULL DEFAULT 0,
+  reconciled_at DATETIME
+) ENGINE=InnoDB;
+
+-- Background report jobs (report_jobs.py)
+CREATE TABLE IF NOT EXISTS report_jobs (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  kind VARCHAR(40) NOT NULL,
+  params JSON NOT NULL,
+  dedupe_key VARCHAR(64) NOT NULL,
+  inflight_key VARCHAR(64),
+  status VARCHAR(20) NOT NULL DEFAULT 'queued',
+  attempts INT NOT NULL DEFAULT 0,
+  max_attempts INT NOT NULL DEFAULT 3,
+  error TEXT,
+  result_path VARCHAR(255),
+  worker VARCHAR(80),
+  requested_by INT,
+  created_at DATETIME NOT NULL,
+  run_after DATETIME NOT NULL,
+  started_at DATETIME,
+  heartbeat_at DATETIME,
+  finished_at DATETIME,
+  KEY ix_report_jobs_status_run_after (status, run_after),
+  KEY ix_report_jobs_dedupe (dedupe_key, status),
+  UNIQUE KEY ux_report_jobs_inflight (inflight_key),
+  FOREIGN KEY (requested_by) REFERENCES users(id) ON DELETE SET NULL
+) ENGINE=InnoDB;
+
+-- JSON API bearer tokens (api.py); only the sha256 of a token is stored
+CREATE TABLE IF NOT EXISTS api_tokens (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  user_id INT NOT NULL,
+  name VARCHAR(80) NOT NULL,
+  token_hash VARCHAR(64) NOT NULL UNIQUE,
+  created_at DATETIME NOT NULL,
+  last_used_at DATETIME,
+  revoked_at DATETIME,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- Client-supplied keys of ingested test results, so retried batches are not inserted twice
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  user_id INT NOT NULL,
+  `key` VARCHAR(100) NOT NULL,
+  fingerprint VARCHAR(64) NOT NULL,
+  test_result_id INT,
+  created_at DATETIME NOT NULL,
+  UNIQUE KEY uq_idempotency_keys_user_key (user_id, `key`),
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+  FOREIGN KEY (test_result_id) REFERENCES test_results(id) ON DELETE SET NULL
+) ENGINE=InnoDB;
+
+-- Audit log, one RANGE partition per month (audit_archive.py adds the coming
+-- months and archives old ones). MySQL needs the partitioning column in the
+-- primary key and allows no foreign keys on partitioned tables, so user_id
+-- is not a foreign key here.
+CREATE TABLE IF NOT EXISTS audit_logs (
+  id INT AUTO_INCREMENT,
+  user_id INT,
+  action VARCHAR(50) NOT NULL,
+  entity_type VARCHAR(50) NOT NULL,
+  entity_id INT,
+  details TEXT,
+  timestamp DATETIME NOT NULL,
+  chain_hash CHAR(64),
+  PRIMARY KEY (id, timestamp),
+  KEY ix_audit_logs_timestamp (timestamp),
+  KEY ix_audit_logs_entity (entity_type, entity_id),
+  KEY ix_audit_logs_user (user_id)
+) ENGINE=InnoDB
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+  PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+-- Sealed blocks of audit entries (audit_chain.py): Merkle root per block and
+-- the hash chain linking blocks, for tamper-evidence checks
+CREATE TABLE IF NOT EXISTS audit_blocks (
+  id INT PRIMARY KEY,
+  first_id INT NOT NULL,
+  last_id INT NOT NULL,
+  entries INT NOT NULL,
+  first_timestamp DATETIME NOT NULL,
+  last_timestamp DATETIME NOT NULL,
+  prev_hash CHAR(64) NOT NULL,
+  last_hash CHAR(64) NOT NULL,
+  merkle_root CHAR(64) NOT NULL,
+  block_hash CHAR(64) NOT NULL,
+  sealed_at DATETIME NOT NULL,
+  KEY ix_audit_blocks_last_id (last_id),
+  KEY ix_audit_blocks_timestamps (first_timestamp, last_timestamp)
+) ENGINE=InnoDB;
@@ -0,0 +1,42 @@
+"""
+schema_upgrade.py - Bring an existing database up to the current models
+
+db.create_all() creates missing tables but never touches tables that already
+exist, so databases created before a column or index was added to models.py
+would fail on the first query. upgrade() adds any missing nullable columns and
+missing indexes with plain ALTER TABLE / CREATE INDEX statements. It only ever
+adds; it never drops or changes existing columns.
+"""
+from sqlalchemy import inspect, text
+
+
+def upgrade(db) -> list:
+    """Create missing tables, columns and indexes. Returns the statements run."""
+    db.create_all()
+    return add_missing_columns(db.metadata, db.engine)
+
+
+def add_missing_columns(metadata, engine) -> list:
+    """Add nullable columns and indexes present in `metadata` but not in the database."""
+    inspector = inspect(engine)
+    statements = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            col_type = column.type.compile(dialect=engine.dialect)
+            statements.append(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}')
+        indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                cols = ', '.join(c.name for c in index.columns)
+                unique = 'UNIQUE ' if index.unique else ''
+                statements.append(f'CREATE {unique}INDEX {index.name} ON {table.name} ({cols})')
+    if statements:
+        with engine.begin() as conn:
+            for stmt in statements:
+                conn.execute(text(stmt))
+    return statements
@@ -0,0 +1,101 @@
+"""Seal and verify the hash-chained audit log (see audit_chain.py).
+
+    seal          chain new entries and store every complete Merkle block
+    verify        re-hash the blocks (optionally of a date range) in a
+                  process pool; reports the first divergent block
+    verify-entry  check one entry with its O(log n) inclusion proof
+    head          print the root over all blocks, to publish elsewhere
+
+Run from project root:
+    python scripts/audit_chain.py seal
+    python scripts/audit_chain.py verify --from 2024-01-01 --to 2024-03-31 --workers 8
+    python scripts/audit_chain.py verify-entry 12345 --root <published head root>
+
+Exits with status 1 when verification fails.
+"""
+import argparse
+import json
+import os
+import sys
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as myapp
+import audit
+import audit_archive
+import audit_chain
+import schema_upgrade
+from sqlalchemy import select
+
+
+def _entry(conn, entry_id, archive_dir):
+    entries = audit_archive.entries_table(conn)
+    row = conn.execute(select(entries).where(entries.c.id == entry_id)).first()
+    if row is not None:
+        return row
+    return next((e for e in audit_archive.read_archive(archive_dir) if e['id'] == entry_id), None)
+
+
+def main():
+    config = myapp.app.config
+    parser = argparse.ArgumentParser(description='Seal and verify the audit log hash chain')
+    parser.add_argument('command', choices=('seal', 'verify', 'verify-entry', 'head'))
+    parser.add_argument('entry_id', nargs='?', type=int, help='verify-entry: audit entry id')
+    parser.add_argument('--from', dest='start', help='verify: first day, YYYY-MM-DD')
+    parser.add_argument('--to', dest='end', help='verify: last day, YYYY-MM-DD')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='verify: processes re-hashing blocks (default: one per CPU)')
+    parser.add_argument('--root', help='verify-entry: published head root (default: the current one)')
+    parser.add_argument('--block-size', type=int, default=config['AUDIT_BLOCK_SIZE'],
+                        help=f"seal: entries per block (default: {config['AUDIT_BLOCK_SIZE']})")
+    parser.add_argument('--archive-dir', default=config['AUDIT_ARCHIVE_DIR'],
+                        help=f"Archived months (default: {config['AUDIT_ARCHIVE_DIR']})")
+    args = parser.parse_args()
+    try:
+        start = audit_archive.parse_day(args.start, '--from')
+        end = audit_archive.parse_day(args.end, '--to', end=True)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.command == 'verify-entry' and args.entry_id is None:
+        parser.error('verify-entry needs an entry id')
+
+    with myapp.app.app_context():
+        schema_upgrade.upgrade(myapp.db)  # adds audit_logs.chain_hash and audit_blocks to older databases
+        audit_archive.upgrade_rollover_tables(myapp.db.engine)
+        with myapp.db.engine.begin() as conn:
+            if args.command == 'seal':
+                audit.flush()
+                sealed = audit_chain.seal(conn, args.block_size)
+                print(f"Done: {sealed['chained']} entries chained, {sealed['blocks']} blocks sealed, "
+                      f"{audit_chain.unsealed(conn)} entries after the last block")
+            elif args.command == 'head':
+                print(json.dumps(audit_chain.head(conn)))
+            elif args.command == 'verify':
+                report = audit_chain.verify(conn, start, end, workers=args.workers, archive_dir=args.archive_dir)
+                if not report['ok']:
+                    print(f"DIVERGENT: {json.dumps(report['divergent'])}")
+                    print(f"{report['blocks']} blocks verified before it")
+                    return 1
+                print(f"OK: {report['blocks']} blocks, {report['entries']} entries verified")
+            else:
+                entry = _entry(conn, args.entry_id, args.archive_dir)
+                if entry is None:
+                    print(f'Audit entry {args.entry_id} not found')
+                    return 1
+                try:
+                    proof = audit_chain.prove(conn, args.entry_id, args.archive_dir)
+                except audit_chain.ChainError as e:
+                    print(e)
+                    return 1
+                root = args.root or audit_chain.head(conn)['root']
+                if not audit_chain.verify_proof(entry, proof, root):
+                    print(f"FAILED: entry {args.entry_id} does not match block {proof['block']} or root {root}")
+                    return 1
+                print(f"OK: entry {args.entry_id} is in block {proof['block']} under root {root} "
+                      f"({len(proof['path']) + len(proof['block_path'])} hashes)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
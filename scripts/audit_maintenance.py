@@ -0,0 +1,87 @@
+"""Roll over, archive and search the audit log (see audit_archive.py).
+
+    rollover   move finished months out of audit_logs (SQLite) or add the
+               coming months' partitions (MySQL)
+    archive    write months older than the retention window to compressed
+               JSONL files and drop them from the database
+    search     stream archived entries matching the filters as JSON lines
+    partition  convert a MySQL audit_logs table created by create_all()
+               into monthly partitions (once)
+
+Run from project root, e.g. monthly from cron:
+    python scripts/audit_maintenance.py archive --keep-months 12
+    python scripts/audit_maintenance.py search --action APPROVE --from 2023-01-01 --to 2023-03-31
+"""
+import argparse
+import json
+import os
+import sys
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as myapp
+import audit
+import audit_archive
+import audit_chain
+import schema_upgrade
+
+
+def main():
+    config = myapp.app.config
+    parser = argparse.ArgumentParser(description='Audit log partitions and archives')
+    parser.add_argument('command', choices=('rollover', 'archive', 'search', 'partition'))
+    parser.add_argument('--dir', default=config['AUDIT_ARCHIVE_DIR'],
+                        help=f"Archive directory (default: {config['AUDIT_ARCHIVE_DIR']})")
+    parser.add_argument('--keep-months', type=int, default=config['AUDIT_RETENTION_MONTHS'],
+                        help=f"Months kept in the database (default: {config['AUDIT_RETENTION_MONTHS']})")
+    parser.add_argument('--from', dest='start', help='search: first day, YYYY-MM-DD')
+    parser.add_argument('--to', dest='end', help='search: last day, YYYY-MM-DD')
+    parser.add_argument('--user-id', type=int, help='search: user id')
+    parser.add_argument('--action', help='search: action, e.g. APPROVE')
+    parser.add_argument('--entity-type', help='search: entity type, e.g. TestResult')
+    parser.add_argument('--entity-id', type=int, help='search: entity id')
+    parser.add_argument('--text', help='search: text contained in the details')
+    args = parser.parse_args()
+
+    if args.command == 'search':
+        try:
+            start = audit_archive.parse_day(args.start, '--from')
+            end = audit_archive.parse_day(args.end, '--to', end=True)
+        except ValueError as e:
+            parser.error(str(e))
+        for entry in audit_archive.read_archive(args.dir, start, end, user_id=args.user_id, action=args.action,
+                                                entity_type=args.entity_type, entity_id=args.entity_id,
+                                                text_filter=args.text):
+            print(json.dumps(entry))
+        return 0
+
+    with myapp.app.app_context():
+        schema_upgrade.upgrade(myapp.db)  # adds the audit_logs indexes to older databases
+        audit_archive.upgrade_rollover_tables(myapp.db.engine)
+        audit.flush()  # queued entries belong in the month being rolled over
+        with myapp.db.engine.begin() as conn:
+            if args.command in ('rollover', 'archive'):
+                # Entries leave audit_logs chained, so the chain has no gaps (see audit_chain.py)
+                audit_chain.seal(conn, config['AUDIT_BLOCK_SIZE'])
+            if args.command == 'rollover':
+                moved = audit_archive.rollover(conn)
+                for table, count in moved.items():
+                    print(f'{table}: {count} entries moved')
+                print(f'Done: {len(moved)} rollover tables written')
+            elif args.command == 'archive':
+                written = audit_archive.archive(conn, args.dir, keep_months=args.keep_months)
+                for path, count in written.items():
+                    print(f'{path}: {count} entries')
+                print(f'Done: {len(written)} months archived')
+            else:
+                if conn.dialect.name not in ('mysql', 'mariadb'):
+                    print('Partitioning is MySQL only; other databases use rollover tables')
+                    return 1
+                for statement in audit_archive.partition_mysql_table(conn):
+                    print(statement)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""Backfill the measurements table from existing TestResult.raw_values.
+
+Runs in small committed chunks so the app can keep writing while it works.
+Safe to interrupt: re-running skips tests that already have measurements.
+
+Run from project root:
+    python scripts/backfill_measurements.py
+    python scripts/backfill_measurements.py --chunk-size 1000 --start-id 250000
+"""
+import argparse
+import os
+import sys
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as myapp
+import measurements
+import schema_upgrade
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill measurements from raw_values')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Tests per transaction (default: 500)')
+    parser.add_argument('--start-id', type=int, default=0, help='Only tests with id greater than this')
+    args = parser.parse_args()
+
+    def progress(last_id, written):
+        print(f'  up to test {last_id}: {written} measurements written')
+
+    with myapp.app.app_context():
+        schema_upgrade.upgrade(myapp.db)  # creates the measurements table if it is missing
+        last_id, written = measurements.backfill(myapp.db.session, chunk_size=args.chunk_size,
+                                                 start_id=args.start_id, progress=progress)
+    print(f'Done: {written} measurements written, last test id {last_id}')
+
+
+if __name__ == '__main__':
+    main()
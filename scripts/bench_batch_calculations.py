@@ -0,0 +1,87 @@
+"""Benchmark batch_calculations against a Python loop over calculations.
+
+Times each formula at 1k / 100k / 1M rows and prints the speedup of the
+vectorized version over calling the scalar function once per row.
+
+Run from project root:
+    python scripts/bench_batch_calculations.py
+    python scripts/bench_batch_calculations.py --sizes 1000 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import calculations
+import batch_calculations
+
+
+def make_inputs(n, rng):
+    """Random but realistic readings (3 decimal places, like a bench sheet)."""
+    def col(lo, hi):
+        return np.round(rng.uniform(lo, hi, n), 3)
+    return {
+        'compressive_strength_mpa': (col(100, 900), col(19000, 23000)),
+        'flexural_strength_mpa': (col(10, 80), col(400, 700), col(100, 150), col(100, 150)),
+        'split_tensile_strength_mpa': (col(50, 400), col(200, 300), col(100, 150)),
+        'water_absorption_percent': (col(1800, 2200), col(2200, 2400)),
+        'cbr_value': (col(1, 30), col(13.24, 19.96)),
+        'proctor_compaction': (col(1500, 2200), col(5, 25)),
+        'atterberg_limits': (col(30, 60), col(10, 30)),
+    }
+
+
+def time_loop(fn, columns):
+    start = time.perf_counter()
+    for row in zip(*(c.tolist() for c in columns)):
+        try:
+            fn(*row)
+        except ValueError:
+            pass
+    return time.perf_counter() - start
+
+
+def time_batch(fn, columns):
+    start = time.perf_counter()
+    fn(*columns)
+    return time.perf_counter() - start
+
+
+SIEVE_SIZES = [75, 37.5, 19, 9.5, 4.75, 2.36, 1.18, 0.6, 0.3, 0.15, 0.075]
+
+
+def time_sieve(n, rng):
+    """Time gradation QC for n lots: dict-per-lot loop vs one matrix call."""
+    retained = np.round(rng.uniform(0, 50, (n, len(SIEVE_SIZES))), 2)
+    totals = retained.sum(axis=1)
+    start = time.perf_counter()
+    for row, total in zip(retained.tolist(), totals.tolist()):
+        calculations.sieve_analysis_summary(dict(zip(SIEVE_SIZES, row)), total)
+    loop_s = time.perf_counter() - start
+    batch_s = time_batch(batch_calculations.sieve_analysis_summary, (SIEVE_SIZES, retained, totals))
+    return loop_s, batch_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark vectorized calculations')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'function':<28}{'rows':>10}{'loop (s)':>12}{'batch (s)':>12}{'speedup':>10}")
+    for n in args.sizes:
+        for name, columns in make_inputs(n, rng).items():
+            loop_s = time_loop(getattr(calculations, name), columns)
+            batch_s = time_batch(getattr(batch_calculations, name), columns)
+            print(f"{name:<28}{n:>10}{loop_s:>12.4f}{batch_s:>12.4f}{loop_s / batch_s:>9.1f}x")
+        loop_s, batch_s = time_sieve(n, rng)
+        print(f"{'sieve_analysis_summary':<28}{n:>10}{loop_s:>12.4f}{batch_s:>12.4f}{loop_s / batch_s:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Benchmark the PDF renderer backends: per-report latency and throughput.
+
+For every backend found by renderers.available() this renders the cube report
+template (or the ReportLab layout) N times:
+
+  cold   - a fresh process per report, importing the backend each time
+           (what a request paid before the renderer pool existed)
+  pooled - submitted concurrently to a warm RendererPool
+
+Run from project root:
+    python scripts/bench_renderers.py
+    python scripts/bench_renderers.py --reports 50 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from types import SimpleNamespace
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import renderers
+
+SAMPLE = {'sample_id': 'BENCH-001', 'sample_type': 'Concrete', 'project_name': 'Benchmark',
+          'client_name': 'Bench Client', 'date_collected': '2024-01-01'}
+
+
+def report_html():
+    """The cube report template rendered with fixed data."""
+    import app as myapp
+    context = {
+        'sample': SimpleNamespace(**SAMPLE), 'report_date': '2024-01-02', 'report_no': 'RPT-1',
+        'ulr_no': 'BENCH-001', 'date_of_test': '2024-01-02', 'num_cubes': 3,
+        'customer_reference': 'Letter No. Nil', 'grade': 'M20', 'dimension': '150 mm x 150 mm x 150 mm',
+        'cross_section_area': '22500 sq.mm', 'failure_loads': [450.0, 460.0, 470.0],
+        'compressive_strengths': [20.0, 20.444, 20.889], 'test_name': 'Compressive Strength',
+        'test_result': '20.444 MPa', 'test_status': 'Approved', 'technician': 'bench',
+        'remarks': None, 'qr_code': None,
+    }
+    with myapp.app.test_request_context('/', base_url='http://localhost:5000/'):
+        from flask import render_template
+        return render_template('report_cube.html', **context)
+
+
+def job_kwargs(backend, html):
+    if backend == 'reportlab':
+        return {'fields': {'lab_name': 'Bench Lab', 'sample': SAMPLE, 'test_name': 'Compressive Strength',
+                           'raw_values': '450,460,470,22500', 'result': '20.444 MPa', 'technician': 'bench'}}
+    return {'html': html, 'base_url': 'http://localhost:5000/'}
+
+
+def cold_once(backend, out_path, kwargs):
+    # Runs in a brand-new process, so imports and font loading are paid every time
+    return renderers.render_job(backend, out_path, **kwargs)
+
+
+def bench_cold(backend, html, n, tmp):
+    latencies = []
+    kwargs = job_kwargs(backend, html)
+    start = time.perf_counter()
+    for i in range(n):
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as one_shot:
+            one_shot.submit(cold_once, backend, os.path.join(tmp, f'cold_{i}.pdf'), kwargs).result()
+        latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - start
+
+
+def bench_pooled(backend, html, n, workers, tmp):
+    pool = renderers.RendererPool(workers, backends=[backend])
+    kwargs = job_kwargs(backend, html)
+    for i in range(workers):  # make sure every worker has started and warmed up
+        pool.render(backend, os.path.join(tmp, f'warm_{i}.pdf'), **kwargs)
+
+    def one(i):
+        t0 = time.perf_counter()
+        pool.render(backend, os.path.join(tmp, f'pooled_{i}.pdf'), **kwargs)
+        return time.perf_counter() - t0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as clients:
+        latencies = list(clients.map(one, range(n)))
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    return latencies, elapsed
+
+
+def row(backend, mode, latencies, elapsed):
+    p50 = statistics.median(latencies) * 1000
+    p95 = sorted(latencies)[max(0, int(len(latencies) * 0.95) - 1)] * 1000
+    print(f'{backend:<11} {mode:<7} {p50:>9.1f} {p95:>9.1f} {len(latencies) / elapsed:>12.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PDF renderer backends')
+    parser.add_argument('--reports', type=int, default=20, help='Reports per backend and mode (default: 20)')
+    parser.add_argument('--workers', type=int, default=2, help='Renderer pool size (default: 2)')
+    args = parser.parse_args()
+
+    backends = renderers.available()
+    print(f'Available renderers: {", ".join(backends) or "none"}')
+    html = report_html()
+    print(f"\n{'backend':<11} {'mode':<7} {'p50 ms':>9} {'p95 ms':>9} {'reports/s':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            row(backend, 'cold', *bench_cold(backend, html, args.reports, tmp))
+            row(backend, 'pooled', *bench_pooled(backend, html, args.reports, args.workers, tmp))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Create, list or revoke bearer tokens for the JSON API (see api.py).
+
+A new token is printed once; only its sha256 is stored, so it cannot be
+shown again. Requests authenticated with it act as the given user.
+
+Run from project root:
+    python scripts/create_api_token.py --user rig4 --name "Compression rig 4"
+    python scripts/create_api_token.py --list
+    python scripts/create_api_token.py --revoke 3
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as myapp
+import api
+import models
+import schema_upgrade
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage JSON API tokens')
+    parser.add_argument('--user', help='Username the new token acts as')
+    parser.add_argument('--name', default='api', help='What the token is for (default: api)')
+    parser.add_argument('--list', action='store_true', help='List tokens')
+    parser.add_argument('--revoke', type=int, metavar='ID', help='Revoke the token with this id')
+    args = parser.parse_args()
+
+    with myapp.app.app_context():
+        schema_upgrade.upgrade(myapp.db)  # creates the api_tokens table if it is missing
+        session = myapp.db.session
+        if args.list:
+            for t in models.ApiToken.query.order_by(models.ApiToken.id):
+                state = f'revoked {t.revoked_at:%Y-%m-%d}' if t.revoked_at else 'active'
+                used = f'{t.last_used_at:%Y-%m-%d %H:%M}' if t.last_used_at else 'never'
+                print(f'{t.id:>4}  {t.user.username:<20} {t.name:<30} {state:<18} last used {used}')
+            return 0
+        if args.revoke:
+            token = session.get(models.ApiToken, args.revoke)
+            if token is None:
+                print(f'No token {args.revoke}')
+                return 1
+            token.revoked_at = datetime.utcnow()
+            session.commit()
+            print(f'Revoked token {token.id} ({token.name})')
+            return 0
+        if not args.user:
+            parser.error('--user is required to create a token')
+        user = models.User.query.filter_by(username=args.user).first()
+        if user is None:
+            print(f'No user {args.user!r}')
+            return 1
+        token = api.create_token(session, user, args.name)
+    print(f'Token for {args.user} ({args.name}); it will not be shown again:')
+    print(token)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
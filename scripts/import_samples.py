@@ -0,0 +1,55 @@
+"""Register samples and tests in bulk from a CSV or XLSX sheet.
+
+One row per test: sample_id, sample_type, project_code, client_name,
+date_collected, test_name, raw_values, date_tested (see bulk_import.py).
+Each chunk of rows is validated, inserted and committed on its own;
+rejected rows are written to the error report. If a chunk fails, the rows
+committed before it are reported and the rest of the file is not imported.
+
+Run from project root:
+    python scripts/import_samples.py site_batch.xlsx --calculate
+    python scripts/import_samples.py cubes.csv --chunk-size 2000 --errors cubes_errors.csv
+"""
+import argparse
+import os
+import sys
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as myapp
+import bulk_import
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import samples and tests from CSV/XLSX')
+    parser.add_argument('path', help='.csv or .xlsx file')
+    parser.add_argument('--chunk-size', type=int, default=bulk_import.CHUNK_SIZE,
+                        help=f'Rows per transaction (default: {bulk_import.CHUNK_SIZE})')
+    parser.add_argument('--calculate', action='store_true', help='Calculate results while importing')
+    parser.add_argument('--errors', help='Error report path (default: <file>_errors.csv)')
+    args = parser.parse_args()
+
+    errors_path = args.errors or os.path.splitext(args.path)[0] + '_errors.csv'
+    stopped = None
+    with myapp.app.app_context(), open(args.path, 'rb') as f:
+        try:
+            summary = bulk_import.import_file(myapp.db.session, f, args.path, errors_path=errors_path,
+                                              chunk_size=args.chunk_size, calculate_results=args.calculate)
+        except bulk_import.ImportInterrupted as e:
+            summary, stopped = e.summary, e
+        myapp.log_audit('IMPORT', 'Sample', None, f'Imported {summary.samples} samples and {summary.tests} tests '
+                                                  f'from {os.path.basename(args.path)} (CLI)'
+                                                  + (f'; {stopped}' if stopped else ''))
+    print('Done: ' + ', '.join(f'{k} {v}' for k, v in summary.as_dict().items()))
+    if stopped is not None:
+        print(f'{stopped}. Rows up to {summary.committed_row} were imported; later rows were not.')
+    if summary.errors:
+        print(f'Error report: {errors_path}')
+    else:
+        os.remove(errors_path)
+    return 1 if summary.rejected or stopped else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""Run report jobs outside the web process (see report_jobs.py).
+
+Start the web app with REPORT_WORKERS=0 (otherwise every web process runs its
+own worker threads) and run one or more of these instead;
+they share the report_jobs table safely.
+
+Run from project root:
+    python scripts/lims_worker.py --threads 4
+    python scripts/lims_worker.py --once        # drain the queue and exit
+"""
+import argparse
+import os
+import sys
+import time
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as myapp
+import report_jobs
+import schema_upgrade
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LIMS background report worker')
+    parser.add_argument('--threads', type=int, default=2, help='Worker threads (default: 2)')
+    parser.add_argument('--once', action='store_true', help='Run queued jobs, then exit')
+    args = parser.parse_args()
+
+    with myapp.app.app_context():
+        schema_upgrade.upgrade(myapp.db)  # creates report_jobs if it is missing
+
+    if args.once:
+        done = report_jobs.run_pending(myapp.app, worker=report_jobs.worker_name())
+        print(f'Ran {done} jobs')
+        return
+
+    pool = report_jobs.start_workers(myapp.app, args.threads)
+    print(f'lims-worker running with {args.threads} threads; Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Rebuild the sample search index (see search.py).
+
+The index is kept up to date on every ORM flush; run this once after upgrading
+and after any bulk change made outside the ORM (raw SQL, query.delete(), ...).
+Works in committed chunks so the app stays usable while it runs.
+
+Run from project root:
+    python scripts/rebuild_search_index.py
+    python scripts/rebuild_search_index.py --chunk-size 5000
+"""
+import argparse
+import os
+import sys
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as myapp
+import schema_upgrade
+import search
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the sample search index')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Samples per transaction (default: 1000)')
+    args = parser.parse_args()
+
+    def progress(last_id, done):
+        print(f'  up to sample {last_id}: {done} samples indexed')
+
+    with myapp.app.app_context():
+        schema_upgrade.upgrade(myapp.db)  # creates the index tables if they are missing
+        backend = search.backend_for(myapp.db.session.connection())
+        done = search.rebuild(myapp.db.session, chunk_size=args.chunk_size, progress=progress)
+    print(f'Done: {done} samples indexed ({backend} backend)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Recount the dashboard totals and fix drift in stats_counters (see stats.py).
+
+Counters are updated on every ORM change; this corrects anything done outside
+the ORM. Run it from cron, or keep it running with --every.
+
+Run from project root:
+    python scripts/reconcile_stats.py
+    python scripts/reconcile_stats.py --every 600
+"""
+import argparse
+import os
+import sys
+import time
+
+# Ensure project root is importable when this script is run from the scripts/ folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as myapp
+import schema_upgrade
+import stats
+
+
+def reconcile_once():
+    with myapp.app.app_context():
+        drift = stats.reconcile(myapp.db.session)
+        myapp.db.session.commit()
+    if drift:
+        print('Corrected: ' + ', '.join(f'{name} {delta:+d}' for name, delta in sorted(drift.items())))
+    else:
+        print('Counters are accurate')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile dashboard counters')
+    parser.add_argument('--every', type=int, default=0, help='Repeat every N seconds (default: run once)')
+    args = parser.parse_args()
+
+    with myapp.app.app_context():
+        schema_upgrade.upgrade(myapp.db)  # creates stats_counters if it is missing
+    reconcile_once()
+    while args.every > 0:
+        time.sleep(args.every)
+        reconcile_once()
+
+
+if __name__ == '__main__':
+    main()
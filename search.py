@@ -0,0 +1,270 @@
+"""
+search.py - Indexed substring search over samples
+
+The samples page used to search with ILIKE '%term%', which can never use an
+index. This module keeps a search index of every sample (sample id, project
+name, client name and the names of its tests) and answers searches from it:
+
+* SQLite with FTS5: a `sample_search` FTS5 table using the trigram tokenizer,
+  ranked by bm25. It is created and dropped together with the other tables.
+* Everything else (MySQL, or SQLite builds without FTS5): the search_documents
+  and search_grams tables from models.py. Each term is split into trigrams,
+  candidate samples are found through the (gram, sample_id) primary key and
+  only those candidates are checked with LIKE.
+
+Terms shorter than three characters cannot be looked up by trigram and fall
+back to a LIKE over the index rows. matches(field='project_name') searches a
+single field; the project filter of the samples page and the exports uses it.
+
+The index follows the ORM: after every flush the samples touched by new,
+changed or deleted Samples, TestResults and Projects are re-indexed inside the
+same transaction. Bulk statements (query.delete(), raw SQL, imports that skip
+the ORM) bypass that, so rebuild() / scripts/rebuild_search_index.py
+re-creates the whole index in small committed chunks.
+"""
+import weakref
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import Float, Integer, delete, event, func, inspect, insert, select, text
+
+import models
+
+FTS_TABLE = 'sample_search'
+MIN_GRAM = 3
+
+# None picks automatically per engine; 'fts5' or 'ngram' forces a backend
+BACKEND = None
+
+_backends = weakref.WeakKeyDictionary()
+
+
+def _fts5_available(conn) -> bool:
+    try:
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE temp._fts_probe USING fts5(x, tokenize='trigram')")
+        conn.exec_driver_sql('DROP TABLE temp._fts_probe')
+        return True
+    except Exception:
+        return False
+
+
+def backend_for(conn) -> str:
+    """'fts5' on SQLite builds with the FTS5 trigram tokenizer, otherwise 'ngram'."""
+    if BACKEND:
+        return BACKEND
+    engine = conn.engine
+    if engine not in _backends:
+        fts5 = engine.dialect.name == 'sqlite' and _fts5_available(conn)
+        _backends[engine] = 'fts5' if fts5 else 'ngram'
+    return _backends[engine]
+
+
+def init_search(db) -> None:
+    """Hook the index into create_all/drop_all and into session flushes."""
+    event.listen(db.metadata, 'after_create', _create_fts_table)
+    event.listen(db.metadata, 'before_drop', _drop_fts_table)
+    event.listen(db.session, 'after_flush', _after_flush)
+
+
+def _create_fts_table(metadata, conn, **kw):
+    if backend_for(conn) == 'fts5':
+        conn.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                             f"sample_id, project_name, client_name, test_names, tokenize='trigram')")
+
+
+def _drop_fts_table(metadata, conn, **kw):
+    if conn.dialect.name == 'sqlite':
+        conn.exec_driver_sql(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+# ---------------------------------------------------------------------------
+# Keeping the index in sync
+# ---------------------------------------------------------------------------
+
+def _changed(obj, *attrs) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+def _touched_sample_ids(session) -> Set[int]:
+    Sample, TestResult, Project = models.Sample, models.TestResult, models.Project
+    ids, projects = set(), set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Sample):
+            ids.add(obj.id)
+        elif isinstance(obj, TestResult):
+            ids.add(obj.sample_id)
+    for obj in session.dirty:
+        if isinstance(obj, Sample) and _changed(obj, 'sample_id', 'project_id', 'project_name', 'client_name'):
+            ids.add(obj.id)
+        elif isinstance(obj, TestResult) and _changed(obj, 'test_name', 'sample_id'):
+            ids.add(obj.sample_id)
+            ids.update(inspect(obj).attrs.sample_id.history.deleted or ())
+        elif isinstance(obj, Project) and _changed(obj, 'project_name', 'client_name'):
+            projects.add(obj.id)
+    if projects:
+        ids.update(session.execute(select(Sample.id).where(Sample.project_id.in_(projects))).scalars())
+    ids.discard(None)
+    return ids
+
+
+def _after_flush(session, flush_context):
+    ids = _touched_sample_ids(session)
+    if ids:
+        reindex_samples(session.connection(), ids)
+
+
+def documents(conn, sample_ids: Iterable[int]) -> List[Dict]:
+    """Searchable fields of the given samples, read in two queries."""
+    Sample, Project, TestResult = models.Sample, models.Project, models.TestResult
+    ids = list(sample_ids)
+    rows = conn.execute(
+        select(Sample.id, Sample.sample_id,
+               func.coalesce(Project.project_name, Sample.project_name),
+               func.coalesce(Sample.client_name, Project.client_name))
+        .outerjoin(Project, Project.id == Sample.project_id)
+        .where(Sample.id.in_(ids))
+    ).all()
+    names: Dict[int, Set[str]] = {}
+    for sample_id, test_name in conn.execute(
+            select(TestResult.sample_id, TestResult.test_name).where(TestResult.sample_id.in_(ids)).distinct()):
+        names.setdefault(sample_id, set()).add(test_name)
+    return [{'id': id_, 'sample_id': code or '', 'project_name': project or '', 'client_name': client or '',
+             'test_names': ' '.join(sorted(names.get(id_, ())))}
+            for id_, code, project, client in rows]
+
+
+def _body(doc: Dict) -> str:
+    return '\n'.join((doc['sample_id'], doc['project_name'], doc['client_name'], doc['test_names'])).lower()
+
+
+def trigrams(value: str) -> Set[str]:
+    """Lower-cased three-character substrings of `value` that contain no whitespace."""
+    value = value.lower()
+    return {g for g in (value[i:i + MIN_GRAM] for i in range(len(value) - MIN_GRAM + 1))
+            if not any(c.isspace() for c in g)}
+
+
+def reindex_samples(conn, sample_ids: Iterable[int]) -> None:
+    """Replace the index rows of `sample_ids`; ids of deleted samples are just removed."""
+    ids = list(sample_ids)
+    if not ids:
+        return
+    docs = documents(conn, ids)
+    if backend_for(conn) == 'fts5':
+        conn.execute(text(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({", ".join(str(int(i)) for i in ids)})'))
+        if docs:
+            conn.execute(text(f'INSERT INTO {FTS_TABLE} (rowid, sample_id, project_name, client_name, test_names) '
+                              f'VALUES (:id, :sample_id, :project_name, :client_name, :test_names)'), docs)
+        return
+    SearchDocument, SearchGram = models.SearchDocument, models.SearchGram
+    conn.execute(delete(SearchGram).where(SearchGram.sample_id.in_(ids)))
+    conn.execute(delete(SearchDocument).where(SearchDocument.sample_id.in_(ids)))
+    if docs:
+        conn.execute(insert(SearchDocument), [{'sample_id': d['id'], 'body': _body(d)} for d in docs])
+        grams = [{'gram': g, 'sample_id': d['id']} for d in docs for g in trigrams(_body(d))]
+        if grams:
+            conn.execute(insert(SearchGram), grams)
+
+
+def rebuild(session, chunk_size: int = 1000, progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """Re-create the whole index, committing every `chunk_size` samples. Returns samples indexed."""
+    Sample = models.Sample
+    conn = session.connection()
+    if backend_for(conn) == 'fts5':
+        _create_fts_table(None, conn)
+        conn.exec_driver_sql(f'DELETE FROM {FTS_TABLE}')
+    else:
+        conn.execute(delete(models.SearchGram))
+        conn.execute(delete(models.SearchDocument))
+    session.commit()
+    last_id, done = 0, 0
+    while True:
+        ids = session.execute(select(Sample.id).where(Sample.id > last_id)
+                              .order_by(Sample.id).limit(chunk_size)).scalars().all()
+        if not ids:
+            return done
+        reindex_samples(session.connection(), ids)
+        session.commit()
+        last_id, done = ids[-1], done + len(ids)
+        if progress:
+            progress(last_id, done)
+
+
+# ---------------------------------------------------------------------------
+# Querying
+# ---------------------------------------------------------------------------
+
+def _like(term: str) -> str:
+    escaped = term.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+FIELDS = ('sample_id', 'project_name', 'client_name', 'test_names')
+SAMPLE_FIELDS = FIELDS[:3]  # the fields matches(field=...) accepts
+
+
+def _field_column(field: str):
+    """The expression an index field is built from (see documents())."""
+    Sample, Project = models.Sample, models.Project
+    columns = {
+        'sample_id': Sample.sample_id,
+        'project_name': func.coalesce(Project.project_name, Sample.project_name),
+        'client_name': func.coalesce(Sample.client_name, Project.client_name),
+    }
+    return func.lower(columns[field])
+
+
+def _fts_matches(terms: List[str], field: Optional[str], name: str):
+    long_terms = [t for t in terms if len(t) >= MIN_GRAM]
+    short_terms = [t for t in terms if len(t) < MIN_GRAM]
+    columns = (field,) if field else FIELDS
+    where, params = [], {}
+    if long_terms:
+        where.append(f'{FTS_TABLE} MATCH :match')
+        prefix = f'{field} : ' if field else ''
+        params['match'] = ' AND '.join(prefix + '"' + t.replace('"', '""') + '"' for t in long_terms)
+    for n, term in enumerate(short_terms):
+        where.append('(' + ' OR '.join(f"{col} LIKE :s{n} ESCAPE '\\'" for col in columns) + ')')
+        params[f's{n}'] = _like(term)
+    rank = 'rank' if long_terms else '0.0'
+    sql = text(f'SELECT rowid AS sample_id, {rank} AS rank FROM {FTS_TABLE} WHERE ' + ' AND '.join(where))
+    return sql.bindparams(**params).columns(sample_id=Integer, rank=Float).subquery(name)
+
+
+def _ngram_matches(terms: List[str], field: Optional[str], name: str):
+    SearchDocument, SearchGram = models.SearchDocument, models.SearchGram
+    query = select(SearchDocument.sample_id, func.length(SearchDocument.body).label('rank'))
+    checked = SearchDocument.body
+    if field:
+        # The trigrams narrow the candidates; the field itself is checked on the sample
+        Sample, Project = models.Sample, models.Project
+        query = (query.join(Sample, Sample.id == SearchDocument.sample_id)
+                 .outerjoin(Project, Project.id == Sample.project_id))
+        checked = _field_column(field)
+    for term in terms:
+        grams = trigrams(term)
+        if grams:
+            candidates = (select(SearchGram.sample_id).where(SearchGram.gram.in_(grams))
+                          .group_by(SearchGram.sample_id).having(func.count() == len(grams)))
+            query = query.where(SearchDocument.sample_id.in_(candidates))
+        query = query.where(checked.like(_like(term), escape='\\'))
+    return query.subquery(name)
+
+
+def matches(session, term: str, field: Optional[str] = None):
+    """Subquery of (sample_id, rank) for samples matching every word of `term`.
+
+    `field` limits the match to one indexed field ('sample_id', 'project_name'
+    or 'client_name'); the subquery is then named '<field>_hits' so it can be
+    joined next to a full search. Lower rank is better. Returns None for an
+    empty search.
+    """
+    if field is not None and field not in SAMPLE_FIELDS:
+        raise ValueError(f'cannot search by {field!r}')
+    terms = term.split()
+    if not terms:
+        return None
+    name = f'{field}_hits' if field else 'search_hits'
+    if backend_for(session.connection()) == 'fts5':
+        return _fts_matches(terms, field, name)
+    return _ngram_matches(terms, field, name)
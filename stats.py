@@ -0,0 +1,147 @@
+"""
+stats.py - Materialized dashboard counters
+
+The dashboard used to run five COUNT(*) queries on every visit. The totals now
+live in the stats_counters table and are maintained incrementally: after each
+ORM flush the inserted and deleted Projects, Samples and TestResults and any
+TestResult status changes are turned into `value = value + delta` updates
+that run in the same transaction as the change itself.
+
+Changes that bypass the ORM (query.update(), query.delete(), raw SQL) are not
+seen; bulk writers report their own deltas with add(). reconcile() recounts
+everything and corrects any drift. It runs when the stats_counters table is
+created, whenever a counter row is missing, and periodically via
+scripts/reconcile_stats.py.
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy import event, func, inspect, select, update
+
+import db_routing
+import models
+
+COUNTERS = ('projects', 'samples', 'tests', 'tests_pending', 'tests_approved')
+
+# TestResult.status -> counter; other statuses (Rejected, ...) are not shown
+_STATUS_COUNTERS = {'Pending': 'tests_pending', 'Approved': 'tests_approved'}
+
+
+def init_stats(db) -> None:
+    """Seed the counters with the tables and keep them in step with session flushes."""
+    event.listen(db.metadata, 'after_create', _seed_counters)
+    event.listen(db.session, 'after_flush', _after_flush)
+
+
+def _seed_counters(metadata, conn, tables=(), **kw):
+    if models.StatCounter.__table__ not in tables:
+        return
+    # Older databases may still miss columns that schema_upgrade adds later;
+    # then the rows stay missing and counters() reconciles on first use.
+    try:
+        with conn.begin_nested():
+            _reconcile(conn)
+    except Exception:
+        pass
+
+
+def true_counts(conn) -> Dict[str, int]:
+    """Count every tracked total with one SELECT of scalar subqueries."""
+    Project, Sample, TestResult = models.Project, models.Sample, models.TestResult
+
+    def count(model, *where):
+        return select(func.count()).select_from(model).where(*where).scalar_subquery()
+
+    row = conn.execute(select(
+        count(Project), count(Sample), count(TestResult),
+        count(TestResult, TestResult.status == 'Pending'),
+        count(TestResult, TestResult.status == 'Approved'),
+    )).one()
+    return dict(zip(COUNTERS, row))
+
+
+def _reconcile(conn) -> Dict[str, int]:
+    StatCounter = models.StatCounter
+    # Lock the counter rows before counting: a concurrent flush's delta then
+    # either committed before the count (and is in it) or waits for this
+    # transaction and is applied on top of the corrected value.
+    stored = dict(conn.execute(select(StatCounter.name, StatCounter.value)
+                               .order_by(StatCounter.name).with_for_update()).all())
+    actual = true_counts(conn)
+    now = datetime.utcnow()
+    drift = {}
+    for name, value in actual.items():
+        if name not in stored:
+            conn.execute(StatCounter.__table__.insert().values(name=name, value=value, reconciled_at=now))
+        else:
+            conn.execute(update(StatCounter).where(StatCounter.name == name)
+                         .values(value=value, reconciled_at=now))
+        if stored.get(name) != value:
+            drift[name] = value - (stored.get(name) or 0)
+    return drift
+
+
+def reconcile(session) -> Dict[str, int]:
+    """Recount all totals and fix the stored counters, holding their row locks (does not commit).
+
+    Returns {counter: correction} for every counter that had drifted.
+    """
+    return _reconcile(session.connection())
+
+
+def _status_delta(deltas: Counter, status, sign: int) -> None:
+    name = _STATUS_COUNTERS.get(status)
+    if name:
+        deltas[name] += sign
+
+
+def _deltas(session) -> Counter:
+    Project, Sample, TestResult = models.Project, models.Sample, models.TestResult
+    deltas = Counter()
+    for objects, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objects:
+            if isinstance(obj, Project):
+                deltas['projects'] += sign
+            elif isinstance(obj, Sample):
+                deltas['samples'] += sign
+            elif isinstance(obj, TestResult):
+                deltas['tests'] += sign
+                _status_delta(deltas, obj.status, sign)
+    for obj in session.dirty:
+        if isinstance(obj, TestResult) and obj not in session.deleted:
+            history = inspect(obj).attrs.status.history
+            if history.has_changes():
+                for old in history.deleted:
+                    _status_delta(deltas, old, -1)
+                _status_delta(deltas, obj.status, 1)
+    return deltas
+
+
+def add(session, deltas: Dict[str, int]) -> None:
+    """Apply counter deltas in the session's transaction (for bulk writes that skip the flush)."""
+    StatCounter = models.StatCounter
+    conn = None
+    # In name order, like _reconcile(), so concurrent writers lock the rows in one order and cannot deadlock
+    for name, delta in sorted(deltas.items()):
+        if delta:
+            conn = conn or session.connection()
+            conn.execute(update(StatCounter).where(StatCounter.name == name)
+                         .values(value=StatCounter.value + delta))
+
+
+def _after_flush(session, flush_context):
+    add(session, _deltas(session))
+
+
+def counters(session) -> Dict[str, int]:
+    """All dashboard totals in one primary-key read, reconciling first if any row is missing."""
+    StatCounter = models.StatCounter
+    query = select(StatCounter.name, StatCounter.value).where(StatCounter.name.in_(COUNTERS))
+    values = dict(session.execute(query).all())
+    if len(values) < len(COUNTERS):
+        with db_routing.primary():  # recount from the primary, not a lagging replica
+            reconcile(session)
+        session.commit()
+        values = dict(session.execute(query).all())
+    return values
@@ -0,0 +1,154 @@
+"""
+Tests for the batch test-result ingestion API
+"""
+import os
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import api
+import search
+import stats
+from models import User, Sample, TestResult, Measurement, IdempotencyKey, ApiToken
+
+URL = '/api/v1/test-results:batch'
+
+
+@pytest.fixture
+def client():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        tech = User(username='rig', role='Lab Technician')
+        viewer = User(username='viewer', role='Viewer')
+        for u in (tech, viewer):
+            u.set_password('pw')
+        myapp.db.session.add_all([tech, viewer, Sample(sample_id='API-1', sample_type='Concrete'),
+                                  Sample(sample_id='API-2', sample_type='Soil')])
+        myapp.db.session.commit()
+        client = myapp.app.test_client()
+        client.token = api.create_token(myapp.db.session, tech, 'rig 4')
+        client.viewer_token = api.create_token(myapp.db.session, viewer, 'read only')
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+@pytest.fixture(params=[True, False], ids=['returning', 'no-returning'])
+def returning(request, monkeypatch):
+    """Run with and without INSERT .. RETURNING for executemany (MySQL has none)."""
+    with myapp.app.app_context():
+        dialect = myapp.db.engine.dialect
+    monkeypatch.setattr(dialect, 'insert_executemany_returning', request.param)
+    return request.param
+
+
+def _post(client, items, token=None):
+    return client.post(URL, json={'items': items}, headers={'Authorization': f'Bearer {token or client.token}'})
+
+
+def _cube(key, load=450, sample='API-1'):
+    return {'key': key, 'sample_id': sample, 'test_name': 'Compressive Strength', 'raw_values': f'{load},22500',
+            'date_tested': '2024-05-01T10:30:00'}
+
+
+def test_batch_is_calculated_inserted_and_reported_per_item(client, returning):
+    items = [_cube('k1'), dict(_cube('k2'), raw_values=[500, 22500]),
+             {'key': 'k3', 'sample_id': 'API-2', 'test_name': 'CBR Test', 'raw_values': '10.5,13.24'},
+             {'key': 'k4', 'sample_id': 'NOPE', 'test_name': 'CBR Test', 'raw_values': '1,2'},
+             {'key': 'k5', 'sample_id': 'API-1', 'test_name': 'Compressive Strength', 'raw_values': 'x'},
+             {'sample_id': 'API-1', 'test_name': 'Slump', 'raw_values': '80'},
+             _cube('k1', load=460)]
+    response = _post(client, items)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['counts'] == {'created': 3, 'duplicate': 0, 'conflict': 0, 'error': 4}
+    statuses = [(o['index'], o['status']) for o in body['items']]
+    assert statuses == [(0, 'created'), (1, 'created'), (2, 'created'), (3, 'error'), (4, 'error'), (5, 'error'),
+                        (6, 'error')]
+    first = body['items'][0]
+    assert first['result'] == f'{450000 / 22500:.3f} MPa' and first['result_unit'] == 'MPa'
+    assert body['items'][3]['errors'] == [{'field': 'sample_id', 'message': 'Unknown sample ID'}]
+    assert body['items'][6]['errors'][0]['message'] == 'Key repeated in this batch'
+    with myapp.app.app_context():
+        test = myapp.db.session.get(TestResult, first['id'])
+        assert test.result_value == pytest.approx(20.0) and test.status == 'Pending'
+        assert test.date_tested.hour == 10
+        assert Measurement.query.filter_by(test_result_id=test.id, field='load_kN').one().value == 450
+        assert myapp.db.session.get(TestResult, body['items'][1]['id']).raw_values == '500,22500'
+        assert IdempotencyKey.query.count() == 3
+        assert stats.reconcile(myapp.db.session) == {}
+        hits = search.matches(myapp.db.session, 'CBR')
+        assert [s for (s,) in myapp.db.session.query(Sample.sample_id).join(hits, hits.c.sample_id == Sample.id)] \
+            == ['API-2']
+        assert ApiToken.query.filter_by(name='rig 4').one().last_used_at is not None
+
+
+def test_retried_batch_returns_duplicates_and_flags_reused_keys(client, returning):
+    first = _post(client, [_cube('a'), _cube('b')]).get_json()
+    again = _post(client, [_cube('a'), _cube('b', load=999), _cube('c')]).get_json()
+    assert again['counts'] == {'created': 1, 'duplicate': 1, 'conflict': 1, 'error': 0}
+    assert again['items'][0]['id'] == first['items'][0]['id']
+    assert again['items'][0]['result'] == first['items'][0]['result']
+    assert again['items'][1]['status'] == 'conflict'
+    with myapp.app.app_context():
+        assert TestResult.query.count() == 3
+
+
+def test_authentication_and_limits(client):
+    assert client.post(URL, json={'items': [_cube('x')]}).status_code == 401
+    assert _post(client, [_cube('x')], token='not-a-token').status_code == 401
+    assert _post(client, [_cube('x')], token=client.viewer_token).status_code == 403
+    assert _post(client, []).status_code == 400
+    myapp.app.config['API_MAX_BATCH'] = 2
+    try:
+        assert _post(client, [_cube(str(i)) for i in range(3)]).status_code == 413
+    finally:
+        myapp.app.config['API_MAX_BATCH'] = api.MAX_BATCH
+    with myapp.app.app_context():
+        token = ApiToken.query.filter_by(name='rig 4').one()
+        token.revoked_at = token.created_at
+        myapp.db.session.commit()
+    assert _post(client, [_cube('x')]).status_code == 401
+
+
+def test_endpoint_needs_no_csrf_token(client):
+    myapp.app.config['WTF_CSRF_ENABLED'] = True
+    try:
+        assert _post(client, [_cube('csrf')]).status_code == 200
+    finally:
+        myapp.app.config['WTF_CSRF_ENABLED'] = False
+
+
+def test_offset_and_utc_times_are_stored_as_naive_utc(client):
+    items = [dict(_cube('z1'), date_tested='2024-05-01T10:30:00Z'),
+             dict(_cube('z2'), date_tested='2024-05-01T12:30:00+02:00'),
+             dict(_cube('z3'), date_tested='2024-05-01T10:30:00+0x')]
+    body = _post(client, items).get_json()
+    assert [o['status'] for o in body['items']] == ['created', 'created', 'error']
+    with myapp.app.app_context():
+        for outcome in body['items'][:2]:
+            tested = myapp.db.session.get(TestResult, outcome['id']).date_tested
+            assert (tested.hour, tested.minute, tested.tzinfo) == (10, 30, None)
+
+
+def test_retry_after_a_key_race_keeps_the_token_use(client, monkeypatch):
+    from sqlalchemy.exc import IntegrityError
+    ingest, calls = api._ingest, []
+
+    def racing(session, user_id, items, now):
+        calls.append(user_id)
+        if len(calls) == 1:
+            session.flush()  # authenticate()'s last_used_at is written, then rolled back
+            raise IntegrityError('INSERT INTO idempotency_keys', {}, Exception('UNIQUE constraint failed'))
+        return ingest(session, user_id, items, now)
+    monkeypatch.setattr(api, '_ingest', racing)
+    assert _post(client, [_cube('r1')]).get_json()['counts']['created'] == 1
+    with myapp.app.app_context():
+        assert len(calls) == 2
+        assert ApiToken.query.filter_by(name='rig 4').one().last_used_at is not None
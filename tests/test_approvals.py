@@ -0,0 +1,105 @@
+"""
+Tests for bulk approve / reject
+"""
+import os
+from datetime import datetime
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import approvals
+import stats
+from models import User, Sample, TestResult, AuditLog
+
+
+@pytest.fixture
+def client():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        engineer = User(username='rev-eng', role='Engineer')
+        tech = User(username='rev-tech', role='Lab Technician')
+        for u in (engineer, tech):
+            u.set_password('pw')
+        sample = Sample(sample_id='REV-1', sample_type='Concrete')
+        myapp.db.session.add_all([engineer, tech, sample])
+        myapp.db.session.flush()
+        myapp.db.session.add_all([TestResult(sample_id=sample.id, test_name='Compressive Strength',
+                                             raw_values='450,22500', status='Pending') for _ in range(6)])
+        myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'rev-eng', 'password': 'pw'})
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _statuses():
+    with myapp.app.app_context():
+        return [s for (s,) in myapp.db.session.query(TestResult.status).order_by(TestResult.id)]
+
+
+def test_review_updates_pending_tests_in_chunks_and_skips_the_rest(client):
+    with myapp.app.app_context():
+        engineer = User.query.filter_by(username='rev-eng').one()
+        myapp.db.session.get(TestResult, 2).status = 'Rejected'  # changed by someone else meanwhile
+        myapp.db.session.commit()
+        outcome = approvals.review(myapp.db.session, [1, 2, 3, 4, 99], 'approve', engineer.id,
+                                   remarks='ok', chunk_size=2)
+        assert outcome == approvals.ReviewResult('Approved', [1, 3, 4], [2, 99])
+        test = myapp.db.session.get(TestResult, 3)
+        assert (test.approved_by, test.remarks) == (engineer.id, 'ok') and test.approved_at is not None
+        audits = AuditLog.query.filter_by(action='APPROVE').order_by(AuditLog.entity_id).all()
+        assert [a.entity_id for a in audits] == [1, 3, 4] and audits[0].user_id == engineer.id
+        assert stats.reconcile(myapp.db.session) == {}
+    assert _statuses() == ['Approved', 'Rejected', 'Approved', 'Approved', 'Pending', 'Pending']
+
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_double_submit_updates_each_test_once(client, monkeypatch, returning):
+    now = datetime(2024, 5, 1, 12, 0, 0)
+    with myapp.app.app_context():
+        engineer = User.query.filter_by(username='rev-eng').one()
+        # False takes the SELECT ... FOR UPDATE path that MySQL uses
+        monkeypatch.setattr(myapp.db.engine.dialect, 'update_returning', returning)
+        first = approvals.review(myapp.db.session, [1, 2, 3], 'approve', engineer.id, now=now)
+        second = approvals.review(myapp.db.session, [1, 2, 3], 'approve', engineer.id, now=now)
+        assert (first.updated, second.updated, second.skipped) == ([1, 2, 3], [], [1, 2, 3])
+        assert AuditLog.query.filter_by(action='APPROVE').count() == 3
+        counters = stats.counters(myapp.db.session)
+        assert (counters['tests_approved'], counters['tests_pending']) == (3, 3)
+        assert stats.reconcile(myapp.db.session) == {}
+
+
+def test_reject_requires_remarks(client):
+    with myapp.app.app_context():
+        with pytest.raises(approvals.ReviewError):
+            approvals.review(myapp.db.session, [1], 'reject', 1)
+        with pytest.raises(approvals.ReviewError):
+            approvals.parse_ids(['1', 'x'])
+    assert approvals.parse_ids(['3', '1', '3']) == [3, 1]
+
+
+def test_bulk_review_endpoint(client):
+    response = client.post('/tests/review', data={'test_ids': ['5', '6'], 'decision': 'reject',
+                                                  'remarks': 'cracked', 'next': '/samples/1'})
+    assert response.status_code == 302 and response.headers['Location'].endswith('/samples/1')
+    assert _statuses()[4:] == ['Rejected', 'Rejected']
+    response = client.post('/tests/review', data={'test_ids': ['5', '1'], 'decision': 'approve',
+                                                  'next': '//evil.example'}, follow_redirects=True)
+    page = response.get_data(as_text=True)
+    assert 'Approved 1 test(s); skipped 1 no longer pending: #5' in page
+    assert _statuses()[0] == 'Approved'
+    assert 'Approve Selected' in client.get('/samples/1').get_data(as_text=True)
+
+
+def test_bulk_review_needs_engineer_role(client):
+    client.get('/logout')
+    client.post('/login', data={'username': 'rev-tech', 'password': 'pw'})
+    client.post('/tests/review', data={'test_ids': ['1'], 'decision': 'approve'})
+    assert _statuses()[0] == 'Pending'
@@ -0,0 +1,127 @@
+"""
+Tests for the buffered audit log writer
+"""
+import os
+import time
+
+import pytest
+from sqlalchemy import create_engine, func, select
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import audit
+from models import User, Sample, TestResult, AuditLog
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'audit.db'}")
+    AuditLog.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+
+def _count(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(AuditLog.__table__)).scalar()
+
+
+def _entries(n, action='VIEW'):
+    return [audit.entry(action, 'Sample', i, f'entry {i}', user_id=1) for i in range(n)]
+
+
+def test_entries_are_batched_by_rows_and_time(engine, tmp_path):
+    writer = audit.AuditWriter(engine, batch_rows=50, flush_ms=50, spill_dir=str(tmp_path / 'spill'))
+    for row in _entries(120):
+        writer.record(row)
+    deadline = time.monotonic() + 5
+    while _count(engine) < 120 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    writer.stop()
+    assert _count(engine) == 120
+    metrics = writer.metrics()
+    assert metrics['mode'] == 'buffered' and metrics['queue_depth'] == 0
+    assert (metrics['recorded'], metrics['written'], metrics['dropped']) == (120, 120, 0)
+    assert 3 <= metrics['flushes'] < 120  # batches, not one insert per entry
+    assert metrics['flush_latency_ms']['max'] > 0
+
+
+def test_failed_inserts_spill_to_disk_and_are_replayed(engine, tmp_path):
+    spill = tmp_path / 'spill'
+    writer = audit.AuditWriter(engine, queue_size=5, spill_dir=str(spill))
+    real_insert = writer._insert
+
+    def down(rows):
+        raise RuntimeError('database is down')
+
+    writer._insert = down
+    writer.start = lambda: writer  # keep everything in this thread
+    for row in _entries(8):
+        writer.record(row)  # 5 fill the queue, 3 spill
+    assert writer.metrics()['spilled'] == 3
+    writer.flush()  # the insert fails: the queue is spilled as well
+    assert writer.metrics()['spilled'] == 8 and writer.metrics()['queue_depth'] == 0
+    assert _count(engine) == 0 and writer.metrics()['spill_bytes'] > 0
+
+    writer._insert = real_insert
+    writer.flush()
+    assert _count(engine) == 8
+    assert writer.metrics()['replayed'] == 8 and os.listdir(spill) == []
+    with engine.connect() as conn:
+        stamps = conn.execute(select(AuditLog.__table__.c.timestamp)).scalars().all()
+    assert all(stamp is not None for stamp in stamps)
+
+
+def test_entries_are_dropped_only_when_the_spill_is_full(engine, tmp_path):
+    writer = audit.AuditWriter(engine, queue_size=1, spill_dir=str(tmp_path / 'spill'), spill_max_bytes=10)
+    writer.start = lambda: writer
+    for row in _entries(3):
+        writer.record(row)
+    assert (writer.metrics()['spilled'], writer.metrics()['dropped']) == (0, 2)
+
+
+@pytest.fixture
+def client():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='audit-admin', role='Admin')
+        admin.set_password('pw')
+        sample = Sample(sample_id='AUD-1', sample_type='Concrete')
+        myapp.db.session.add_all([admin, sample])
+        myapp.db.session.flush()
+        myapp.db.session.add(TestResult(sample_id=sample.id, test_name='Compressive Strength',
+                                        raw_values='450,22500', status='Pending'))
+        myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'audit-admin', 'password': 'pw'})
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def test_log_audit_does_not_commit_the_session(client):
+    with myapp.app.test_request_context():
+        sample = Sample(sample_id='AUD-2', sample_type='Soil')
+        myapp.db.session.add(sample)
+        myapp.log_audit('CREATE', 'Sample', None, 'queued entry')
+        myapp.db.session.rollback()
+        assert Sample.query.filter_by(sample_id='AUD-2').count() == 0
+        assert AuditLog.query.filter_by(details='queued entry').count() == 1
+
+
+def test_sync_entries_commit_with_the_change(client):
+    assert client.post('/test/1/approve', data={'remarks': 'fine'}).status_code == 302
+    with myapp.app.app_context():
+        log = AuditLog.query.filter_by(action='APPROVE').one()
+        assert (log.entity_id, log.details) == (1, 'Approved: fine')
+        with myapp.app.test_request_context():
+            myapp.log_audit('REJECT', 'TestResult', 1, 'not kept', sync=True)
+            myapp.db.session.rollback()
+        assert AuditLog.query.filter_by(details='not kept').count() == 0
+    metrics = client.get('/admin/audit/metrics').get_json()
+    assert metrics['mode'] == 'direct' and 'queue_depth' in metrics
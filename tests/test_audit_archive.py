@@ -0,0 +1,99 @@
+"""
+Tests for audit log rollover tables, filtered browsing and archival
+"""
+import json
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import inspect
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import audit_archive
+from models import User, AuditLog
+
+NOW = datetime(2024, 3, 15)
+
+
+@pytest.fixture
+def client():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='arc-admin', role='Admin')
+        admin.set_password('pw')
+        myapp.db.session.add(admin)
+        myapp.db.session.flush()
+        for month, count in ((1, 3), (2, 2), (3, 2)):
+            for day in range(1, count + 1):
+                myapp.db.session.add(AuditLog(user_id=admin.id, action='APPROVE' if day == 1 else 'CREATE',
+                                              entity_type='TestResult', entity_id=month * 10 + day,
+                                              details=f'entry {month}/{day}', timestamp=datetime(2024, month, day)))
+        myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'arc-admin', 'password': 'pw'})
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        with myapp.db.engine.begin() as conn:
+            for month in audit_archive.rollover_months(conn):
+                audit_archive.rollover_table(month).drop(conn)
+        myapp.db.drop_all()
+
+
+def _rollover():
+    with myapp.app.app_context(), myapp.db.engine.begin() as conn:
+        return audit_archive.rollover(conn, NOW)
+
+
+def _details(response):
+    page = response.get_data(as_text=True)
+    return sorted(d for d in (f'entry {m}/{n}' for m in (1, 2, 3) for n in (1, 2, 3)) if f'<td>{d}</td>' in page)
+
+
+def test_rollover_moves_finished_months(client):
+    assert _rollover() == {'audit_logs_202401': 3, 'audit_logs_202402': 2}
+    with myapp.app.app_context():
+        assert {e.details for e in AuditLog.query} == {'entry 3/1', 'entry 3/2'}
+        assert 'audit_logs_202401' in inspect(myapp.db.engine).get_table_names()
+    assert _rollover() == {}
+
+
+def test_browsing_spans_rollover_tables_with_filters(client):
+    _rollover()
+    assert len(_details(client.get('/audit/logs'))) == 7
+    assert _details(client.get('/audit/logs?action=approve')) == ['entry 1/1', 'entry 2/1', 'entry 3/1']
+    assert _details(client.get('/audit/logs?entity_type=TestResult&entity_id=12')) == ['entry 1/2']
+    assert _details(client.get('/audit/logs?from=2024-02-01&to=2024-02-29')) == ['entry 2/1', 'entry 2/2']
+    assert _details(client.get('/audit/logs?user=nobody')) == []
+    # Keyset pages walk from the live table into the rollover tables
+    first = client.get('/audit/logs?per_page=4').get_data(as_text=True)
+    older = first.split('after=', 1)[1].split('"', 1)[0].split("'", 1)[0]
+    assert len(_details(client.get(f'/audit/logs?per_page=4&after={older}'))) == 3
+    assert client.get('/audit/logs?from=yesterday').status_code == 302
+
+
+def test_archive_writes_compressed_months_and_stays_searchable(client, tmp_path):
+    with myapp.app.app_context(), myapp.db.engine.begin() as conn:
+        written = audit_archive.archive(conn, str(tmp_path), keep_months=1, now=NOW)
+        assert written == {audit_archive.archive_path(str(tmp_path), datetime(2024, 1, 1)): 3}
+        assert audit_archive.rollover_months(conn) == [datetime(2024, 2, 1)]
+    rows = list(audit_archive.read_archive(str(tmp_path), action='APPROVE'))
+    assert [r['details'] for r in rows] == ['entry 1/1']
+    assert list(audit_archive.read_archive(str(tmp_path), start=datetime(2024, 2, 1))) == []
+    assert [r['entity_id'] for r in audit_archive.read_archive(str(tmp_path), text_filter='1/3')] == [13]
+
+    myapp.app.config['AUDIT_ARCHIVE_DIR'] = str(tmp_path)
+    try:
+        page = client.get('/audit/logs').get_data(as_text=True)
+        assert 'January 2024 are archived' in page and len(_details(client.get('/audit/logs'))) == 4
+        response = client.get('/audit/archive.jsonl?entity_id=12')
+        assert response.mimetype == 'application/x-ndjson'
+        assert [json.loads(line)['details'] for line in response.get_data(as_text=True).splitlines()] \
+            == ['entry 1/2']
+    finally:
+        myapp.app.config['AUDIT_ARCHIVE_DIR'] = os.path.join('reports', 'audit_archive')
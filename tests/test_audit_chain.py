@@ -0,0 +1,131 @@
+"""
+Tests for the hash-chained, Merkle-sealed audit log
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, update
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import audit
+import audit_archive
+import audit_chain
+from models import User, AuditLog
+
+NOW = datetime(2024, 3, 15)
+
+
+@pytest.fixture
+def conn():
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='chain-admin', role='Admin')
+        admin.set_password('pw')
+        myapp.db.session.add(admin)
+        myapp.db.session.flush()
+        for i in range(10):
+            stamp = datetime(2024, 1 + i // 5, 1 + i)
+            myapp.db.session.add(AuditLog(user_id=admin.id, action='CREATE', entity_type='Sample', entity_id=i,
+                                          details=f'entry {i}', timestamp=stamp, inserted_at=stamp))
+        myapp.db.session.commit()
+        with myapp.db.engine.begin() as connection:
+            yield connection
+        myapp.db.session.remove()
+        with myapp.db.engine.begin() as connection:
+            for month in audit_archive.rollover_months(connection):
+                audit_archive.rollover_table(month).drop(connection)
+        myapp.db.drop_all()
+
+
+def _tamper(conn, entry_id, **values):
+    log = AuditLog.__table__
+    conn.execute(update(log).where(log.c.id == entry_id).values(**values))
+
+
+def test_seal_chains_entries_into_blocks(conn):
+    assert audit_chain.seal(conn, block_size=4, now=NOW) == {'chained': 10, 'blocks': 2}
+    assert audit_chain.seal(conn, block_size=4, now=NOW) == {'chained': 0, 'blocks': 0}
+    assert audit_chain.unsealed(conn) == 2
+    # Entries inside the grace period wait for the next seal
+    conn.execute(AuditLog.__table__.insert(), {'action': 'VIEW', 'entity_type': 'Sample', 'timestamp': NOW,
+                                               'inserted_at': NOW})
+    assert audit_chain.seal(conn, block_size=4, now=NOW) == {'chained': 0, 'blocks': 0}
+    report = audit_chain.verify(conn)
+    assert (report['ok'], report['blocks'], report['entries']) == (True, 2, 10)
+    assert [b['id'] for b in conn.execute(AuditLog.__table__.select()).mappings() if b['chain_hash']] \
+        == list(range(1, 11))
+
+
+def test_late_commit_of_a_lower_id_is_not_skipped(conn):
+    audit_chain.seal(conn, block_size=4, now=NOW)
+    log = AuditLog.__table__
+    # Id 11 belongs to a transaction that has not committed yet; spilled entries
+    # replayed meanwhile get ids 12 and 13 but keep their old timestamps
+    old = datetime(2024, 3, 1)
+    conn.execute(log.insert(), [dict(audit.entry('VIEW', 'Sample', i, 'replayed', timestamp=old), id=i)
+                                for i in (12, 13)])
+    now = datetime.utcnow()
+    assert audit_chain.seal(conn, block_size=4, now=now) == {'chained': 0, 'blocks': 0}
+    conn.execute(log.insert(), dict(audit.entry('UPDATE', 'Sample', 11, 'late commit', timestamp=old), id=11))
+    later = now + timedelta(seconds=audit_chain.SEAL_GRACE_SECONDS + 1)
+    assert audit_chain.seal(conn, block_size=4, now=later) == {'chained': 3, 'blocks': 1}
+    report = audit_chain.verify(conn)
+    assert (report['ok'], report['entries']) == (True, 13)
+
+
+def test_single_entry_proof(conn):
+    audit_chain.seal(conn, block_size=4, now=NOW)
+    root = audit_chain.head(conn)['root']
+    entry = conn.execute(AuditLog.__table__.select().where(AuditLog.__table__.c.id == 6)).first()
+    proof = audit_chain.prove(conn, 6)
+    assert (proof['block'], proof['index'], len(proof['path'])) == (2, 1, 2)
+    assert audit_chain.verify_proof(entry, proof, root)
+    assert not audit_chain.verify_proof(dict(entry._mapping, details='edited'), proof, root)
+    assert not audit_chain.verify_proof(entry, proof, '0' * 64)
+    with pytest.raises(audit_chain.ChainError):
+        audit_chain.prove(conn, 10)  # after the last block
+
+
+def test_merkle_paths_match_the_root_for_every_size():
+    for size in range(1, 20):
+        leaves = [bytes([i]) * 32 for i in range(size)]
+        root = audit_chain.merkle_root(leaves)
+        for index in range(size):
+            path = audit_chain.inclusion_path(leaves, index)
+            assert audit_chain.root_from_path(leaves[index], index, size, path) == root
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_verify_reports_the_first_divergent_block(conn, workers):
+    audit_chain.seal(conn, block_size=4, now=NOW)
+    _tamper(conn, 6, details='edited')
+    report = audit_chain.verify(conn, workers=workers)
+    assert not report['ok'] and report['blocks'] == 1
+    assert {k: report['divergent'][k] for k in ('block', 'first_id', 'last_id', 'entry_id')} \
+        == {'block': 2, 'first_id': 5, 'last_id': 8, 'entry_id': 6}
+    # A date range before the edit still verifies
+    assert audit_chain.verify(conn, end=datetime(2024, 1, 4), workers=workers)['ok']
+
+
+def test_deleted_entries_and_tail_edits_are_detected(conn):
+    audit_chain.seal(conn, block_size=4, now=NOW)
+    _tamper(conn, 9, action='DELETE')
+    assert audit_chain.verify(conn)['divergent']['entry_id'] == 9
+    conn.execute(delete(AuditLog.__table__).where(AuditLog.__table__.c.id == 3))
+    divergent = audit_chain.verify(conn)['divergent']
+    assert (divergent['block'], divergent['entry_id']) == (1, 3)
+
+
+def test_verification_spans_rollover_tables_and_archives(conn, tmp_path):
+    audit_chain.seal(conn, block_size=4, now=NOW)
+    audit_archive.rollover(conn, NOW)
+    assert audit_chain.verify(conn)['ok']
+    audit_archive.archive(conn, str(tmp_path), keep_months=1, now=NOW)  # January leaves the database
+    assert not audit_chain.verify(conn)['ok']
+    report = audit_chain.verify(conn, archive_dir=str(tmp_path))
+    assert (report['ok'], report['entries']) == (True, 10)
+    assert audit_chain.prove(conn, 2, archive_dir=str(tmp_path))['block'] == 1
@@ -36,3 +36,42 @@ def test_process_atterberg_and_proctor():
 
     assert 'proctor' in results
     assert results['proctor']['dry_density'] == 2000.0
+
+
+def _bench_sheet(n):
+    for i in range(n):
+        readings = {
+            'compressive': {'load_kN': 200.0 + i, 'area_mm2': 22500.0 if i % 7 else 0.0},
+            'water_absorption': {'dry_mass_g': 2000.0, 'saturated_mass_g': 2100.0 + i},
+            'atterberg': {'liquid_limit': 40.0 + i % 5, 'plastic_limit': 18.125},
+        }
+        if i % 3 == 0:
+            readings['sieve'] = {'sieve_masses': {75: 10, 37.5: 20 + i % 4, 19: 30, 9.5: 25, 4.75: 10},
+                                 'total_mass': 95.0 + i % 4}
+        if i % 5 == 0:
+            readings['cbr'] = {'load_at_penetration_kN': 10.5}  # missing standard load
+        yield readings
+
+
+def test_process_readings_many_matches_process_readings():
+    from auto_calculations import process_readings_many
+
+    outputs = list(process_readings_many(_bench_sheet(50), chunk_size=8))
+
+    assert len(outputs) == 50
+    for readings, out in zip(_bench_sheet(50), outputs):
+        if out['errors']:
+            assert 'compressive' in out['errors'] or 'cbr' in out['errors']
+            for kind in out['errors']:
+                readings.pop(kind)
+        assert out['results'] == process_readings(readings)
+    assert outputs[0]['errors'] == {'compressive': 'Area must be positive',
+                                    'cbr': "Missing reading 'standard_load_kN'"}
+
+
+def test_process_readings_many_with_process_pool():
+    from auto_calculations import process_readings_many
+
+    serial = list(process_readings_many(_bench_sheet(40), chunk_size=5))
+    pooled = list(process_readings_many(_bench_sheet(40), workers=2, chunk_size=5))
+    assert pooled == serial
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+import calculations
+import batch_calculations as batch
+
+
+def _scalar(fn, *columns):
+    """Run a scalar calculation row by row, returning (values, error messages)."""
+    values, errors = [], []
+    for row in zip(*columns):
+        try:
+            values.append(fn(*(float(v) for v in row)))
+            errors.append(None)
+        except ValueError as e:
+            values.append(None)
+            errors.append(str(e))
+    return values, errors
+
+
+@pytest.mark.parametrize('name, columns', [
+    ('compressive_strength_mpa', [(-50, 900), (-1000, 40000)]),
+    ('flexural_strength_mpa', [(0, 80), (-10, 700), (-10, 200), (-10, 200)]),
+    ('split_tensile_strength_mpa', [(0, 400), (-10, 400), (-10, 200)]),
+    ('water_absorption_percent', [(-100, 3000), (-100, 3300)]),
+    ('cbr_value', [(0, 30), (-5, 25)]),
+])
+def test_batch_matches_scalar_bit_for_bit(name, columns):
+    rng = np.random.default_rng(42)
+    data = [np.round(rng.uniform(lo, hi, 2000), 3) for lo, hi in columns]
+    expected, expected_errors = _scalar(getattr(calculations, name), *data)
+
+    result = getattr(batch, name)(*data)
+
+    for value, error, got, got_error, bad in zip(expected, expected_errors, result.values, result.errors, result.invalid):
+        if error is None:
+            assert not bad
+            assert got == value
+        else:
+            assert bad
+            assert got_error == error
+            assert np.isnan(got)
+
+
+def test_water_absorption_error_order():
+    result = batch.water_absorption_percent([0.0, 100.0, 100.0], [10.0, 50.0, 110.0])
+    assert list(result.invalid) == [True, True, False]
+    assert result.errors[0] == 'Dry mass must be positive'
+    assert result.errors[1] == 'Saturated mass cannot be less than dry mass'
+    assert result.values[2] == calculations.water_absorption_percent(100.0, 110.0)
+
+
+def test_proctor_and_atterberg_rounding_matches_scalar():
+    rng = np.random.default_rng(7)
+    density = np.round(rng.uniform(-10, 2400, 5000), 3)
+    water = np.round(rng.uniform(-1, 30, 5000), 3)
+
+    proctor = batch.proctor_compaction(density, water)
+    atterberg = batch.atterberg_limits(water + 20, water)
+    for i in range(len(density)):
+        try:
+            expected = calculations.proctor_compaction(float(density[i]), float(water[i]))
+            assert proctor.values['dry_density'][i] == expected['dry_density']
+            assert proctor.values['water_content'][i] == expected['water_content']
+        except ValueError as e:
+            assert proctor.errors[i] == str(e)
+        try:
+            expected = calculations.atterberg_limits(float(water[i] + 20), float(water[i]))
+            assert atterberg.values['PI'][i] == expected['PI']
+            assert atterberg.values['LL'][i] == expected['LL']
+        except ValueError as e:
+            assert atterberg.invalid[i]
+
+
+def test_scalars_and_lists_broadcast():
+    result = batch.compressive_strength_mpa([250.0, 300.0], 19600)
+    assert result.values.shape == (2,)
+    assert not result.invalid.any()
+
+
+def test_sieve_batch_matches_scalar_summary():
+    rng = np.random.default_rng(3)
+    sizes = [4.75, 75, 19, 37.5, 9.5, 2.36]
+    retained = np.round(rng.uniform(0, 40, (300, len(sizes))), 2)
+    retained[5] = 0.0  # nothing retained: no D-values
+    totals = retained.sum(axis=1)
+    totals[7] = 0.0    # invalid lot
+
+    result = batch.sieve_analysis_summary(sizes, retained, totals)
+
+    assert list(result.values['sieve_mm']) == sorted(sizes, reverse=True)
+    for lot in range(len(retained)):
+        masses = dict(zip(sizes, retained[lot].tolist()))
+        try:
+            expected = calculations.sieve_analysis_summary(masses, float(totals[lot]))
+        except ValueError as e:
+            assert result.invalid[lot] and result.errors[lot] == str(e)
+            continue
+        assert [row['percent_passing'] for row in expected['summary_table']] == list(result.values['percent_passing'][lot])
+        for key in ('D10', 'D30', 'D60', 'Cu', 'Cc'):
+            got = result.values[key][lot]
+            if expected[key] is None:
+                assert np.isnan(got)
+            else:
+                assert got == expected[key]
+
+
+def test_sieve_batch_log_interpolation():
+    linear = batch.sieve_analysis_summary([75, 37.5, 19, 9.5, 4.75], [[10, 20, 30, 25, 10]])
+    log = batch.sieve_analysis_summary([75, 37.5, 19, 9.5, 4.75], [[10, 20, 30, 25, 10]], log_interpolation=True)
+    # Log interpolation between 19 and 9.5 mm lands on the geometric side of the linear value
+    assert 9.5 < log.values['D30'][0] < linear.values['D30'][0] < 19
+    assert not log.invalid.any()
@@ -0,0 +1,130 @@
+"""
+Tests for streamed batch PDF reports
+"""
+import os
+import re
+import zlib
+from datetime import datetime
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import batch_reports
+import report_jobs
+from models import User, Project, Sample, TestResult, Report
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # job artifacts are written under reports/
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='batch-admin', role='Admin')
+        admin.set_password('pw')
+        project = Project(project_code='BR-1', project_name='Bridge')
+        myapp.db.session.add_all([admin, project])
+        myapp.db.session.flush()
+        for n in range(3):
+            sample = Sample(sample_id=f'BR-S{n}', sample_type='Concrete', project_id=project.id)
+            myapp.db.session.add(sample)
+            myapp.db.session.flush()
+            for k in range(4):
+                myapp.db.session.add(TestResult(sample_id=sample.id, test_name='Compressive Strength',
+                                                raw_values='450,460,470,22500', result_kind='compressive',
+                                                result_value=20.4 + k, date_tested=datetime(2024, 5, 1)))
+        # A sample without a project
+        orphan = Sample(sample_id='LOOSE-1', sample_type='Soil')
+        myapp.db.session.add(orphan)
+        myapp.db.session.flush()
+        myapp.db.session.add(TestResult(sample_id=orphan.id, test_name='CBR', raw_values='10.5,13.24',
+                                        remarks='Soaked ' * 40))
+        myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'batch-admin', 'password': 'pw'})
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _page_texts(pdf: bytes):
+    """Decompressed content streams, in file order."""
+    return [zlib.decompress(m.group(1)) for m in
+            re.finditer(rb'/FlateDecode >>\nstream\n(.*?)\nendstream', pdf, re.S)]
+
+
+def _page_count(pdf: bytes) -> int:
+    return int(re.search(rb'/Type /Pages /Kids \[[^\]]*\] /Count (\d+)', pdf).group(1))
+
+
+def test_sections_group_tests_by_sample(client):
+    with myapp.app.app_context():
+        sections = list(batch_reports.sections(session=myapp.db.session))
+    assert [s['sample']['sample_id'] for s in sections] == ['BR-S0', 'BR-S1', 'BR-S2', 'LOOSE-1']
+    assert [len(s['tests']) for s in sections] == [4, 4, 4, 1]
+    assert sections[0]['tests'][0]['result'] == '20.400 MPa'
+    assert sections[0]['tests'][0]['tested'] == '2024-05-01'
+    assert sections[3]['sample']['project'] == '-'
+
+
+def test_render_section_continues_on_new_pages():
+    section = {'sample': {'pk': 1, 'sample_id': 'S', 'sample_type': 'Soil', 'project': 'P', 'client': '-'},
+               'tests': [{'id': i, 'name': 'CBR', 'status': 'Pending', 'raw_values': '1,2', 'result': '-',
+                          'tested': '-', 'approved': None, 'remarks': 'x ' * 200} for i in range(12)]}
+    pages = batch_reports.render_section(section)
+    assert len(pages) > 1
+    assert b'(Sample S \\(continued\\))' in pages[1]
+
+
+def test_selected_tests_across_samples_are_streamed(client):
+    with myapp.app.app_context():
+        ids = [t.id for t in TestResult.query.order_by(TestResult.id)]
+    response = client.post('/reports/batch', data={'test_ids': [ids[0], ids[5], ids[-1]]})
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers['Content-Disposition'] == 'attachment; filename="batch_' + \
+        response.headers['Content-Disposition'].split('batch_', 1)[1]
+    pdf = response.get_data()
+    assert pdf.startswith(b'%PDF') and pdf.rstrip().endswith(b'%%EOF')
+    # title + contents + one page per sample
+    assert _page_count(pdf) == 5
+    body = b''.join(_page_texts(pdf))
+    assert b'BR-S0' in body and b'BR-S1' in body and b'LOOSE-1' in body
+    assert b'Samples: 3    Total Tests: 3' in body
+    assert pdf.count(b'/Subtype /Link') == 3
+    assert b'/Outlines' in pdf
+
+
+def test_whole_project_batch(client):
+    with myapp.app.app_context():
+        project_id = Project.query.one().id
+    response = client.post('/reports/batch', data={'project_id': project_id})
+    assert response.status_code == 200
+    assert 'batch_project_BR-1.pdf' in response.headers['Content-Disposition']
+    body = b''.join(_page_texts(response.get_data()))
+    assert b'Project: Bridge' in body and b'LOOSE-1' not in body
+    assert b'Total Tests: 12' in body
+
+
+def test_batch_report_as_background_job(client):
+    with myapp.app.app_context():
+        project_id = Project.query.one().id
+    response = client.post('/reports/batch', data={'project_id': project_id, 'deliver': 'job'})
+    assert response.status_code == 302
+    assert report_jobs.run_pending(myapp.app) == 1
+    status = client.get(response.headers['Location'] + '?format=json').get_json()
+    assert status['status'] == 'done', status['error']
+    pdf = client.get(status['download_url']).data
+    assert pdf.startswith(b'%PDF') and _page_count(pdf) == 5
+    with myapp.app.app_context():
+        assert Report.query.filter(Report.file_path.like('%batch_%')).count() == 1
+
+
+def test_empty_selection_redirects(client):
+    assert client.post('/reports/batch', data={}).status_code == 302
+    assert client.post('/reports/batch', data={'test_ids': ['99999']}).status_code == 302
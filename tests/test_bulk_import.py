@@ -0,0 +1,186 @@
+"""
+Tests for bulk sample / test import
+"""
+import csv
+import io
+import os
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import bulk_import
+import search
+import stats
+from models import User, Project, Sample, TestResult, Measurement
+
+HEADER = 'Sample ID,Type,Project,Client,Test Name,Raw Values,Date Tested\n'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # error reports are written under reports/imports
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='imp-admin', role='Admin')
+        admin.set_password('pw')
+        myapp.db.session.add_all([admin, Project(project_code='BR-9', project_name='Bridge 9'),
+                                  Sample(sample_id='OLD-1', sample_type='Soil')])
+        myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'imp-admin', 'password': 'pw'})
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+@pytest.fixture(params=[True, False], ids=['returning', 'no-returning'])
+def returning(request, monkeypatch):
+    """Run with and without INSERT .. RETURNING for executemany (MySQL has none)."""
+    with myapp.app.app_context():
+        dialect = myapp.db.engine.dialect
+    monkeypatch.setattr(dialect, 'insert_executemany_returning', request.param)
+    return request.param
+
+
+def _import(text, **kwargs):
+    with myapp.app.app_context():
+        return bulk_import.import_rows(myapp.db.session, bulk_import.read_rows(io.BytesIO(text.encode()), 'x.csv'),
+                                       **kwargs)
+
+
+def test_rows_are_imported_in_chunks_with_calculations(client, returning):
+    rows = ''.join(f'CUBE-{i},Concrete,BR-9,ACME,Compressive Strength,"{400 + i},22500",2024-05-0{1 + i}\n'
+                   for i in range(7))
+    rows += 'CUBE-0,,,,Compressive Strength,"410,22500",\n'  # second test on a sample from this file
+    rows += 'OLD-1,,,,CBR Test,"10.5,13.24",\n'  # test on an existing sample
+    summary = _import(HEADER + rows, chunk_size=3, calculate_results=True)
+    assert summary.as_dict() == {'rows': 9, 'samples': 7, 'tests': 9, 'calculated': 9, 'rejected': 0,
+                                 'warnings': 0}
+    with myapp.app.app_context():
+        cube = Sample.query.filter_by(sample_id='CUBE-3').one()
+        assert cube.project.project_code == 'BR-9' and cube.project_name == 'Bridge 9'
+        test = TestResult.query.filter_by(sample_id=cube.id).one()
+        assert test.result_kind == 'compressive' and test.result_value == pytest.approx(403000 / 22500)
+        assert test.calculated_result == f'{403000 / 22500:.3f} MPa' and test.status == 'Pending'
+        assert test.date_tested.day == 4
+        assert Measurement.query.filter_by(test_result_id=test.id, field='load_kN').one().value == 403
+        assert len(Sample.query.filter_by(sample_id='CUBE-0').one().tests) == 2
+        assert TestResult.query.join(Sample).filter(Sample.sample_id == 'OLD-1').one().result_value == \
+            pytest.approx(10.5 / 13.24 * 100)
+        # Counters and search index were kept up to date by the bulk inserts
+        assert stats.reconcile(myapp.db.session) == {}
+        hits = search.matches(myapp.db.session, 'CUBE-5')
+        assert [s for (s,) in myapp.db.session.query(Sample.sample_id).join(hits, hits.c.sample_id == Sample.id)] \
+            == ['CUBE-5']
+
+
+def test_invalid_rows_are_reported_and_the_rest_imported(client, returning):
+    rows = ('GOOD-1,Concrete,,,Compressive Strength,"250,19600",\n'
+            'BAD-TYPE,Metal,,,,,\n'
+            'BAD-TYPE,,,,Compressive Strength,"250,19600",\n'
+            'BAD-RAW,Concrete,,,Compressive Strength,"250,abc",\n'
+            ',Concrete,,,,,\n'
+            'OLD-1,Soil,,,,,\n'
+            'BAD-PROJ,Soil,NOPE,,,,\n'
+            'BAD-DATE,Soil,,,CBR Test,"10,13",yesterday\n'
+            'CALC,Soil,,,Water Absorption,"2000,1900",\n')
+    errors = io.StringIO()
+    summary = _import(HEADER + rows, calculate_results=True, error_writer=csv.writer(errors))
+    assert (summary.samples, summary.tests, summary.rejected, summary.warnings) == (2, 2, 7, 1)
+    report = {(int(r[0]), r[3]) for r in csv.reader(io.StringIO(errors.getvalue()))}
+    assert report == {(3, 'sample_type'), (4, 'sample_id'), (5, 'raw_values'), (6, 'sample_id'),
+                      (7, 'sample_id'), (8, 'project_code'), (9, 'date_tested'), (10, 'calculation')}
+    with myapp.app.app_context():
+        calc = TestResult.query.join(Sample).filter(Sample.sample_id == 'CALC').one()
+        assert calc.result_kind is None
+
+
+def test_upload_page_with_error_report(client):
+    data = {'file': (io.BytesIO((HEADER + 'UP-1,Concrete,,,,,\nUP-2,Rock,,,,,\n').encode()), 'batch.csv'),
+            'calculate': '1'}
+    response = client.post('/import', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'Imported 1 samples and 0 tests; 1 rows rejected' in page
+    link = page.split("href='/import/errors/", 1)[1].split("'", 1)[0]
+    report = client.get(f'/import/errors/{link}')
+    assert report.status_code == 200 and b'UP-2' in report.data
+
+
+def test_xlsx_upload(client):
+    openpyxl = pytest.importorskip('openpyxl')
+    wb = openpyxl.Workbook()
+    wb.active.append(['sample_id', 'sample_type', 'test_name', 'raw_values'])
+    wb.active.append(['X-1', 'Concrete', 'Compressive Strength', '300,22500'])
+    wb.active.append([1001, 'Soil', None, None])
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    response = client.post('/import', data={'file': (buf, 'sheet.xlsx')}, content_type='multipart/form-data')
+    assert 'Imported 2 samples and 1 tests' in response.get_data(as_text=True)
+    with myapp.app.app_context():
+        assert Sample.query.filter_by(sample_id='1001').count() == 1
+
+
+def test_unsupported_file_is_refused(client):
+    response = client.post('/import', data={'file': (io.BytesIO(b'x'), 'notes.txt')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+
+
+def test_bad_collection_dates_are_rejected(client):
+    header = 'Sample ID,Type,Collected\n'
+    errors = io.StringIO()
+    summary = _import(header + 'DC-1,Soil,2024-03-02T09:30\nDC-2,Soil,last week\n', error_writer=csv.writer(errors))
+    assert (summary.samples, summary.rejected) == (1, 1)
+    assert [r[3] for r in csv.reader(io.StringIO(errors.getvalue()))] == ['date_collected']
+    with myapp.app.app_context():
+        assert Sample.query.filter_by(sample_id='DC-1').one().date_collected == '2024-03-02'
+
+
+def _fail_on_second_chunk(monkeypatch):
+    calls = []
+    reindex = search.reindex_samples
+
+    def flaky(conn, ids):
+        calls.append(ids)
+        if len(calls) == 2:
+            raise RuntimeError('disk full')
+        return reindex(conn, ids)
+    monkeypatch.setattr(search, 'reindex_samples', flaky)
+
+
+def test_failed_chunk_reports_the_committed_rows(client, monkeypatch):
+    _fail_on_second_chunk(monkeypatch)
+    rows = ('CH-1,Concrete,,,,,\nCH-2,Rock,,,,,\n'  # chunk 1: one imported, one rejected
+            'CH-3,Concrete,,,,,\nCH-4,Rock,,,,,\n')  # chunk 2: fails
+    errors = io.StringIO()
+    with pytest.raises(bulk_import.ImportInterrupted) as stopped:
+        _import(HEADER + rows, chunk_size=2, error_writer=csv.writer(errors))
+    summary = stopped.value.summary
+    assert summary.as_dict() == {'rows': 2, 'samples': 1, 'tests': 0, 'calculated': 0, 'rejected': 1,
+                                 'warnings': 0}
+    assert summary.committed_row == 3 and 'disk full' in str(stopped.value)
+    assert [r[1] for r in csv.reader(io.StringIO(errors.getvalue()))] == ['CH-2']  # not CH-4
+    with myapp.app.app_context():
+        assert [s.sample_id for s in Sample.query.filter(Sample.sample_id.like('CH-%'))] == ['CH-1']
+
+
+def test_upload_page_reports_an_interrupted_import(client, monkeypatch):
+    _fail_on_second_chunk(monkeypatch)
+    myapp.app.config['IMPORT_CHUNK_SIZE'], chunk_size = 2, myapp.app.config['IMPORT_CHUNK_SIZE']
+    try:
+        data = {'file': (io.BytesIO((HEADER + 'UP-1,Concrete,,,,,\nUP-2,Rock,,,,,\nUP-3,Soil,,,,,\n').encode()),
+                         'batch.csv')}
+        page = client.post('/import', data=data, content_type='multipart/form-data').get_data(as_text=True)
+    finally:
+        myapp.app.config['IMPORT_CHUNK_SIZE'] = chunk_size
+    assert 'Rows up to 3 were imported (1 samples, 0 tests)' in page
+    link = page.split("href='/import/errors/", 1)[1].split("'", 1)[0]
+    assert b'UP-2' in client.get(f'/import/errors/{link}').data
@@ -0,0 +1,59 @@
+"""
+Tests for the database engine settings
+"""
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import db_engine
+
+
+@pytest.fixture
+def engine(tmp_path):
+    url = f"sqlite:///{tmp_path / 'tuned.db'}"
+    engine = create_engine(url)
+    db_engine.init_engine(engine, {'SQLITE_BUSY_TIMEOUT_MS': 2000})
+    yield engine
+    engine.dispose()
+
+
+def test_server_databases_get_pool_options():
+    options = db_engine.engine_options({'SQLALCHEMY_DATABASE_URI': 'mysql+pymysql://u:p@db/lims',
+                                        'DB_POOL_SIZE': 4, 'DB_POOL_RECYCLE': 600})
+    assert options == {'pool_size': 4, 'max_overflow': db_engine.MAX_OVERFLOW,
+                       'pool_timeout': db_engine.POOL_TIMEOUT, 'pool_recycle': 600, 'pool_pre_ping': True}
+    assert db_engine.engine_options({'SQLALCHEMY_DATABASE_URI': 'sqlite:///lims.db'}) == {}
+
+
+def test_sqlite_file_connections_get_the_pragmas(engine):
+    settings = db_engine.settings(engine)
+    assert (settings['journal_mode'], settings['synchronous'], settings['busy_timeout']) == ('wal', 1, 2000)
+    assert settings['cache_size'] == -65536 and settings['mmap_size'] > 0
+
+
+def test_writers_commit_while_a_read_is_open(engine):
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE t (x INTEGER)'))
+        conn.execute(text('INSERT INTO t VALUES (1)'))
+    with engine.connect() as reader, engine.connect() as writer:
+        reader.execute(text('BEGIN'))
+        assert reader.execute(text('SELECT count(*) FROM t')).scalar() == 1
+        # In rollback-journal mode this commit waits for the reader and fails after busy_timeout
+        writer.execute(text('BEGIN IMMEDIATE'))
+        writer.execute(text('INSERT INTO t VALUES (2)'))
+        writer.execute(text('COMMIT'))
+        assert reader.execute(text('SELECT count(*) FROM t')).scalar() == 1  # the reader's snapshot
+        reader.execute(text('COMMIT'))
+        assert reader.execute(text('SELECT count(*) FROM t')).scalar() == 2
+
+
+def test_invalid_pragmas_and_memory_databases():
+    with pytest.raises(ValueError):
+        db_engine.sqlite_pragmas({'SQLITE_JOURNAL_MODE': 'wal; DROP TABLE users'})
+    assert db_engine.init_engine(create_engine('sqlite://'), {}) is None
+    assert myapp.app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {}
@@ -0,0 +1,126 @@
+"""
+Tests for read/write routing between the primary and a replica
+"""
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, text, update
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import db_routing
+from models import User, Sample
+
+
+def _populate(session, sample_id):
+    admin = User(username='route-admin', role='Admin')
+    admin.set_password('pw')
+    session.add_all([admin, Sample(sample_id=sample_id, sample_type='Concrete')])
+    session.commit()
+
+
+@pytest.fixture
+def client(tmp_path):
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        myapp.db.metadata.create_all(replica)
+        _populate(myapp.db.session, 'PRIMARY-1')
+    with myapp.db.Session(bind=replica) as session:
+        _populate(session, 'REPLICA-1')
+    db_routing.set_replica(db_routing.Replica(replica))
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'route-admin', 'password': 'pw'})
+    yield client
+    db_routing.set_replica(None)
+    replica.dispose()
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _exported(client):
+    return [line.split(',')[1] for line in client.get('/export/samples?format=csv').get_data(as_text=True)
+            .splitlines()[1:]]
+
+
+def test_read_only_views_use_the_replica(client):
+    assert _exported(client) == ['REPLICA-1']
+    # Other views, and cached list pages, read the primary
+    assert 'PRIMARY-1' in client.get('/samples/1').get_data(as_text=True)
+    page = client.get('/samples').get_data(as_text=True)
+    assert 'PRIMARY-1' in page and 'REPLICA-1' not in page
+
+
+def test_users_read_their_own_writes(client):
+    response = client.post('/samples/new', data={'sample_id': 'PRIMARY-2', 'sample_type': 'Soil'})
+    assert response.status_code == 302
+    assert _exported(client) == ['PRIMARY-1', 'PRIMARY-2']
+    with client.session_transaction() as session:
+        session[db_routing.STICKY_KEY] -= myapp.app.config['DB_STICKY_SECONDS']
+    assert _exported(client) == ['REPLICA-1']
+
+
+def test_writes_go_to_the_primary_and_pin_the_session(client):
+    with myapp.app.test_request_context('/export/samples'):
+        myapp.app.preprocess_request()
+        session = myapp.db.session
+        assert session.execute(text('SELECT sample_id FROM samples')).scalars().all() == ['REPLICA-1']
+        session.execute(update(Sample.__table__).values(client_name='edited'))
+        assert session.execute(text('SELECT client_name FROM samples')).scalars().all() == ['edited']
+        session.rollback()
+        myapp.db.session.remove()
+
+
+def test_snapshot_copies_the_primary_on_refresh(tmp_path):
+    primary = sqlite3.connect(tmp_path / 'primary.db')
+    primary.execute('PRAGMA journal_mode=WAL')
+    primary.execute('CREATE TABLE t (x INTEGER)')
+    primary.execute('INSERT INTO t VALUES (1)')
+    primary.commit()
+    snapshot = db_routing.Snapshot(str(tmp_path / 'primary.db'), str(tmp_path / 'snap' / 'lims.db'), 3600)
+    snapshot.refresh()
+
+    def count():
+        with snapshot.engine().connect() as conn:
+            return conn.execute(text('SELECT count(*) FROM t')).scalar()
+
+    assert count() == 1
+    primary.execute('INSERT INTO t VALUES (2)')
+    primary.commit()
+    assert count() == 1  # until the next refresh
+    snapshot.refresh()
+    assert count() == 2 and snapshot.status()['last_error'] is None
+    primary.close()
+    with myapp.app.app_context(), pytest.raises(ValueError):
+        db_routing.replica_from_config({'DATABASE_SNAPSHOT': 'x.db'}, myapp.db.engine)  # in-memory primary
+
+
+def _unstick(client):
+    with client.session_transaction() as session:
+        session.pop(db_routing.STICKY_KEY, None)
+
+
+def test_users_and_roles_come_from_the_primary(client):
+    with myapp.app.app_context():
+        fresh = User(username='new-tech', role='Lab Technician')  # not on the replica yet
+        fresh.set_password('pw')
+        myapp.db.session.add(fresh)
+        myapp.db.session.commit()
+    other = myapp.app.test_client()
+    assert other.post('/login', data={'username': 'new-tech', 'password': 'pw'}).status_code == 302
+    _unstick(other)
+    assert _exported(other) == ['REPLICA-1']
+    assert other.get('/samples').status_code == 200
+
+    with myapp.app.app_context():
+        User.query.filter_by(username='route-admin').update({'role': 'Viewer'})  # still Admin on the replica
+        myapp.db.session.commit()
+    _unstick(client)
+    response = client.get('/projects/1/reports.zip')
+    assert response.status_code == 302 and '/login' not in response.location
@@ -0,0 +1,90 @@
+"""
+Tests for the streaming CSV / Excel exports
+"""
+import csv
+import io
+import os
+from datetime import datetime
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import exports
+from models import User, Project, Sample, TestResult
+
+
+@pytest.fixture
+def client():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='exp-admin', role='Admin')
+        admin.set_password('pw')
+        project = Project(project_code='EX-1', project_name='Dam')
+        myapp.db.session.add_all([admin, project])
+        myapp.db.session.flush()
+        concrete = Sample(sample_id='EX-C1', sample_type='Concrete', project_id=project.id)
+        soil = Sample(sample_id='EX-S1', sample_type='Soil', project_name='Legacy Road')
+        myapp.db.session.add_all([concrete, soil])
+        myapp.db.session.flush()
+        myapp.db.session.add_all([
+            TestResult(sample_id=concrete.id, test_name='Compressive Strength', raw_values='450,22500',
+                       result_kind='compressive', result_value=20.0, result_unit='MPa', status='Approved',
+                       approved_by=admin.id, date_tested=datetime(2024, 3, 1)),
+            TestResult(sample_id=concrete.id, test_name='Compressive Strength', raw_values='460,22500',
+                       date_tested=datetime(2024, 4, 1)),
+            TestResult(sample_id=soil.id, test_name='CBR', raw_values='10.5,13.24', date_tested=datetime(2024, 4, 2)),
+        ])
+        myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'exp-admin', 'password': 'pw'})
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _csv(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    return list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+
+def test_samples_csv_streams_default_columns(client):
+    response = client.get('/export/samples?format=csv')
+    assert response.is_streamed
+    table = _csv(response)
+    assert table[0] == ['ID', 'Sample ID', 'Type', 'Project', 'Client', 'Date Collected', 'Test Count']
+    assert [r[1:4] + [r[6]] for r in table[1:]] == [['EX-C1', 'Concrete', 'Dam', '2'],
+                                                   ['EX-S1', 'Soil', 'Legacy Road', '1']]
+
+
+def test_tests_csv_with_columns_and_filters(client):
+    table = _csv(client.get('/export/tests?format=csv&columns=sample_id,result,approved_by&type=Concrete'
+                            '&tested_from=2024-03-01&tested_to=2024-03-31'))
+    assert table == [['Sample ID', 'Result', 'Approved By'], ['EX-C1', '20.000 MPa', 'exp-admin']]
+    table = _csv(client.get('/export/tests?format=csv&columns=id&columns=status&status=Pending'))
+    assert [r[1] for r in table[1:]] == ['Pending', 'Pending']
+
+
+def test_unknown_column_is_rejected(client):
+    response = client.get('/export/tests?columns=id,password_hash')
+    assert response.status_code == 302
+
+
+def test_xlsx_uses_a_temporary_file_that_is_removed(client, tmp_path, monkeypatch):
+    openpyxl = pytest.importorskip('openpyxl')
+    monkeypatch.setattr(exports.tempfile, 'tempdir', str(tmp_path))
+    response = client.get('/export/tests?project_id=1')
+    data = response.get_data()
+    response.close()
+    assert response.status_code == 200
+    sheet = openpyxl.load_workbook(io.BytesIO(data)).active
+    values = list(sheet.values)
+    assert values[0][:3] == ('Test ID', 'Sample ID', 'Test Name')
+    assert len(values) == 3 and all(row[1] == 'EX-C1' for row in values[1:])
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,92 @@
+"""
+Tests for normalized measurement storage and the backfill job
+"""
+import os
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import measurements
+from models import Project, Sample, TestResult, Measurement
+
+
+@pytest.fixture
+def app():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        yield myapp.app
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _add_tests(raws, project=None):
+    sample = Sample(sample_id=f'M-{len(raws)}-{project.id if project else 0}', sample_type='Concrete',
+                    project_id=project.id if project else None)
+    myapp.db.session.add(sample)
+    myapp.db.session.flush()
+    tests = [TestResult(sample_id=sample.id, test_name=name, raw_values=raw) for name, raw in raws]
+    myapp.db.session.add_all(tests)
+    myapp.db.session.commit()
+    return tests
+
+
+def test_measurement_rows_for_sieve():
+    rows = measurements.measurement_rows(7, 'Sieve Analysis', '75:10;37.5:20;total:40')
+    assert [(r['field'], r['ordinal'], r['value']) for r in rows] == [
+        ('sieve_mm', 0, 75.0), ('retained_g', 0, 10.0),
+        ('sieve_mm', 1, 37.5), ('retained_g', 1, 20.0),
+        ('total_mass', 0, 40.0),
+    ]
+    assert measurements.measurement_rows(7, 'Compressive Strength', 'not numbers') == []
+
+
+def test_backfill_is_chunked_and_resumable(app):
+    tests = _add_tests([('Compressive Strength', f'{500 + i * 20},22500') for i in range(9)]
+                       + [('Sieve Analysis', '75:10;37.5:20;total:40'), ('Unknown Test', '1,2')])
+
+    last_id, written = measurements.backfill(myapp.db.session, chunk_size=4, start_id=0)
+    assert written == 9 * 2 + 5
+    assert last_id == tests[-1].id
+    # Second run finds nothing left to do
+    assert measurements.backfill(myapp.db.session, chunk_size=4)[1] == 0
+
+    first = myapp.db.session.get(TestResult, tests[0].id)
+    assert first.reading('load_kN') == 500.0
+    assert first.readings == {'area_mm2': 22500.0, 'load_kN': 500.0}
+    sieve = myapp.db.session.get(TestResult, tests[9].id)
+    assert sieve.readings['retained_g'] == [10.0, 20.0]
+
+
+def test_query_by_reading_runs_in_sql(app):
+    site = Project(project_code='P-1', project_name='Bridge')
+    other = Project(project_code='P-2', project_name='Road')
+    myapp.db.session.add_all([site, other])
+    myapp.db.session.commit()
+    mine = _add_tests([('Compressive Strength', '650,22500'), ('Compressive Strength', '550,22500')], site)
+    _add_tests([('Compressive Strength', '700,22500')], other)
+    measurements.backfill(myapp.db.session)
+
+    found = measurements.tests_with_reading('load_kN', '>', 600, project_id=site.id,
+                                            test_name='Compressive Strength').all()
+    assert [t.id for t in found] == [mine[0].id]
+
+
+def test_adding_a_test_stores_measurements(app):
+    from models import User
+    admin = User(username='m-admin', role='Admin')
+    admin.set_password('pw')
+    sample = Sample(sample_id='M-NEW', sample_type='Soil')
+    myapp.db.session.add_all([admin, sample])
+    myapp.db.session.commit()
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'm-admin', 'password': 'pw'})
+    client.post(f'/samples/{sample.id}', data={'test_name': 'Atterberg Limits', 'raw_value': '45,20'})
+
+    rows = Measurement.query.order_by(Measurement.field).all()
+    assert [(m.field, m.value, m.unit) for m in rows] == [('liquid_limit', 45.0, '%'), ('plastic_limit', 20.0, '%')]
@@ -0,0 +1,97 @@
+"""
+Tests for keyset pagination on list pages
+"""
+import os
+import re
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import pagination
+from models import User, Sample
+
+
+@pytest.fixture
+def client():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    pagination.clear_count_cache()
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='page-admin', role='Admin')
+        admin.set_password('pw')
+        myapp.db.session.add(admin)
+        myapp.db.session.add_all([Sample(sample_id=f'PG-{i:02d}', sample_type='Soil' if i % 2 else 'Concrete')
+                                  for i in range(7)])
+        myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'page-admin', 'password': 'pw'})
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _sample_ids(html):
+    return re.findall(r'<strong>(PG-\d+)</strong>', html)
+
+
+def _link(html, label):
+    m = re.search(r"href='([^']*)'>\s*(?:<i[^>]*></i>\s*)?" + label, html)
+    return m.group(1).replace('&amp;', '&') if m else None
+
+
+def test_walk_pages_forward_and_back(client):
+    first = client.get('/samples?per_page=3').get_data(as_text=True)
+    assert _sample_ids(first) == ['PG-06', 'PG-05', 'PG-04']
+    assert 'About 7 results' in first
+
+    second = client.get(_link(first, 'Older')).get_data(as_text=True)
+    assert _sample_ids(second) == ['PG-03', 'PG-02', 'PG-01']
+
+    third = client.get(_link(second, 'Older')).get_data(as_text=True)
+    assert _sample_ids(third) == ['PG-00']
+    assert _link(third, 'Older') == '#'
+
+    back = client.get(_link(third, 'Newer')).get_data(as_text=True)
+    assert _sample_ids(back) == ['PG-03', 'PG-02', 'PG-01']
+
+
+def test_cursor_links_keep_filters(client):
+    html = client.get('/samples?type=Soil&per_page=2').get_data(as_text=True)
+    assert _sample_ids(html) == ['PG-05', 'PG-03']
+    older = _link(html, 'Older')
+    assert 'type=Soil' in older and 'per_page=2' in older
+    assert _sample_ids(client.get(older).get_data(as_text=True)) == ['PG-01']
+
+
+def test_approximate_count_is_cached():
+    calls = []
+
+    class FakeQuery:
+        def order_by(self, *args):
+            return self
+
+        def count(self):
+            calls.append(1)
+            return 42
+
+    pagination.clear_count_cache()
+    assert pagination.approximate_count(('k',), FakeQuery()) == 42
+    assert pagination.approximate_count(('k',), FakeQuery()) == 42
+    assert len(calls) == 1
+    # Every distinct filter adds an entry; the oldest are dropped beyond COUNT_MAX_ENTRIES
+    for n in range(pagination.COUNT_MAX_ENTRIES + 10):
+        pagination.approximate_count(('search', f'term {n}'), FakeQuery())
+    assert len(pagination._count_cache._entries) == pagination.COUNT_MAX_ENTRIES
+    assert pagination.approximate_count(('k',), FakeQuery(), ttl=0) == 42
+    assert pagination.approximate_count(('k',), FakeQuery()) == 42
+    assert len(calls) == pagination.COUNT_MAX_ENTRIES + 10 + 3  # evicted, then expired at once
+
+
+def test_other_list_pages_paginate(client):
+    for url in ('/projects?per_page=1', '/users?per_page=1', '/audit/logs?per_page=1'):
+        assert client.get(url).status_code == 200
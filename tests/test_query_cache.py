@@ -0,0 +1,84 @@
+"""
+Tests for the generation-counter query cache
+"""
+import os
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import query_cache
+from models import Project
+
+
+@pytest.fixture
+def app():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    query_cache.reset_metrics()
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        yield myapp.app
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _project_codes():
+    return [p['project_code'] for p in myapp.project_choices()]
+
+
+def test_commit_invalidates_and_rollback_does_not(app):
+    session = myapp.db.session
+    assert _project_codes() == []
+    assert _project_codes() == []
+    assert query_cache.metrics()['caches']['project_choices'] == {'hits': 1, 'misses': 1}
+
+    session.add(Project(project_code='QC-1', project_name='First'))
+    session.commit()
+    assert _project_codes() == ['QC-1']
+
+    session.add(Project(project_code='QC-2', project_name='Rolled back'))
+    session.flush()
+    session.rollback()
+    assert _project_codes() == ['QC-1']
+    assert query_cache.metrics()['caches']['project_choices'] == {'hits': 2, 'misses': 2}
+
+
+def test_bulk_update_invalidates(app):
+    myapp.db.session.add(Project(project_code='QC-3', project_name='Bulk'))
+    myapp.db.session.commit()
+    assert _project_codes() == ['QC-3']
+    Project.query.update({'project_code': 'QC-4'})
+    myapp.db.session.commit()
+    assert _project_codes() == ['QC-4']
+
+
+def test_memory_backend_lru_and_ttl():
+    backend = query_cache.MemoryBackend(max_entries=2)
+    backend.set('a', 1, ttl=60)
+    backend.set('b', 2, ttl=60)
+    assert backend.get('a') == 1
+    backend.set('c', 3, ttl=60)
+    assert backend.get('b') is query_cache.MISS
+    assert backend.evictions == 1
+    backend.set('d', 4, ttl=-1)
+    assert backend.get('d') is query_cache.MISS
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    url = f"sqlite:///{tmp_path / 'cache.db'}"
+    first, second = query_cache.backend_from_url(url), query_cache.backend_from_url(url)
+    first.set('k', {'rows': [1, 2]}, ttl=60)
+    assert second.get('k') == {'rows': [1, 2]}
+    first.bump('projects')
+    assert second.generation('projects') == 1
+
+
+def test_disabled_cache_always_loads(monkeypatch):
+    monkeypatch.setattr(query_cache, '_backend', None)
+    calls = []
+    query_cache.cached('x', (), ['projects'], lambda: calls.append(1))
+    query_cache.cached('x', (), ['projects'], lambda: calls.append(1))
+    assert len(calls) == 2
@@ -0,0 +1,93 @@
+"""
+Regression tests: list pages and exports issue a fixed number of SQL
+statements however many rows they show (no N+1 lazy loads).
+"""
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import pagination
+from models import User, Project, Sample, TestResult, AuditLog
+
+
+@pytest.fixture
+def app():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='qc-admin', role='Admin')
+        admin.set_password('pw')
+        myapp.db.session.add(admin)
+        myapp.db.session.commit()
+    yield myapp.app
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'qc-admin', 'password': 'pw'})
+    return client
+
+
+def _seed(n):
+    """Create n samples (each with its own project and two tests, one approved) plus audit rows."""
+    admin = User.query.filter_by(username='qc-admin').one()
+    for i in range(n):
+        project = Project(project_code=f'QC-{n}-{i}', project_name=f'Project {i}')
+        myapp.db.session.add(project)
+        myapp.db.session.flush()
+        sample = Sample(sample_id=f'QC-{n}-{i}', sample_type='Concrete', project_id=project.id)
+        myapp.db.session.add(sample)
+        myapp.db.session.flush()
+        myapp.db.session.add_all([
+            TestResult(sample_id=sample.id, test_name='Compressive Strength', raw_values='250,22500',
+                       status='Pending'),
+            TestResult(sample_id=sample.id, test_name='Compressive Strength', raw_values='260,22500',
+                       status='Approved', approved_by=admin.id, approved_at=datetime.utcnow()),
+        ])
+        myapp.db.session.add(AuditLog(user_id=admin.id, action='CREATE', entity_type='Sample',
+                                      entity_id=sample.id, timestamp=datetime.utcnow()))
+    myapp.db.session.commit()
+    return Sample.query.order_by(Sample.id.desc()).first().id
+
+
+def _count_statements(app, client, url):
+    pagination.clear_count_cache()
+    with app.app_context():
+        engine = myapp.db.engine
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize('url', ['/', '/samples', '/samples/{id}', '/export/samples', '/export/tests',
+                                 '/audit/logs'])
+def test_statement_count_does_not_grow_with_rows(app, client, url):
+    with app.app_context():
+        sample_id = _seed(2)
+    few = _count_statements(app, client, url.format(id=sample_id))
+
+    with app.app_context():
+        sample_id = _seed(25)
+    many = _count_statements(app, client, url.format(id=sample_id))
+
+    assert many == few
@@ -0,0 +1,56 @@
+import pytest
+
+import raw_values
+from raw_values import RawValuesError, parse
+
+
+def test_parse_field_list():
+    values = parse('flexural', ' 45, 500 ,150,150')
+    assert values.load_kN == 45.0
+    assert values._asdict() == {'load_kN': 45.0, 'length_mm': 500.0, 'width_mm': 150.0, 'depth_mm': 150.0}
+
+
+def test_parse_ignores_extra_values_like_legacy_split():
+    assert parse('compressive', '250,19600,99') == parse('compressive', '250,19600')
+
+
+def test_parse_sieve_with_and_without_total():
+    values = parse('sieve', '75:10;37.5:20;19:30;total:95')
+    assert dict(values.sieve_masses) == {75.0: 10.0, 37.5: 20.0, 19.0: 30.0}
+    assert values.total_mass == 95.0
+    assert parse('sieve', '75:10;37.5:20;').total_mass == 30.0
+
+
+def test_cube_report_optional_fields():
+    values = parse('cube_report', '250,260')
+    assert values.load_1_kN == 250.0 and values.load_2_kN == 260.0
+    assert values.load_3_kN is None and values.area_mm2 is None
+
+
+@pytest.mark.parametrize('kind, raw, field, position', [
+    ('compressive', '250', 'area_mm2', 3),
+    ('compressive', '250,,19600', 'area_mm2', 4),
+    ('atterberg', '45,abc', 'plastic_limit', 3),
+    ('sieve', '75:10;19-30', 'sieve_masses', 6),
+])
+def test_parse_errors_are_structured(kind, raw, field, position):
+    with pytest.raises(RawValuesError) as info:
+        parse(kind, raw)
+    err = info.value
+    assert isinstance(err, ValueError)
+    assert (err.kind, err.raw, err.field, err.position) == (kind, raw, field, position)
+    assert err.as_dict()['field'] == field
+
+
+def test_parse_is_cached_per_raw_string():
+    parse.cache_clear()
+    first = parse('cbr', '10.5,13.24')
+    assert parse('cbr', '10.5,13.24') is first
+    assert parse.cache_info().hits == 1
+
+
+def test_to_readings_feeds_process_readings():
+    from auto_calculations import process_readings
+
+    readings = raw_values.to_readings('sieve', '75:10;37.5:20;19:30;9.5:25;4.75:10;total:95')
+    assert process_readings(readings)['sieve_analysis']['D60'] is not None
@@ -0,0 +1,64 @@
+"""
+Tests for renderer detection and the warm renderer pool
+"""
+import faulthandler
+
+import pytest
+
+import renderers
+
+
+def test_reportlab_is_always_detected():
+    assert 'reportlab' in renderers.available(refresh=True)
+
+
+def test_pdf_renderer_restricts_backends(monkeypatch):
+    monkeypatch.setenv('PDF_RENDERER', 'reportlab')
+    try:
+        assert renderers.available(refresh=True) == ['reportlab']
+        assert renderers.html_backend() is None
+    finally:
+        monkeypatch.delenv('PDF_RENDERER')
+        renderers.available(refresh=True)
+
+
+def test_pool_renders_reportlab(tmp_path):
+    pool = renderers.RendererPool(workers=1, backends=['reportlab'])
+    try:
+        out = tmp_path / 'r.pdf'
+        used = pool.render('reportlab', str(out), fields={
+            'lab_name': 'Lab', 'sample': {'sample_id': 'S-1', 'sample_type': 'Soil'},
+            'test_name': 'CBR Test', 'raw_values': '2.5,13.24', 'result': 'CBR = 18.88%'})
+        assert used == 'reportlab'
+        assert pool._executor._mp_context.get_start_method() == 'spawn'
+        assert out.read_bytes().startswith(b'%PDF')
+        with pytest.raises(renderers.NoRendererAvailable):
+            pool.render_html('<p>x</p>', str(tmp_path / 'h.pdf'))
+    finally:
+        pool.shutdown()
+
+
+def test_static_files_are_served_from_memory(tmp_path, monkeypatch):
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'images' / 'header.gif').write_bytes(b'GIF89a')
+    monkeypatch.setitem(renderers._worker, 'static', renderers._preload_static(str(tmp_path)))
+    fetched = renderers._static_fetcher('http://localhost:5000/static/images/header.gif?v=1')
+    assert fetched == {'string': b'GIF89a', 'mime_type': 'image/gif'}
+    with pytest.raises(ValueError):
+        renderers._static_fetcher('http://localhost:5000/static/images/missing.png')
+
+
+def test_pool_recovers_when_a_worker_dies(tmp_path):
+    pool = renderers.RendererPool(workers=1, backends=['reportlab'])
+    try:
+        crashed = pool.submit(faulthandler._sigsegv)
+        with pytest.raises(renderers.BrokenProcessPool):
+            crashed.result(60)
+        out = tmp_path / 'after.pdf'
+        assert pool.render('reportlab', str(out), fields={
+            'lab_name': 'Lab', 'sample': {'sample_id': 'S-2', 'sample_type': 'Soil'},
+            'test_name': 'CBR Test', 'raw_values': '2.5,13.24', 'result': 'CBR = 18.88%'}) == 'reportlab'
+        assert out.read_bytes().startswith(b'%PDF')
+        assert pool.submit(abs, -3).result(60) == 3
+    finally:
+        pool.shutdown()
@@ -0,0 +1,223 @@
+"""
+Tests for the background report job queue
+"""
+import inspect
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import false
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import pdf_cache
+import report_jobs
+from models import User, Sample, TestResult, ReportJob, Report
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # reports/ is written relative to the working directory
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='job-admin', role='Admin')
+        admin.set_password('pw')
+        sample = Sample(sample_id='JOB-1', sample_type='Concrete')
+        myapp.db.session.add_all([admin, sample])
+        myapp.db.session.flush()
+        myapp.db.session.add(TestResult(sample_id=sample.id, test_name='Compressive Strength',
+                                        raw_values='450,460,470,22500'))
+        myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'job-admin', 'password': 'pw'})
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _test_id():
+    with myapp.app.app_context():
+        return TestResult.query.one().id
+
+
+def test_generate_enqueues_then_worker_renders(client):
+    test_id = _test_id()
+    response = client.get(f'/reports/generate/{test_id}')
+    assert response.status_code == 302
+    job_url = response.headers['Location']
+    status = client.get(job_url + '?format=json').get_json()
+    assert status['status'] == 'queued' and status['download_url'] is None
+
+    # A second click while the first job is in flight reuses it
+    assert client.get(f'/reports/generate/{test_id}').headers['Location'] == job_url
+
+    assert report_jobs.run_pending(myapp.app) == 1
+    status = client.get(job_url + '?format=json').get_json()
+    assert status['status'] == 'done' and status['attempts'] == 1
+    pdf = client.get(status['download_url'])
+    assert pdf.status_code == 200 and pdf.data.startswith(b'%PDF')
+    with myapp.app.app_context():
+        assert Report.query.filter_by(test_result_id=test_id).count() == 1
+
+    assert client.get(job_url).status_code == 200
+    assert 'test_report' in client.get('/admin/jobs').get_data(as_text=True)
+
+
+def test_unchanged_report_is_served_from_cache(client):
+    test_id = _test_id()
+    client.get(f'/reports/generate/{test_id}')
+    report_jobs.run_pending(myapp.app)
+
+    cached = client.get(f'/reports/generate/{test_id}')
+    assert cached.status_code == 200 and cached.data.startswith(b'%PDF')
+    etag = cached.headers['ETag']
+    assert not etag.startswith('W/')
+    assert client.get(f'/reports/generate/{test_id}', headers={'If-None-Match': etag}).status_code == 304
+    with myapp.app.app_context():
+        assert Report.query.count() == 1
+        assert ReportJob.query.count() == 1
+
+    # Any change to the test gives a new key, so the report is rendered again
+    with myapp.app.app_context():
+        TestResult.query.get(test_id).remarks = 'Re-checked'
+        myapp.db.session.commit()
+    assert client.get(f'/reports/generate/{test_id}').status_code == 302
+    assert report_jobs.run_pending(myapp.app) == 1
+    with myapp.app.app_context():
+        assert Report.query.count() == 2
+
+
+def test_cache_evicts_least_recently_used(client):
+    keys = [pdf_cache.cache_key('t', 'r', n=n) for n in range(3)]
+    for age, key in enumerate(keys):
+        path = pdf_cache.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100)
+        os.utime(path, (1000 + age, 1000 + age))
+    assert pdf_cache.lookup(keys[0])  # touching the oldest makes it the most recent
+    assert pdf_cache.evict(max_bytes=200) == 1
+    assert pdf_cache.lookup(keys[1]) is None
+    assert pdf_cache.lookup(keys[0]) and pdf_cache.lookup(keys[2])
+
+
+
+def test_cache_key_follows_the_rendering_code(monkeypatch):
+    assert all(os.path.exists(os.path.join(pdf_cache._ROOT, name)) for name in pdf_cache.TEMPLATE_FILES)
+    before = pdf_cache.cache_key('t', 'r', n=1)
+    pdf_cache.template_version.cache_clear()
+    monkeypatch.setattr(pdf_cache, 'RENDER_VERSION', pdf_cache.RENDER_VERSION + 1)
+    try:
+        assert pdf_cache.cache_key('t', 'r', n=1) != before
+    finally:
+        pdf_cache.template_version.cache_clear()
+
+def test_failing_job_is_retried_then_failed(client, monkeypatch):
+    calls = []
+
+    def broken(job):
+        calls.append(job.attempts)
+        raise RuntimeError('renderer crashed')
+
+    monkeypatch.setitem(report_jobs._handlers, 'broken', broken)
+    monkeypatch.setattr(report_jobs, 'RETRY_DELAY_SECONDS', 0)
+    with myapp.app.app_context():
+        job, created = report_jobs.enqueue(myapp.db.session, 'broken', {'n': 1}, max_attempts=2)
+        job_id = job.id
+    assert created
+    assert report_jobs.run_pending(myapp.app) == 2
+    assert calls == [1, 2]
+    with myapp.app.app_context():
+        job = myapp.db.session.get(ReportJob, job_id)
+        assert job.status == 'failed' and job.error == 'RuntimeError: renderer crashed'
+        assert job.finished_at is not None
+
+    client.post(f'/admin/jobs/{job_id}/retry')
+    with myapp.app.app_context():
+        assert myapp.db.session.get(ReportJob, job_id).status == 'queued'
+
+
+def test_stale_running_jobs_are_requeued(client):
+    with myapp.app.app_context():
+        job, _ = report_jobs.enqueue(myapp.db.session, 'test_report', {'test_id': 1})
+        claimed = report_jobs.claim_next(myapp.db.session, 'dead-worker')
+        assert claimed.id == job.id and claimed.status == 'running'
+        assert report_jobs.claim_next(myapp.db.session, 'other') is None
+        # Long-running jobs whose worker keeps sending heartbeats are left alone
+        claimed.started_at = datetime.utcnow() - timedelta(hours=1)
+        myapp.db.session.commit()
+        assert report_jobs.requeue_stale(myapp.db.session) == 0
+        claimed.heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+        myapp.db.session.commit()
+        assert report_jobs.requeue_stale(myapp.db.session) == 1
+        assert myapp.db.session.get(ReportJob, job.id, populate_existing=True).status == 'queued'
+
+
+
+def test_job_that_keeps_killing_its_worker_fails(client):
+    with myapp.app.app_context():
+        session = myapp.db.session
+        job, _ = report_jobs.enqueue(session, 'test_report', {'test_id': 1}, max_attempts=2)
+        for requeued in (1, 0):
+            claimed = report_jobs.claim_next(session, 'dying-worker')
+            claimed.heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+            session.commit()
+            assert report_jobs.requeue_stale(session) == requeued
+        job = session.get(ReportJob, job.id, populate_existing=True)
+        assert (job.status, job.attempts, job.inflight_key) == ('failed', 2, None)
+        assert 'timed out' in job.error and job.finished_at is not None
+        assert report_jobs.claim_next(session, 'other') is None
+
+
+def test_download_of_an_evicted_report_renders_it_again(client):
+    test_id = _test_id()
+    job_url = client.get(f'/reports/generate/{test_id}').headers['Location']
+    report_jobs.run_pending(myapp.app)
+    status = client.get(job_url + '?format=json').get_json()
+    with myapp.app.app_context():
+        os.remove(myapp.db.session.get(ReportJob, status['id']).result_path)
+    response = client.get(status['download_url'])
+    assert response.status_code == 302 and response.headers['Location'] == job_url
+    assert client.get(job_url + '?format=json').get_json()['status'] == 'queued'
+    assert report_jobs.run_pending(myapp.app) == 1
+    pdf = client.get(status['download_url'])
+    assert pdf.status_code == 200 and pdf.data.startswith(b'%PDF')
+
+def test_concurrent_enqueue_of_the_same_job_inserts_it_once(client, monkeypatch):
+    query = inspect.getattr_static(ReportJob, 'query')
+    lookups = []
+
+    class RacingQuery:
+        # The first lookup misses, as if another request inserted the job right after it
+        def __get__(self, obj, cls):
+            lookups.append(1)
+            q = query.__get__(obj, cls)
+            return q.filter(false()) if len(lookups) == 1 else q
+
+    with myapp.app.app_context():
+        first, created = report_jobs.enqueue(myapp.db.session, 'test_report', {'test_id': 1})
+        monkeypatch.setattr(ReportJob, 'query', RacingQuery())
+        second, created_again = report_jobs.enqueue(myapp.db.session, 'test_report', {'test_id': 1})
+        monkeypatch.undo()
+        assert created and not created_again and second.id == first.id
+        assert ReportJob.query.count() == 1
+        # Finished jobs release the key, so the same report can be queued again
+        report_jobs.run_job(myapp.app, myapp.db.session, report_jobs.claim_next(myapp.db.session, 'w'))
+        assert report_jobs.enqueue(myapp.db.session, 'test_report', {'test_id': 1})[1]
+
+
+def test_workers_start_once_per_process(monkeypatch):
+    started = []
+    monkeypatch.setattr(report_jobs, 'start_workers', lambda app, threads: started.append(threads) or object())
+    monkeypatch.setattr(report_jobs, '_pool', None)
+    assert report_jobs.ensure_workers(myapp.app, 0) is None
+    pool = report_jobs.ensure_workers(myapp.app, 2)
+    assert report_jobs.ensure_workers(myapp.app, 2) is pool and started == [2]
+    monkeypatch.setattr(report_jobs, '_pool_pid', -1)  # as in a forked child
+    report_jobs.ensure_workers(myapp.app, 2)
+    assert started == [2, 2]
@@ -0,0 +1,106 @@
+"""
+Tests for the streamed project report pack (ZIP)
+"""
+import io
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import report_pack
+from models import User, Project, Sample, TestResult, Report
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the PDF cache lives under reports/cache
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        admin = User(username='pack-admin', role='Admin')
+        admin.set_password('pw')
+        project = Project(project_code='PK 1', project_name='Pack')
+        myapp.db.session.add_all([admin, project])
+        myapp.db.session.flush()
+        sample = Sample(sample_id='PK-S1', sample_type='Concrete', project_id=project.id)
+        myapp.db.session.add(sample)
+        myapp.db.session.flush()
+        for status in ('Approved', 'Approved', 'Pending'):
+            myapp.db.session.add(TestResult(sample_id=sample.id, test_name='Compressive Strength',
+                                            raw_values='450,460,470,22500', status=status,
+                                            date_tested=datetime(2024, 5, 1)))
+        myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'pack-admin', 'password': 'pw'})
+    yield client
+    with myapp.app.app_context():
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _project_id():
+    with myapp.app.app_context():
+        return Project.query.one().id
+
+
+def test_zip_contains_approved_reports_rendered_on_demand(client):
+    response = client.get(f'/projects/{_project_id()}/reports.zip')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers['Content-Disposition'] == 'attachment; filename="PK_1_reports.zip"'
+    archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    assert archive.testzip() is None
+    names = archive.namelist()
+    assert len(names) == 2 and all(n.startswith('PK-S1/') and n.endswith('_Compressive_Strength.pdf')
+                                   for n in names)
+    assert all(archive.read(n).startswith(b'%PDF') for n in names)
+    # The renders went into the PDF cache, so the single-report route now hits it
+    with myapp.app.app_context():
+        test_id = TestResult.query.filter_by(status='Approved').first().id
+    assert client.get(f'/reports/generate/{test_id}').status_code == 200
+
+
+def test_stored_report_files_are_reused(client, tmp_path):
+    stored = tmp_path / 'old_report.pdf'
+    stored.write_bytes(b'%PDF-stored')
+    with myapp.app.app_context():
+        tr = TestResult.query.filter_by(status='Approved').first()
+        myapp.db.session.add(Report(sample_id=tr.sample_id, test_result_id=tr.id, file_path=str(stored)))
+        myapp.db.session.commit()
+        test_id = tr.id
+    archive = zipfile.ZipFile(io.BytesIO(client.get(f'/projects/{_project_id()}/reports.zip').get_data()))
+    name = next(n for n in archive.namelist() if n.startswith(f'PK-S1/{test_id}_'))
+    assert archive.read(name) == b'%PDF-stored'
+
+
+def test_stream_zip_notes_missing_files(tmp_path):
+    present = tmp_path / 'a.pdf'
+    present.write_bytes(b'x' * (report_pack.CHUNK_SIZE * 3 + 5))
+    chunks = list(report_pack.stream_zip([('a.pdf', str(present)), ('b.pdf', None),
+                                          ('c.pdf', str(tmp_path / 'gone.pdf'))]))
+    assert len(chunks) > 3 and all(chunks)
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    assert archive.namelist() == ['a.pdf', 'MISSING.txt']
+    assert archive.read('a.pdf') == present.read_bytes()
+    assert archive.read('MISSING.txt').decode().splitlines()[1:] == ['b.pdf', 'c.pdf']
+
+
+def test_ordered_ahead_keeps_order_and_bounds_window():
+    started = []
+
+    def items():
+        for n in range(10):
+            started.append(n)
+            yield n
+
+    out = []
+    for value in report_pack.ordered_ahead(items(), lambda n: n * n, window=3):
+        assert len(started) - len(out) <= 3
+        out.append(value)
+    assert out == [n * n for n in range(10)]
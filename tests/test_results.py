@@ -0,0 +1,96 @@
+"""
+Tests for typed calculated results and render-time formatting
+"""
+import os
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import results
+from models import Project, Sample, TestResult
+
+
+@pytest.fixture
+def app():
+    myapp.app.config['TESTING'] = True
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        yield myapp.app
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def test_set_result_keeps_numbers_and_legacy_text():
+    tr = TestResult(test_name='CBR Test')
+    results.set_result(tr, 'cbr', 33.21)
+    assert (tr.result_value, tr.result_unit, tr.result_kind) == (33.21, '%', 'cbr')
+    assert tr.calc_version
+    assert tr.calculated_result == 'CBR = 33.21%' == results.format_result(tr)
+
+
+def test_format_result_falls_back_to_legacy_string():
+    tr = TestResult(test_name='Compressive Strength', calculated_result='12.000 MPa')
+    assert results.format_result(tr) == '12.000 MPa'
+
+
+def test_strength_statistics_single_aggregate(app):
+    site = Project(project_code='S-1', project_name='Site')
+    myapp.db.session.add(site)
+    myapp.db.session.flush()
+    sample = Sample(sample_id='S-1-A', sample_type='Concrete', project_id=site.id)
+    myapp.db.session.add(sample)
+    myapp.db.session.flush()
+    for strength in (20.0, 25.0, 30.0):
+        tr = TestResult(sample_id=sample.id, test_name='Compressive Strength')
+        results.set_result(tr, 'compressive', strength)
+        myapp.db.session.add(tr)
+    myapp.db.session.add(TestResult(sample_id=sample.id, test_name='Compressive Strength'))
+    myapp.db.session.commit()
+
+    stats = results.result_statistics('Compressive Strength', project_id=site.id)
+    assert stats == {'count': 3, 'avg': 25.0, 'min': 20.0, 'max': 30.0}
+
+
+def test_schema_upgrade_adds_missing_columns(tmp_path):
+    import sqlite3
+    from sqlalchemy import create_engine
+    import schema_upgrade
+
+    path = tmp_path / 'legacy.db'
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE test_results (id INTEGER PRIMARY KEY, sample_id INTEGER NOT NULL, '
+                 'test_name VARCHAR(120) NOT NULL, raw_values TEXT, calculated_result TEXT)')
+    conn.commit()
+    conn.close()
+
+    engine = create_engine(f'sqlite:///{path}')
+    myapp.db.metadata.create_all(engine)  # leaves the existing table alone
+    statements = schema_upgrade.add_missing_columns(myapp.db.metadata, engine)
+    assert any('ADD COLUMN result_value' in s for s in statements)
+    assert any('ix_test_results_name_value' in s for s in statements)
+    assert schema_upgrade.add_missing_columns(myapp.db.metadata, engine) == []
+    engine.dispose()
+
+
+def test_importing_the_app_upgrades_an_existing_database(tmp_path):
+    import sqlite3
+    import subprocess
+    import sys
+
+    path = tmp_path / 'legacy.db'
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE test_results (id INTEGER PRIMARY KEY, sample_id INTEGER NOT NULL, '
+                 'test_name VARCHAR(120) NOT NULL, raw_values TEXT, calculated_result TEXT)')
+    conn.commit()
+    conn.close()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, DATABASE_URI=f'sqlite:///{path}', AUDIT_BUFFERED='false', REPORT_WORKERS='0')
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=tmp_path, env=dict(env, PYTHONPATH=root), check=True)
+    conn = sqlite3.connect(path)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(test_results)')}
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    assert 'result_value' in columns and {'samples', 'report_jobs', 'stats_counters'} <= tables
@@ -0,0 +1,176 @@
+"""
+Tests for the indexed sample search (FTS5 and trigram-table backends)
+"""
+import os
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import search
+from models import Project, Sample, TestResult, SearchGram
+
+
+@pytest.fixture(params=['fts5', 'ngram'])
+def app(request, monkeypatch):
+    monkeypatch.setattr(search, 'BACKEND', request.param)
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        yield myapp.app
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _seed():
+    session = myapp.db.session
+    bridge = Project(project_code='BR-1', project_name='Harbour Bridge', client_name='Metro Rail')
+    session.add(bridge)
+    session.flush()
+    a = Sample(sample_id='CUBE-0001', sample_type='Concrete', project_id=bridge.id)
+    b = Sample(sample_id='SOIL-0002', sample_type='Soil', client_name='Acme_Corp')
+    session.add_all([a, b])
+    session.flush()
+    session.add(TestResult(sample_id=b.id, test_name='CBR Test'))
+    session.commit()
+    return bridge, a, b
+
+
+def _ids(term):
+    hits = search.matches(myapp.db.session, term)
+    return {row[0] for row in myapp.db.session.execute(hits.select())}
+
+
+def _login():
+    from models import User
+    admin = User(username='search-admin', role='Admin')
+    admin.set_password('pw')
+    myapp.db.session.add(admin)
+    myapp.db.session.commit()
+    client = myapp.app.test_client()
+    client.post('/login', data={'username': 'search-admin', 'password': 'pw'})
+    return client
+
+
+
+def test_search_covers_all_fields(app):
+    bridge, a, b = _seed()
+    assert _ids('cube-00') == {a.id}
+    assert _ids('harbour') == {a.id}
+    assert _ids('METRO') == {a.id}
+    assert _ids('acme_corp') == {b.id}
+    assert _ids('cbr') == {b.id}
+    assert _ids('0') == {a.id, b.id}
+    assert _ids('soil cbr') == {b.id}
+    assert _ids('soil harbour') == set()
+    assert _ids('acme%') == set()
+    assert search.matches(myapp.db.session, '   ') is None
+
+
+def test_index_follows_orm_changes(app):
+    bridge, a, b = _seed()
+    bridge.project_name = 'Tunnel Works'
+    myapp.db.session.commit()
+    assert _ids('tunnel') == {a.id}
+    assert _ids('harbour') == set()
+
+    myapp.db.session.add(TestResult(sample_id=a.id, test_name='Compressive Strength'))
+    myapp.db.session.commit()
+    assert _ids('compressive') == {a.id}
+
+    myapp.db.session.delete(b.tests[0])
+    myapp.db.session.commit()
+    assert _ids('cbr') == set()
+
+    myapp.db.session.delete(b)
+    myapp.db.session.commit()
+    assert _ids('soil') == set()
+
+
+def test_rebuild_recovers_from_bulk_changes(app):
+    bridge, a, b = _seed()
+    Sample.query.filter_by(id=a.id).update({'sample_id': 'CORE-0009'})
+    myapp.db.session.commit()
+    assert _ids('core') == set()
+    assert search.rebuild(myapp.db.session, chunk_size=1) == 2
+    assert _ids('core') == {a.id}
+    assert _ids('cube') == set()
+
+
+def test_ngram_postings(app):
+    if search.BACKEND != 'ngram':
+        pytest.skip('trigram table is only filled by the ngram backend')
+    _, a, _ = _seed()
+    assert SearchGram.query.filter_by(gram='cub', sample_id=a.id).count() == 1
+    assert search.trigrams('Ab Cdef') == {'cde', 'def'}
+
+
+def test_samples_page_uses_index(app):
+    _seed()
+    client = _login()
+    html = client.get('/samples?search=bridge').get_data(as_text=True)
+    assert 'CUBE-0001' in html and 'SOIL-0002' not in html
+    html = client.get('/samples?search=cbr&type=Concrete').get_data(as_text=True)
+    assert 'SOIL-0002' not in html
+
+def test_project_filter_searches_the_project_field(app):
+    bridge, a, b = _seed()
+    legacy = Sample(sample_id='CUBE-0003', sample_type='Concrete', project_name='Old Harbour Wall')
+    myapp.db.session.add(legacy)
+    myapp.db.session.commit()
+    hits = search.matches(myapp.db.session, 'harbour', field='project_name')
+    assert {row[0] for row in myapp.db.session.execute(hits.select())} == {a.id, legacy.id}
+    # 'Metro' is the project's client, not its name; 'cube' is a sample id
+    for term in ('metro', 'cube', 'rt'):
+        hits = search.matches(myapp.db.session, term, field='project_name')
+        assert list(myapp.db.session.execute(hits.select())) == []
+    with pytest.raises(ValueError):
+        search.matches(myapp.db.session, 'cbr', field='test_names')
+
+
+def test_project_filter_on_samples_page_and_export(app):
+    _seed()
+    client = _login()
+    html = client.get('/samples?project=harbour').get_data(as_text=True)
+    assert 'CUBE-0001' in html and 'SOIL-0002' not in html
+    html = client.get('/samples?search=cube&project=harbour').get_data(as_text=True)
+    assert 'CUBE-0001' in html
+    csv = client.get('/export/samples?format=csv&project=harbour').get_data(as_text=True)
+    assert 'CUBE-0001' in csv and 'SOIL-0002' not in csv
+
+
+
+def test_search_results_page_through_every_match(app):
+    import pagination
+    session = myapp.db.session
+    session.add_all([Sample(sample_id=f'CUBE-{n:04d}', sample_type='Concrete') for n in range(7)])
+    session.add_all([Sample(sample_id='CUBE-0100-CUBE', sample_type='Concrete'), Sample(sample_id='SOIL-0100', sample_type='Soil')])
+    session.commit()
+    hits = search.matches(session, 'cube')
+    query = Sample.query.join(hits, hits.c.sample_id == Sample.id)
+    ranked = [s.id for s in query.order_by(hits.c.rank, Sample.id.desc())]
+
+    pages, after = [], None
+    while True:
+        page = pagination.paginate_ranked(query, hits.c.rank, Sample.id, after=after, page_size=3)
+        pages.append([s.id for s in page])
+        if not page.has_next:
+            break
+        after = page.next_cursor
+    assert sum(pages, []) == ranked and len(ranked) == 8
+    back = pagination.paginate_ranked(query, hits.c.rank, Sample.id, before=pages[-1][0], page_size=3)
+    assert [s.id for s in back] == pages[-2] and back.has_next and back.has_prev
+    # A cursor that no longer matches starts from the best matches again
+    first = pagination.paginate_ranked(query, hits.c.rank, Sample.id, after=10 ** 6, page_size=3)
+    assert [s.id for s in first] == pages[0] and not first.has_prev
+
+
+def test_samples_page_links_to_more_search_results(app):
+    myapp.db.session.add_all([Sample(sample_id=f'CUBE-{n:04d}', sample_type='Concrete') for n in range(4)])
+    myapp.db.session.commit()
+    client = _login()
+    html = client.get('/samples?search=cube&per_page=3').get_data(as_text=True)
+    assert html.count('CUBE-000') == 3 and 'after=' in html
@@ -0,0 +1,109 @@
+"""
+Tests for the incrementally maintained dashboard counters
+"""
+import os
+
+import pytest
+
+os.environ['DATABASE_URI'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret'
+
+import app as myapp
+import stats
+from models import Project, Sample, TestResult, StatCounter
+
+
+@pytest.fixture
+def app():
+    myapp.app.config['TESTING'] = True
+    myapp.app.config['WTF_CSRF_ENABLED'] = False
+    with myapp.app.app_context():
+        myapp.db.create_all()
+        yield myapp.app
+        myapp.db.session.remove()
+        myapp.db.drop_all()
+
+
+def _counters():
+    return stats.counters(myapp.db.session)
+
+
+def test_counters_follow_inserts_status_changes_and_deletes(app):
+    session = myapp.db.session
+    assert _counters() == dict.fromkeys(stats.COUNTERS, 0)
+
+    project = Project(project_code='ST-1', project_name='Stats')
+    sample = Sample(sample_id='ST-S1', sample_type='Soil', project=project)
+    session.add_all([project, sample])
+    session.flush()
+    first = TestResult(sample_id=sample.id, test_name='CBR Test')
+    second = TestResult(sample_id=sample.id, test_name='CBR Test', status='Approved')
+    session.add_all([first, second])
+    session.commit()
+    assert _counters() == {'projects': 1, 'samples': 1, 'tests': 2, 'tests_pending': 1, 'tests_approved': 1}
+
+    first.status = 'Approved'
+    second.status = 'Rejected'
+    session.commit()
+    assert _counters()['tests_pending'] == 0
+    assert _counters()['tests_approved'] == 1
+
+    session.delete(first)
+    session.commit()
+    assert _counters() == {'projects': 1, 'samples': 1, 'tests': 1, 'tests_pending': 0, 'tests_approved': 0}
+    assert _counters() == stats.true_counts(session.connection())
+
+
+def test_rolled_back_changes_do_not_count(app):
+    myapp.db.session.add(Project(project_code='ST-2', project_name='Rolled back'))
+    myapp.db.session.flush()
+    myapp.db.session.rollback()
+    assert _counters()['projects'] == 0
+
+
+def test_reconcile_fixes_drift_and_missing_rows(app):
+    session = myapp.db.session
+    session.add(Project(project_code='ST-3', project_name='Bulk'))
+    session.commit()
+    Project.query.delete()  # bypasses the ORM events
+    session.commit()
+    assert _counters()['projects'] == 1
+    assert stats.reconcile(session) == {'projects': -1}
+    session.commit()
+    assert _counters()['projects'] == 0
+
+    StatCounter.query.delete()
+    session.commit()
+    assert _counters() == dict.fromkeys(stats.COUNTERS, 0)
+    assert StatCounter.query.count() == len(stats.COUNTERS)
+
+
+def test_reconcile_locks_the_counter_rows_before_counting(app):
+    from sqlalchemy.dialects import mysql
+    conn = myapp.db.session.connection()
+    statements = []
+
+    class Recording:
+        def execute(self, statement, *args, **kwargs):
+            statements.append(str(statement.compile(dialect=mysql.dialect())))
+            return conn.execute(statement, *args, **kwargs)
+    stats._reconcile(Recording())
+    assert 'stats_counters' in statements[0] and statements[0].endswith('FOR UPDATE')
+    assert 'count(*)' in statements[1]
+
+
+def test_deltas_update_the_counters_in_name_order(app):
+    from sqlalchemy.dialects import mysql
+    conn = myapp.db.session.connection()
+    names = []
+
+    class Recording:
+        def execute(self, statement, *args, **kwargs):
+            names.append(statement.compile(dialect=mysql.dialect()).params['name_1'])
+            return conn.execute(statement, *args, **kwargs)
+
+    class Session:
+        def connection(self):
+            return Recording()
+    stats.add(Session(), {'tests_pending': 1, 'tests_approved': -1, 'samples': 2, 'projects': 0})
+    assert names == ['samples', 'tests_approved', 'tests_pending']